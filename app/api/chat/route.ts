@@ -1,6 +1,7 @@
 import { NextRequest, NextResponse } from 'next/server';
 import { auth } from '@clerk/nextjs';
-import { spawn } from 'child_process';
+
+const CHATBOT_SERVER_URL = process.env.CHATBOT_SERVER_URL || 'http://127.0.0.1:8001';
 
 export async function POST(req: NextRequest) {
   const { userId } = auth();
@@ -8,24 +9,34 @@ export async function POST(req: NextRequest) {
     return NextResponse.json({ error: 'Unauthorized' }, { status: 401 });
   }
 
-  const { message } = await req.json();
-
-  return new Promise((resolve) => {
-    const python = spawn('python', ['backend/chatbot.py', userId, message]);
+  const { message, stream } = await req.json();
 
-    let botResponse = '';
-
-    python.stdout.on('data', (data) => {
-      botResponse += data.toString();
+  try {
+    const response = await fetch(`${CHATBOT_SERVER_URL}/chat`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ clerkUserId: userId, message, stream: Boolean(stream) }),
     });
 
-    python.stderr.on('data', (data) => {
-      console.error(`Error: ${data}`);
-    });
+    if (stream && response.ok && response.body) {
+      // Pass the server-sent events through as they arrive
+      return new Response(response.body, {
+        headers: {
+          'Content-Type': 'text/event-stream',
+          'Cache-Control': 'no-cache',
+        },
+      });
+    }
 
-    python.on('close', (code) => {
-      console.log(`Child process exited with code ${code}`);
-      resolve(NextResponse.json({ message: botResponse.trim() }));
-    });
-  });
-}
\ No newline at end of file
+    const data = await response.json();
+    if (!response.ok) {
+      console.error('Chatbot server error:', data.error);
+      return NextResponse.json({ error: 'Error processing message' }, { status: response.status });
+    }
+
+    return NextResponse.json({ message: data.response });
+  } catch (error) {
+    console.error('Error contacting chatbot server:', error);
+    return NextResponse.json({ error: 'Chatbot server unavailable' }, { status: 503 });
+  }
+}
@@ -1,7 +1,7 @@
 import { NextRequest, NextResponse } from 'next/server';
 import { auth } from '@clerk/nextjs';
-import prisma from 'lib/prisma';
-import { spawn } from 'child_process';
+
+const CHATBOT_SERVER_URL = process.env.CHATBOT_SERVER_URL || 'http://127.0.0.1:8001';
 
 export async function POST(req: NextRequest) {
   console.log("Health analysis API route called");
@@ -12,67 +12,34 @@ export async function POST(req: NextRequest) {
       return NextResponse.json({ error: 'Unauthorized' }, { status: 401 });
     }
 
-    // Create a new task in the database
-    let task;
+    // The chatbot server returns the analysis already stored for the user's
+    // current results, or the ID of the task computing it. Tasks are recorded
+    // in the Task table and can be polled through /api/task-status.
+    let response;
     try {
-      task = await prisma.task.create({
-        data: {
-          userId,
-          status: 'processing',
-        },
+      response = await fetch(`${CHATBOT_SERVER_URL}/health-analysis/jobs`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ clerkUserId: userId }),
       });
-    } catch (dbError) {
-      console.error('Database error:', dbError);
-      return NextResponse.json({ error: 'Database error' }, { status: 500 });
+    } catch (error) {
+      console.error('Chatbot server unavailable:', error);
+      return NextResponse.json({ error: 'Health analysis service unavailable' }, { status: 503 });
     }
 
-    // Spawn the Python script as a background process
-    const python = spawn('python', ['backend/chatbot.py', userId, 'health_analysis']);
-
-    python.stdout.on('data', async (data) => {
-      const output = data.toString().trim();
-      console.log('Python script output:', output);
-      
-      if (output.includes('HEALTH_ANALYSIS_START') && output.includes('HEALTH_ANALYSIS_END')) {
-        const healthAnalysis = output.split('HEALTH_ANALYSIS_START\n')[1].split('\nHEALTH_ANALYSIS_END')[0];
-        try {
-          await prisma.task.update({
-            where: { id: task.id },
-            data: {
-              status: 'success',
-              result: healthAnalysis,
-            },
-          });
-        } catch (updateError) {
-          console.error('Error updating task:', updateError);
-        }
-      }
-    });
-
-    python.stderr.on('data', (data) => {
-      console.log('Python script log:', data.toString());
-    });
+    const data = await response.json();
+    if (!response.ok) {
+      return NextResponse.json({ error: data.error || `Chatbot server returned ${response.status}` }, { status: 502 });
+    }
 
-    python.on('close', async (code) => {
-      console.log(`Python script exited with code ${code}`);
-      if (code !== 0) {
-        try {
-          await prisma.task.update({
-            where: { id: task.id },
-            data: {
-              status: 'error',
-              result: `Process exited with code ${code}`,
-            },
-          });
-        } catch (updateError) {
-          console.error('Error updating task:', updateError);
-        }
-      }
+    return NextResponse.json({
+      taskId: data.taskId,
+      status: data.status,
+      result: data.result ?? null,
+      message: data.status === 'success' ? 'Health analysis ready' : 'Health analysis generation started',
     });
-
-    return NextResponse.json({ taskId: task.id, message: 'Health analysis generation started' });
   } catch (error) {
     console.error('Error:', error);
     return NextResponse.json({ error: 'An error occurred while processing the request' }, { status: 500 });
   }
-}
\ No newline at end of file
+}
@@ -31,6 +31,10 @@ export async function POST() {
 
     // Parse the output from the Python script
     const processedData = JSON.parse(stdout);
+    if (processedData.error === 'busy') {
+      // Report parsing is at its limit across all backend processes
+      return NextResponse.json({ error: 'busy' }, { status: 503, headers: { 'Retry-After': '5' } });
+    }
     console.log('Processed data from Python script:', processedData);
 
     // Encrypt the processed data and raw attachments
@@ -41,6 +41,10 @@ export async function POST(req: Request) {
   
       // Parse the output from the Python script
       const processedData = JSON.parse(stdout);
+      if (processedData.error === 'busy') {
+        // Report parsing is at its limit across all backend processes
+        return NextResponse.json({ error: 'busy' }, { status: 503, headers: { 'Retry-After': '5' } });
+      }
   
       // Decrypt existing data if available
       let existingData = [];
@@ -39,24 +39,53 @@ const ChatPage: React.FC = () => {
             'Content-Type': 'application/json',
             'Authorization': `Bearer ${token}`
           },
-          body: JSON.stringify({ message: input }),
+          body: JSON.stringify({ message: input, stream: true }),
         });
 
-        if (!response.ok) {
+        if (!response.ok || !response.body) {
           throw new Error('Failed to send message');
         }
 
-        const data = await response.json();
-        setMessages((prevMessages) => [
-          ...prevMessages,
-          { content: data.message, type: 'bot' },
-        ]);
+        // Render the answer as it streams in: one server-sent event per chunk,
+        // then a final "done" frame with timings.
+        setMessages((prevMessages) => [...prevMessages, { content: '', type: 'bot' }]);
+        const appendToLastMessage = (text: string) => {
+          setMessages((prevMessages) => {
+            const updated = [...prevMessages];
+            const last = updated[updated.length - 1];
+            updated[updated.length - 1] = { ...last, content: last.content + text };
+            return updated;
+          });
+        };
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        while (true) {
+          const { done, value } = await reader.read();
+          if (done) break;
+          buffer += decoder.decode(value, { stream: true });
+          const events = buffer.split('\n\n');
+          buffer = events.pop() || '';
+          for (const event of events) {
+            if (!event.startsWith('data: ')) continue;
+            const frame = JSON.parse(event.slice('data: '.length));
+            if (frame.type === 'chunk') {
+              appendToLastMessage(frame.content);
+            } else if (frame.type === 'error') {
+              throw new Error(frame.error);
+            } else if (frame.type === 'done') {
+              console.log('Chat response timings:', frame.timings);
+            }
+          }
+        }
       } catch (error) {
         console.error('Error sending message:', error);
-        setMessages((prevMessages) => [
-          ...prevMessages,
-          { content: 'Sorry, there was an error processing your message.', type: 'bot' },
-        ]);
+        // The chatbot server turns requests away with "busy" when its queues are full
+        const content = error.message === 'busy'
+          ? 'The assistant is busy right now. Please try again in a moment.'
+          : 'Sorry, there was an error processing your message.';
+        setMessages((prevMessages) => [...prevMessages, { content, type: 'bot' }]);
       } finally {
         setIsLoading(false);
       }
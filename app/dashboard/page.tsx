@@ -42,7 +42,10 @@ export default function Dashboard() {
       const result = await response.json();
       console.log("Health analysis task started:", result);
       
-      if (result.taskId) {
+      if (result.status === 'success') {
+        // Precomputed for the current results
+        setHealthAnalysis(result.result);
+      } else if (result.taskId) {
         pollTaskStatus(result.taskId);
       } else {
         setError("Failed to start health analysis task");
@@ -0,0 +1,158 @@
+from typing import Dict, List, Tuple
+
+import numpy as np
+from models import ANALYTES
+
+# Adult reference ranges in the units listed in models.ANALYTES. Where men and
+# women differ the union of both ranges is used.
+REFERENCE_RANGES = {
+    'WBC': (4.0, 11.0),
+    'RBC': (4.2, 6.1),
+    'HGB': (12.1, 17.2),
+    'HCT': (36.0, 50.0),
+    'MCV': (80.0, 100.0),
+    'MCH': (27.0, 33.0),
+    'MCHC': (32.0, 36.0),
+    'PLT': (150.0, 400.0),
+    'LYM_percent': (20.0, 40.0),
+    'MXD_percent': (3.0, 15.0),
+    'NEUT_percent': (40.0, 75.0),
+    'LYM_count': (1.0, 4.0),
+    'MXD_count': (0.1, 1.5),
+    'NEUT_count': (1.8, 7.7),
+    'RDW_SD': (37.0, 54.0),
+    'RDW_CV': (11.5, 14.5),
+    'PDW': (9.0, 17.0),
+    'MPV': (7.5, 12.5),
+    'P_LCR': (13.0, 43.0),
+    'PCT': (0.17, 0.35),
+}
+
+DAYS_PER_MONTH = 30.44
+# How far ahead a trend is projected when checking whether it will leave the range
+PROJECTION_MONTHS = 3.0
+# Minimum reports before slopes and z-scores are reported
+MIN_TREND_POINTS = 3
+
+
+def _last_valid(valid: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Index of the last True per column and whether the column has any True."""
+    has_any = np.asarray(valid.any(axis=0))
+    last = valid.shape[0] - 1 - np.argmax(valid[::-1], axis=0)
+    return last, has_any
+
+
+def analyze(dates: np.ndarray, analytes: List[str], values: np.ndarray) -> Dict[str, np.ndarray]:
+    """Compute per-analyte range flags, deltas, slopes and z-scores in one pass over the matrix.
+
+    Returns a dict of arrays aligned with analytes. NaN marks a statistic that
+    cannot be computed, e.g. a slope from fewer than MIN_TREND_POINTS reports.
+    """
+    n_reports, n_analytes = values.shape
+    columns = np.arange(n_analytes)
+    low = np.array([REFERENCE_RANGES[a][0] for a in analytes])
+    high = np.array([REFERENCE_RANGES[a][1] for a in analytes])
+
+    valid = ~np.isnan(values)
+    count = valid.sum(axis=0)
+    nan_row = np.full(n_analytes, np.nan)
+
+    if n_reports == 0:
+        empty = nan_row.copy()
+        return {
+            "count": count, "latest": empty, "previous": empty, "earlier": empty,
+            "low": low, "high": high, "flag": np.zeros(n_analytes, dtype=int),
+            "out_of_range_count": np.zeros(n_analytes, dtype=int), "delta": empty,
+            "delta_percent": empty, "slope_per_month": empty, "zscore": empty,
+            "worsening": np.zeros(n_analytes, dtype=bool),
+        }
+
+    # Latest value and the two before it, per analyte
+    remaining = valid.copy()
+    picked = []
+    for _ in range(3):
+        index, has = _last_valid(remaining)
+        picked.append(np.where(has, values[index, columns], np.nan))
+        remaining[index[has], columns[has]] = False
+    latest, previous, earlier = picked
+
+    flag = np.where(latest < low, -1, np.where(latest > high, 1, 0))
+    out_of_range_count = (valid & ((values < low) | (values > high))).sum(axis=0)
+
+    delta = latest - previous
+    with np.errstate(divide="ignore", invalid="ignore"):
+        delta_percent = np.where(previous != 0, delta / np.abs(previous) * 100, np.nan)
+
+    # Least-squares slope against time for every column at once, ignoring NaNs
+    months = (dates - dates[0]).astype(float)[:, None] / DAYS_PER_MONTH
+    x = np.where(valid, months, 0.0)
+    y = np.where(valid, values, 0.0)
+    sx, sy = x.sum(axis=0), y.sum(axis=0)
+    sxx, sxy = (x * x).sum(axis=0), (x * y).sum(axis=0)
+    denominator = count * sxx - sx * sx
+    with np.errstate(divide="ignore", invalid="ignore"):
+        slope = np.where((count >= MIN_TREND_POINTS) & (denominator > 0), (count * sxy - sx * sy) / denominator, np.nan)
+
+        # Latest value relative to the user's own history
+        mean = sy / np.maximum(count, 1)
+        variance = np.where(valid, (values - mean) ** 2, 0.0).sum(axis=0) / np.maximum(count - 1, 1)
+        std = np.sqrt(variance)
+        zscore = np.where((count >= MIN_TREND_POINTS) & (std > 0), (latest - mean) / std, np.nan)
+
+    # Worsening: out of range and moving further away, or in range but
+    # projected to leave it within PROJECTION_MONTHS at the current slope.
+    moving_away = ((flag == -1) & (delta < 0)) | ((flag == 1) & (delta > 0))
+    projected = latest + np.nan_to_num(slope) * PROJECTION_MONTHS
+    leaving = (flag == 0) & ~np.isnan(slope) & ((projected < low) | (projected > high))
+    worsening = moving_away | leaving
+
+    return {
+        "count": count,
+        "latest": latest,
+        "previous": previous,
+        "earlier": earlier,
+        "low": low,
+        "high": high,
+        "flag": flag,
+        "out_of_range_count": out_of_range_count,
+        "delta": delta,
+        "delta_percent": delta_percent,
+        "slope_per_month": slope,
+        "zscore": zscore,
+        "worsening": worsening,
+    }
+
+
+def _fmt(value: float) -> str:
+    return "-" if np.isnan(value) else f"{value:.3g}"
+
+
+def summarize(dates: np.ndarray, analytes: List[str], values: np.ndarray) -> str:
+    """Render the analysis as a compact table for the LLM prompt."""
+    if values.shape[0] == 0:
+        return "No blood test results available."
+    stats = analyze(dates, analytes, values)
+    flag_names = {-1: "LOW", 0: "ok", 1: "HIGH"}
+    lines = [
+        f"Reports: {values.shape[0]} ({dates[0]} to {dates[-1]})",
+        "analyte|unit|latest|prev|prev2|range|flag|delta%|slope/mo|z|out-of-range reports|trend",
+    ]
+    for i, analyte in enumerate(analytes):
+        if stats["count"][i] == 0:
+            continue
+        lines.append("|".join([
+            ANALYTES[analyte][0],
+            ANALYTES[analyte][1],
+            _fmt(stats["latest"][i]),
+            _fmt(stats["previous"][i]),
+            _fmt(stats["earlier"][i]),
+            f"{_fmt(stats['low'][i])}-{_fmt(stats['high'][i])}",
+            flag_names[int(stats["flag"][i])],
+            _fmt(stats["delta_percent"][i]),
+            _fmt(stats["slope_per_month"][i]),
+            _fmt(stats["zscore"][i]),
+            f"{stats['out_of_range_count'][i]}/{stats['count'][i]}",
+            "WORSENING" if stats["worsening"][i] else "stable",
+        ]))
+    return "\n".join(lines)
+
@@ -0,0 +1,163 @@
+import asyncio
+import logging
+import os
+import uuid
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, Optional, Set, Tuple
+
+import httpx
+from dotenv import load_dotenv
+from results_store import results_version
+from supabase import create_client
+
+load_dotenv()
+
+url = os.environ.get("NEXT_PUBLIC_SUPABASE_URL")
+key = os.environ.get("NEXT_PUBLIC_SUPABASE_ANON_KEY")
+supabase = create_client(url, key)
+
+CHATBOT_SERVER_URL = os.environ.get("CHATBOT_SERVER_URL", "http://127.0.0.1:8001")
+HEALTH_ANALYSIS = "health_analysis"
+
+
+def create_task(clerk_user_id: str, kind: str, version: str) -> str:
+    # Task ids and updatedAt are filled in by Prisma on the Next.js side, so set them here
+    task_id = str(uuid.uuid4())
+    supabase.table("Task").insert({
+        "id": task_id,
+        "userId": clerk_user_id,
+        "kind": kind,
+        "resultsVersion": version,
+        "status": "processing",
+        "updatedAt": datetime.utcnow().isoformat(),
+    }).execute()
+    return task_id
+
+
+def update_task(task_id: str, status: str, result: Optional[str]):
+    supabase.table("Task").update({
+        "status": status,
+        "result": result,
+        "updatedAt": datetime.utcnow().isoformat(),
+    }).eq("id", task_id).execute()
+
+
+def latest_result(clerk_user_id: str, kind: str, version: str) -> Optional[Dict]:
+    """The newest successful task computed from this results version, if any."""
+    response = (
+        supabase.table("Task")
+        .select("id, status, result")
+        .eq("userId", clerk_user_id)
+        .eq("kind", kind)
+        .eq("resultsVersion", version)
+        .eq("status", "success")
+        .order("createdAt", desc=True)
+        .limit(1)
+        .execute()
+    )
+    return response.data[0] if response.data else None
+
+
+def fail_abandoned_tasks(kind: str):
+    """Mark tasks left in 'processing' by a previous server process as failed."""
+    supabase.table("Task").update({
+        "status": "error",
+        "result": "Interrupted by a server restart",
+        "updatedAt": datetime.utcnow().isoformat(),
+    }).eq("kind", kind).eq("status", "processing").execute()
+
+
+class AnalysisJobRunner:
+    """Runs one kind of per-user analysis in the background and records it in the Task table.
+
+    submit() returns the stored result when one exists for the user's current
+    results version. Otherwise it starts a job, or joins the one already
+    running for that user and version, and returns its task id to poll.
+    Must be used from a single event loop.
+    """
+
+    def __init__(self, compute: Callable[[str], Awaitable[str]], kind: str = HEALTH_ANALYSIS):
+        self.compute = compute
+        self.kind = kind
+        self._inflight: Dict[str, Tuple[str, str]] = {}  # user -> (task id, results version)
+        # Per-user locks live only while a submit for that user is waiting or running
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._waiting: Dict[str, int] = {}
+        # The loop only keeps weak references to tasks, so hold them until they finish
+        self._tasks: Set[asyncio.Task] = set()
+        self.started = 0
+        self.deduplicated = 0
+        self.served_stored = 0
+
+    async def submit(self, clerk_user_id: str, force: bool = False) -> Dict:
+        lock = self._locks.setdefault(clerk_user_id, asyncio.Lock())
+        self._waiting[clerk_user_id] = self._waiting.get(clerk_user_id, 0) + 1
+        try:
+            async with lock:
+                return await self._submit(clerk_user_id, force)
+        finally:
+            self._waiting[clerk_user_id] -= 1
+            if not self._waiting[clerk_user_id]:
+                del self._waiting[clerk_user_id]
+                del self._locks[clerk_user_id]
+
+    async def _submit(self, clerk_user_id: str, force: bool) -> Dict:
+        loop = asyncio.get_running_loop()
+        version = await loop.run_in_executor(None, results_version, clerk_user_id)
+
+        inflight = self._inflight.get(clerk_user_id)
+        if inflight is not None and inflight[1] == version:
+            self.deduplicated += 1
+            return {"taskId": inflight[0], "status": "processing"}
+
+        if not force:
+            stored = await loop.run_in_executor(None, latest_result, clerk_user_id, self.kind, version)
+            if stored is not None:
+                self.served_stored += 1
+                return {"taskId": stored["id"], "status": stored["status"], "result": stored["result"]}
+
+        task_id = await loop.run_in_executor(None, create_task, clerk_user_id, self.kind, version)
+        self._inflight[clerk_user_id] = (task_id, version)
+        self.started += 1
+        task = loop.create_task(self._run(clerk_user_id, task_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return {"taskId": task_id, "status": "processing"}
+
+    async def _run(self, clerk_user_id: str, task_id: str):
+        loop = asyncio.get_running_loop()
+        try:
+            result = await self.compute(clerk_user_id)
+            status = "success"
+            logging.info(f"Computed {self.kind} for user {clerk_user_id} in task {task_id}")
+        except Exception as e:
+            logging.error(f"Error computing {self.kind} for user {clerk_user_id}: {e}")
+            result, status = str(e), "error"
+        try:
+            await loop.run_in_executor(None, update_task, task_id, status, result)
+        except Exception as e:
+            logging.error(f"Error updating task {task_id}: {e}")
+        finally:
+            # Released only once the result is stored, so a submit in between
+            # finds either this job or its result. A newer job may have
+            # replaced this one after the results changed.
+            if self._inflight.get(clerk_user_id, (None,))[0] == task_id:
+                del self._inflight[clerk_user_id]
+
+    def stats(self) -> dict:
+        return {
+            "running": len(self._inflight),
+            "started": self.started,
+            "deduplicated": self.deduplicated,
+            "served_stored": self.served_stored,
+        }
+
+
+def request_health_analysis(clerk_user_id: str):
+    """Ask the chatbot server to precompute a user's health analysis; used after new reports are stored."""
+    try:
+        response = httpx.post(f"{CHATBOT_SERVER_URL}/health-analysis/jobs", json={"clerkUserId": clerk_user_id}, timeout=30.0)
+        response.raise_for_status()
+        logging.info(f"Requested health analysis for user {clerk_user_id}: task {response.json().get('taskId')}")
+    except Exception as e:
+        logging.warning(f"Could not request health analysis for user {clerk_user_id}: {e}")
@@ -0,0 +1,69 @@
+import argparse
+import statistics
+import sys
+import time
+
+from chatbot import MedicalChatbot, format_documents, get_blood_test_results
+from langchain.chains import create_retrieval_chain
+from langchain_core.prompts import ChatPromptTemplate
+
+QUESTIONS = [
+    "What does a low hemoglobin level mean?",
+    "Is my white blood cell count normal?",
+    "How has my platelet count changed over time?",
+    "What could cause a high MCV?",
+]
+
+
+def time_calls(fn, questions, iterations):
+    timings = []
+    for _ in range(iterations):
+        for question in questions:
+            start = time.perf_counter()
+            fn(question)
+            timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def report(name, timings):
+    timings = sorted(timings)
+    p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+    print(f"{name:<32} mean {statistics.mean(timings):8.1f} ms  p50 {statistics.median(timings):8.1f} ms  p95 {p95:8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the per-turn context stage before and after direct retrieval")
+    parser.add_argument("clerk_user_id")
+    parser.add_argument("--iterations", type=int, default=5)
+    args = parser.parse_args()
+
+    chatbot = MedicalChatbot(args.clerk_user_id, get_blood_test_results(args.clerk_user_id))
+
+    # The previous context stage: a retrieval chain with a prompt where a
+    # combine-documents chain belongs, whose "answer" was used as context.
+    retrieval_prompt = ChatPromptTemplate.from_template("Please retrieve information relevant to: {input}")
+    retrieval_chain = create_retrieval_chain(chatbot.retriever, retrieval_prompt)
+    def legacy_context(question):
+        return retrieval_chain.invoke({"input": question})["answer"]
+
+    def direct_context(question):
+        return format_documents(chatbot.retriever.invoke(question))
+
+    def all_inputs(question):
+        return chatbot.prompt_inputs.invoke({"question": question})
+
+    # Warm the embedder and connections before timing
+    direct_context(QUESTIONS[0])
+
+    legacy = time_calls(legacy_context, QUESTIONS, args.iterations)
+    direct = time_calls(direct_context, QUESTIONS, args.iterations)
+    gathered = time_calls(all_inputs, QUESTIONS, args.iterations)
+
+    report("legacy retrieval chain", legacy)
+    report("direct retrieval", direct)
+    report("all prompt inputs (parallel)", gathered)
+    print(f"Saved per turn (mean): {statistics.mean(legacy) - statistics.mean(direct):.1f} ms")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
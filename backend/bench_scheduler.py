@@ -0,0 +1,71 @@
+import argparse
+import asyncio
+import json
+import random
+from collections import Counter
+
+from scheduler import BACKGROUND, INTERACTIVE, Busy, Scheduler
+
+# Drives the scheduler with a stubbed LLM (a sleep) to check limits,
+# priorities, per-user fairness and admission control without Ollama.
+
+
+class StubLLM:
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.active = 0
+        self.peak = 0
+
+    async def generate(self):
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            await asyncio.sleep(self.latency * random.uniform(0.5, 1.5))
+        finally:
+            self.active -= 1
+
+
+async def simulate(args):
+    scheduler = Scheduler(llm=args.concurrency, max_waiting=args.max_waiting)
+    queue = scheduler["llm"]
+    llm = StubLLM(args.latency)
+    served, busy = Counter(), Counter()
+
+    async def request(user: str, priority: int):
+        try:
+            await queue.run(user, priority, llm.generate)
+            served[(user, priority)] += 1
+        except Busy:
+            busy[user] += 1
+
+    jobs = []
+    # One heavy background user (e.g. a large mailbox sync) submitting everything at once
+    jobs += [request("sync-user", BACKGROUND) for _ in range(args.background)]
+    # Interactive users arriving over time
+    for _ in range(args.requests):
+        await asyncio.sleep(random.expovariate(args.rate))
+        jobs.append(asyncio.ensure_future(request(f"user-{random.randrange(args.users)}", INTERACTIVE)))
+    await asyncio.gather(*jobs)
+
+    print(json.dumps(queue.stats(), indent=2))
+    print(f"peak concurrent generations: {llm.peak} (limit {args.concurrency})")
+    print(f"interactive served: {sum(n for (_, p), n in served.items() if p == INTERACTIVE)}, "
+          f"background served: {sum(n for (_, p), n in served.items() if p == BACKGROUND)}, "
+          f"rejected busy: {sum(busy.values())}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate chat and sync load against the LLM queue with a stubbed model")
+    parser.add_argument("--concurrency", type=int, default=2)
+    parser.add_argument("--max-waiting", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.2, help="Mean seconds per stubbed generation")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=200, help="Interactive requests to send")
+    parser.add_argument("--rate", type=float, default=20.0, help="Interactive requests per second")
+    parser.add_argument("--background", type=int, default=50, help="Background jobs queued up front")
+    args = parser.parse_args()
+    asyncio.run(simulate(args))
+
+
+if __name__ == "__main__":
+    main()
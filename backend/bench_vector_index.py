@@ -0,0 +1,163 @@
+import argparse
+import io
+import os
+import statistics
+import time
+
+import numpy as np
+import psycopg2
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DIMENSIONS = 384
+TABLE = "bench_blood_test_data"
+USERS = 1000
+
+# Same shape as match_blood_test_data in setup_database.sql, against the
+# benchmark table so it can run on a throwaway local database.
+ANN_QUERY = f"""
+SELECT candidates.id, candidates.similarity FROM (
+  SELECT bt.id, 1 - (bt.embedding <=> %(query)s::vector) AS similarity
+  FROM {TABLE} bt
+  WHERE (bt."clerkUserId" = %(user)s OR bt."accessType" = 'global')
+  ORDER BY bt.embedding <=> %(query)s::vector
+  LIMIT %(k)s
+) candidates
+WHERE candidates.similarity > %(threshold)s
+ORDER BY candidates.similarity DESC
+"""
+
+
+def vector_literal(vector: np.ndarray) -> str:
+    return "[" + ",".join(f"{x:.6f}" for x in vector) + "]"
+
+
+def synthetic_vectors(rng: np.random.Generator, count: int, centers: np.ndarray) -> np.ndarray:
+    """Unit vectors clustered around topic centers, roughly like sentence embeddings."""
+    labels = rng.integers(0, len(centers), size=count)
+    vectors = centers[labels] + rng.normal(scale=0.35, size=(count, DIMENSIONS)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def load_rows(conn, rng, rows: int, user_fraction: float, centers: np.ndarray, batch_size: int = 10000):
+    with conn.cursor() as cur:
+        cur.execute("CREATE EXTENSION IF NOT EXISTS vector")
+        cur.execute(f"DROP TABLE IF EXISTS {TABLE}")
+        cur.execute(f"""
+            CREATE TABLE {TABLE} (
+              id bigserial PRIMARY KEY,
+              "clerkUserId" text,
+              "accessType" text NOT NULL,
+              embedding vector({DIMENSIONS})
+            )
+        """)
+        start = time.perf_counter()
+        for offset in range(0, rows, batch_size):
+            count = min(batch_size, rows - offset)
+            vectors = synthetic_vectors(rng, count, centers)
+            is_user = rng.random(count) < user_fraction
+            owners = rng.integers(0, USERS, size=count)
+            buffer = io.StringIO()
+            for vector, user, owner in zip(vectors, is_user, owners, strict=True):
+                clerk_user_id = f"user-{owner}" if user else "\\N"
+                buffer.write(f"{clerk_user_id}\t{'user' if user else 'global'}\t{vector_literal(vector)}\n")
+            buffer.seek(0)
+            cur.copy_from(buffer, TABLE, columns=('"clerkUserId"', '"accessType"', "embedding"))
+        conn.commit()
+        print(f"Loaded {rows} rows in {time.perf_counter() - start:.1f}s")
+
+        start = time.perf_counter()
+        cur.execute(f'CREATE INDEX ON {TABLE}("clerkUserId")')
+        cur.execute(f"CREATE INDEX ON {TABLE} USING hnsw (embedding vector_cosine_ops) WITH (m = 16, ef_construction = 64)")
+        cur.execute(f"ANALYZE {TABLE}")
+        conn.commit()
+        print(f"Built indexes in {time.perf_counter() - start:.1f}s")
+
+
+def run_queries(conn, queries, users, k, threshold, settings):
+    """Return (result ids per query, latencies in ms) under the given SET LOCAL settings."""
+    results, timings = [], []
+    with conn.cursor() as cur:
+        for query, user in zip(queries, users, strict=True):
+            for name, value in settings.items():
+                cur.execute("SELECT set_config(%s, %s, true)", (name, str(value)))
+            start = time.perf_counter()
+            cur.execute(ANN_QUERY, {"query": vector_literal(query), "user": user, "k": k, "threshold": threshold})
+            rows = cur.fetchall()
+            timings.append((time.perf_counter() - start) * 1000)
+            results.append([row[0] for row in rows])
+            conn.rollback()
+    return results, timings
+
+
+def supports_iterative_scan(conn) -> bool:
+    """hnsw.iterative_scan exists from pgvector 0.8; older versions reject the setting."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT extversion FROM pg_extension WHERE extname = 'vector'")
+        row = cur.fetchone()
+    conn.rollback()
+    if row is None:
+        return False
+    version = tuple(int(part) for part in row[0].split(".")[:2] if part.isdigit())
+    return version >= (0, 8)
+
+
+def recall(exact, approximate):
+    scores = [len(set(e) & set(a)) / len(e) for e, a in zip(exact, approximate, strict=True) if e]
+    return statistics.mean(scores) if scores else 1.0
+
+
+def report(name, timings, value):
+    timings = sorted(timings)
+    p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+    print(f"{name:<28} recall {value:6.3f}  p50 {statistics.median(timings):8.2f} ms  p95 {p95:8.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure recall and latency of the HNSW index used by match_blood_test_data")
+    parser.add_argument("--dsn", default=os.environ.get("BENCH_DATABASE_URL"),
+                        help="Local Postgres with pgvector; the benchmark creates and drops its own table")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--threshold", type=float, default=-1.0, help="Similarity cutoff; the default keeps every candidate")
+    parser.add_argument("--user-fraction", type=float, default=0.05, help="Share of rows owned by a user rather than global")
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[10, 20, 40, 80, 160])
+    parser.add_argument("--skip-load", action="store_true", help="Reuse the table from a previous run")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    if not args.dsn:
+        parser.error("--dsn or BENCH_DATABASE_URL is required")
+
+    rng = np.random.default_rng(args.seed)
+    centers = rng.normal(size=(256, DIMENSIONS)).astype(np.float32)
+    conn = psycopg2.connect(args.dsn)
+    try:
+        if not args.skip_load:
+            load_rows(conn, rng, args.rows, args.user_fraction, centers)
+
+        queries = synthetic_vectors(rng, args.queries, centers)
+        users = [f"user-{owner}" for owner in rng.integers(0, USERS, size=args.queries)]
+
+        # Ground truth from a sequential scan
+        exact, timings = run_queries(conn, queries, users, args.k, args.threshold,
+                                     {"enable_indexscan": "off", "enable_bitmapscan": "off"})
+        report("exact (seq scan)", timings, 1.0)
+
+        # Mirror match_blood_test_data, which only enables iterative scans where available
+        settings = {}
+        if supports_iterative_scan(conn):
+            settings["hnsw.iterative_scan"] = "relaxed_order"
+        else:
+            print("pgvector < 0.8: measuring without iterative index scans")
+        for ef_search in args.ef_search:
+            approximate, timings = run_queries(conn, queries, users, args.k, args.threshold,
+                                               {"hnsw.ef_search": ef_search, **settings})
+            report(f"hnsw ef_search={ef_search}", timings, recall(exact, approximate))
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
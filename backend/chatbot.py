@@ -1,22 +1,48 @@
-import os
-from typing import List, Dict
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_ollama.llms import OllamaLLM
-from langchain.memory import ConversationBufferMemory
-from langchain.schema import Document, BaseRetriever
-from langchain_huggingface import HuggingFaceEmbeddings
-from supabase import create_client
+import asyncio
+import datetime
+import hashlib
 import json
+import logging
+import os
 import sys
+import time
+from typing import Any, Dict, List, Optional
+
 import dotenv
-import datetime
-from langchain.schema import messages_from_dict, messages_to_dict
-from load_memory import update_conversation_memory, initialize_blood_test_results
-from pydantic import BaseModel, Field, Extra
+import httpx
+from analysis import summarize
+from conversation_writer import get_conversation_writer
+from embeddings import get_embeddings
+from langchain.memory import ConversationBufferMemory
+from langchain.schema import BaseRetriever, Document, messages_from_dict
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import RunnableLambda, RunnableParallel
+from langchain_ollama.llms import OllamaLLM
+from load_memory import update_conversation_memory
 from load_user import load_user_data
-import subprocess
-
-import logging
+from prompt_builder import PROMPT_MAX_HISTORY_MESSAGES, PromptBuilder
+from pydantic import Extra, Field
+from reranking import (
+    RETRIEVAL_CONTEXT_TOKENS,
+    RETRIEVAL_DUPLICATE_THRESHOLD,
+    RETRIEVAL_FETCH_K,
+    RETRIEVAL_MIN_SCORE,
+    RETRIEVAL_MMR_LAMBDA,
+    RETRIEVAL_SCORE_GAP,
+    rerank,
+)
+from response_cache import (
+    RESPONSE_CACHE_ENABLED,
+    RESPONSE_CACHE_THRESHOLD,
+    depends_on_history,
+    get_response_cache,
+    normalize_question,
+)
+from results_store import load_blood_test_results, load_results_matrix, results_version
+from scheduler import INTERACTIVE, Busy, get_scheduler
+from supabase import create_client
+from vector_index import load_hybrid_index
 
 # Set up logging
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -35,45 +61,95 @@ if not url or not key:
 supabase = create_client(url, key)
 logging.info("Supabase client created")
 
-# Hugging Face Embeddings setup
-try:
-    hf_embeddings = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
-    logging.info("HuggingFace Embeddings initialized")
-    
-    # Add this near the top of your file, after initializing hf_embeddings
-    test_query = "This is a test query"
-    test_embedding = hf_embeddings.embed_query(test_query)
-    logging.info(f"Test embedding type: {type(test_embedding)}, length: {len(test_embedding)}")
-    logging.info(f"First few elements of test embedding: {test_embedding[:5]}")
-except Exception as e:
-    logging.error(f"Error initializing HuggingFace Embeddings: {e}")
-    sys.exit(1)
+# Pooled async HTTP client for PostgREST calls made from the event loop
+SUPABASE_MAX_CONNECTIONS = int(os.environ.get("SUPABASE_MAX_CONNECTIONS", "20"))
+_async_http = None
+
+def get_async_http() -> httpx.AsyncClient:
+    global _async_http
+    if _async_http is None:
+        _async_http = httpx.AsyncClient(
+            base_url=f"{url}/rest/v1",
+            headers={"apikey": key, "Authorization": f"Bearer {key}"},
+            limits=httpx.Limits(max_connections=SUPABASE_MAX_CONNECTIONS, max_keepalive_connections=SUPABASE_MAX_CONNECTIONS),
+            timeout=30.0,
+        )
+    return _async_http
+
+# Vector index search breadth (see match_blood_test_data in setup_database.sql)
+MATCH_EF_SEARCH = int(os.environ.get("MATCH_EF_SEARCH", "40"))
+MATCH_PROBES = int(os.environ.get("MATCH_PROBES", "10"))
+# Similarity floor for the plain "similarity" retrieval mode
+MATCH_THRESHOLD = float(os.environ.get("MATCH_THRESHOLD", "0.95"))
+
+def match_params(query_vector: List[float], clerk_user_id: str, top_k: int, threshold: float = MATCH_THRESHOLD) -> Dict:
+    return {
+        "query_embedding": query_vector,
+        "match_threshold": threshold,
+        "match_count": top_k,
+        "clerk_user_id": clerk_user_id,
+        "include_global": True,
+        "ef_search": MATCH_EF_SEARCH,
+        "probes": MATCH_PROBES
+    }
+
+def search_index(index, query_vector: List[float], clerk_user_id: str, top_k: int, threshold: float):
+    """Search the in-process index, or return None so the caller falls back to the RPC."""
+    if index is None:
+        return None
+    try:
+        params = match_params(query_vector, clerk_user_id, top_k, threshold)
+        start = time.perf_counter()
+        results = index.search(query_vector, top_k, params["match_threshold"], params["include_global"])
+        logging.info(f"In-process index returned {len(results)} results in {(time.perf_counter() - start) * 1000:.2f} ms")
+        return results
+    except Exception as e:
+        logging.error(f"In-process index search failed, falling back to pgvector: {e}")
+        return None
 
-def query_db(query: str, clerk_user_id: str, top_k: int = 5) -> List[Dict]:
+def query_db(query: str, clerk_user_id: str, top_k: int = 5, index=None, threshold: float = MATCH_THRESHOLD) -> List[Dict]:
     logging.info(f"Querying database for user {clerk_user_id}")
     try:
-        query_vector = hf_embeddings.embed_query(query)
+        query_vector = get_embeddings().embed_query(query)
         logging.info(f"Query vector type: {type(query_vector)}, length: {len(query_vector)}")
         logging.info(f"First few elements of query vector: {query_vector[:5]}")
-        response = supabase.rpc(
-            "match_blood_test_data",
-            {
-                "query_embedding": query_vector,
-                "match_threshold": 0.95,
-                "match_count": top_k,
-                "clerk_user_id": clerk_user_id,
-                "include_global": True  
-            }
-        ).execute()
+        results = search_index(index, query_vector, clerk_user_id, top_k, threshold)
+        if results is not None:
+            return results
+        response = supabase.rpc("match_blood_test_data", match_params(query_vector, clerk_user_id, top_k, threshold)).execute()
         logging.info(f"Database query successful, returned {len(response.data)} results")
         return response.data
     except Exception as e:
         logging.error(f"Error querying database: {e}")
         return []
 
+async def aquery_db(query: str, clerk_user_id: str, top_k: int = 5, index=None, threshold: float = MATCH_THRESHOLD) -> List[Dict]:
+    logging.info(f"Querying database asynchronously for user {clerk_user_id}")
+    try:
+        # The encoder is CPU-bound, so keep it off the event loop
+        loop = asyncio.get_running_loop()
+        query_vector = await get_scheduler()["embedding"].run(
+            clerk_user_id, INTERACTIVE, loop.run_in_executor, None, get_embeddings().embed_query, query
+        )
+        # A local search takes well under a millisecond, so it runs inline
+        results = search_index(index, query_vector, clerk_user_id, top_k, threshold)
+        if results is not None:
+            return results
+        response = await get_async_http().post("/rpc/match_blood_test_data", json=match_params(query_vector, clerk_user_id, top_k, threshold))
+        response.raise_for_status()
+        data = response.json()
+        logging.info(f"Database query successful, returned {len(data)} results")
+        return data
+    except Busy:
+        # Overload is reported to the client (503) rather than answered without context
+        raise
+    except Exception as e:
+        logging.error(f"Error querying database: {e}")
+        return []
+
 def check_embedding_structure():
     logging.info("Checking embedding structure")
-    query_vector = hf_embeddings.embed_query("Test query")
+    query_vector = get_embeddings().embed_query("Test query")
     logging.info(f"Python embedding structure: {type(query_vector)}, length: {len(query_vector) if isinstance(query_vector, list) else 'Not a list'}")
     logging.info(f"First few elements: {query_vector[:5] if isinstance(query_vector, list) else query_vector}")
 
@@ -91,20 +167,82 @@ def check_db_embedding_structure():
         logging.error(f"Error checking database embedding structure: {e}")
 
 class SupabaseRetriever(BaseRetriever):
+    """Retrieves context for one user from the in-process index or match_blood_test_data.
+
+    search_type "similarity" returns up to top_k matches above
+    match_threshold. "mmr" over-fetches fetch_k matches above min_score,
+    drops everything after a similarity drop larger than score_gap, then
+    picks up to top_k diverse chunks that fit in context_tokens.
+    """
     clerk_user_id: str = Field(...)
+    # In-process HybridIndex; None sends every query to match_blood_test_data
+    index: Any = None
+    search_type: str = "mmr"
+    top_k: int = 5
+    match_threshold: float = MATCH_THRESHOLD
+    fetch_k: int = RETRIEVAL_FETCH_K
+    min_score: float = RETRIEVAL_MIN_SCORE
+    score_gap: float = RETRIEVAL_SCORE_GAP
+    lambda_mult: float = RETRIEVAL_MMR_LAMBDA
+    duplicate_threshold: float = RETRIEVAL_DUPLICATE_THRESHOLD
+    context_tokens: int = RETRIEVAL_CONTEXT_TOKENS
 
     class Config:
         extra = Extra.allow
 
-    def get_relevant_documents(self, query: str) -> List[Document]:
+    def _query_args(self) -> Dict:
+        if self.search_type == "mmr":
+            return {"top_k": self.fetch_k, "threshold": self.min_score, "index": self.index}
+        return {"top_k": self.top_k, "threshold": self.match_threshold, "index": self.index}
+
+    def select(self, results: List[Dict]) -> List[Document]:
+        if self.search_type == "mmr":
+            results = rerank(results, self.top_k, self.min_score, self.score_gap, self.lambda_mult,
+                             self.duplicate_threshold, self.context_tokens)
+        return results_to_documents(results)
+
+    def _get_relevant_documents(self, query: str, *, run_manager=None) -> List[Document]:  # noqa: ARG002
         logging.info(f"Getting relevant documents for query: {query}")
-        results = query_db(query, self.clerk_user_id)
-        documents = [Document(page_content=r['content'], metadata=json.loads(r['metadata'])) for r in results]
+        documents = self.select(query_db(query, self.clerk_user_id, **self._query_args()))
+        logging.info(f"Retrieved {len(documents)} relevant documents")
+        return documents
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager=None) -> List[Document]:  # noqa: ARG002
+        logging.info(f"Getting relevant documents asynchronously for query: {query}")
+        documents = self.select(await aquery_db(query, self.clerk_user_id, **self._query_args()))
         logging.info(f"Retrieved {len(documents)} relevant documents")
         return documents
 
-    async def aget_relevant_documents(self, query: str) -> List[Document]:
-        return self.get_relevant_documents(query)
+def results_to_documents(results: List[Dict]) -> List[Document]:
+    return [
+        Document(page_content=r['content'], metadata={**parse_metadata(r['metadata']), "similarity": r.get('similarity')})
+        for r in results
+    ]
+
+def parse_metadata(metadata) -> Dict:
+    # Rows inserted with json.dumps come back as a JSON string inside the jsonb column
+    if isinstance(metadata, str):
+        try:
+            metadata = json.loads(metadata)
+        except json.JSONDecodeError:
+            return {}
+    return metadata if isinstance(metadata, dict) else {}
+
+def _digest(*parts) -> str:
+    return hashlib.sha256(json.dumps(parts).encode("utf-8")).hexdigest()
+
+def format_documents(documents: List[Document]) -> str:
+    """Render retrieved documents as compact numbered lines tagged with their source."""
+    if not documents:
+        return "No relevant context found."
+    lines = []
+    for i, doc in enumerate(documents, 1):
+        source = doc.metadata.get("source", "unknown")
+        if doc.metadata.get("document"):
+            source = f"{source}: {doc.metadata['document']}"
+        content = " ".join(doc.page_content.split())
+        lines.append(f"[{i}] ({source}) {content}")
+    return "\n".join(lines)
 
 def save_conversation(clerk_user_id: str, conversation: str):
     logging.info(f"Saving conversation for user {clerk_user_id}")
@@ -117,21 +255,31 @@ def save_conversation(clerk_user_id: str, conversation: str):
     except Exception as e:
         logging.error(f"Error saving conversation: {e}")
 
-def retrieve_conversation(clerk_user_id: str) -> str:
+def retrieve_conversation(clerk_user_id: str, limit: int = PROMPT_MAX_HISTORY_MESSAGES) -> Optional[str]:
+    """Return the user's last `limit` conversation messages, oldest first, as a JSON list for messages_from_dict."""
     logging.info(f"Retrieving conversation for user {clerk_user_id}")
     try:
-        response = supabase.table("BloodTestData").select("content", "metadata").eq("clerkUserId", clerk_user_id).execute()
+        # Served by the partial index on ("clerkUserId", "createdAt") for conversation rows
+        response = (
+            supabase.table("BloodTestData")
+            .select("id, content, metadata")
+            .eq("clerkUserId", clerk_user_id)
+            .eq("metadata->>source", "conversation")
+            .order("createdAt", desc=True)
+            .order("id", desc=True)
+            .limit(limit)
+            .execute()
+        )
         conversation_messages = []
-        for r in response.data:
-            metadata = json.loads(r['metadata'])
-            if metadata.get('source') == 'conversation':
-                try:
-                    content = json.loads(r['content'])
-                    conversation_messages.append(content)
-                except json.JSONDecodeError:
-                    logging.warning(f"Invalid JSON in conversation content: {r['content']}")
+        for r in reversed(response.data):
+            metadata = parse_metadata(r['metadata'])
+            message_type = metadata.get('message_type', 'human')
+            conversation_messages.append({
+                "type": message_type,
+                "data": {"content": r['content'], "type": message_type},
+            })
         if conversation_messages:
-            logging.info("Conversation retrieved successfully")
+            logging.info(f"Retrieved {len(conversation_messages)} conversation messages")
             return json.dumps(conversation_messages)
         else:
             logging.info("No existing conversation found")
@@ -140,23 +288,9 @@ def retrieve_conversation(clerk_user_id: str) -> str:
         logging.error(f"Error retrieving conversation: {e}")
         return None
 
-def get_blood_test_results(clerk_user_id: str) -> str:
-    logging.info(f"Getting blood test results for user {clerk_user_id}")
-    try:
-        response = supabase.table("BloodTestData").select("content").or_(f"clerkUserId.eq.{clerk_user_id},accessType.eq.global").execute()
-        results = [json.loads(r['content']) for r in response.data] if response.data else []
-        logging.info(f"Retrieved {len(results)} blood test results")
-        return json.dumps(results)
-    except Exception as e:
-        logging.error(f"Error getting blood test results: {e}")
-        return "[]"
-
-from langchain.chains import create_retrieval_chain
-from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough
-
 class MedicalChatbot:
-    def __init__(self, clerk_user_id: str, blood_test_results: List[Dict] = None):
+    def __init__(self, clerk_user_id: str, blood_test_results: Optional[List[Dict]] = None):
+        """Loads the user's blood test results unless they are passed in."""
         logging.info(f"Initializing MedicalChatbot for user {clerk_user_id}")
         self.clerk_user_id = clerk_user_id
         try:
@@ -165,9 +299,15 @@ class MedicalChatbot:
         except Exception as e:
             logging.error(f"Error initializing OllamaLLM: {e}")
             raise
-        self.retriever = SupabaseRetriever(clerk_user_id=clerk_user_id)
+        self.retriever = SupabaseRetriever(clerk_user_id=clerk_user_id, index=load_hybrid_index(clerk_user_id))
         self.memory = ConversationBufferMemory(return_messages=True)
         
+        # Read the version before the results: results stored in between are
+        # then picked up by refresh_results() instead of being cached under it
+        self.results_version = self._current_results_version()
+        self._trend_summary: Optional[str] = None
+        if blood_test_results is None:
+            blood_test_results = get_blood_test_results(clerk_user_id)
         self.blood_test_results = load_user_data(clerk_user_id, blood_test_results)
         if self.blood_test_results:
             logging.info(f"Loaded {len(self.blood_test_results)} blood test results from email/file")
@@ -205,47 +345,124 @@ class MedicalChatbot:
         Assistant: """
 
         self.prompt = ChatPromptTemplate.from_template(template)
-
-        retrieval_prompt = ChatPromptTemplate.from_template("Please retrieve information relevant to: {input}")
-        retrieval_chain = create_retrieval_chain(self.retriever, retrieval_prompt)
+        self.prompt_builder = PromptBuilder(template)
+
+        # Retrieval, results and history are gathered concurrently; the
+        # retriever is called once and its documents go straight into the prompt.
+        self.prompt_inputs = RunnableParallel(
+            context=RunnableLambda(lambda x: x["question"]) | self.retriever | RunnableLambda(format_documents),
+            question=RunnableLambda(lambda x: x["question"]),
+            blood_test_results=RunnableLambda(lambda x: x.get("blood_test_results") or self.blood_test_results),
+            history=RunnableLambda(lambda _x: self.memory.chat_memory.messages),
+        )
 
         self.qa_chain = (
-            {
-                "context": lambda x: retrieval_chain.invoke({"input": x["question"]})["answer"],
-                "question": lambda x: x["question"],
-                "blood_test_results": lambda x: json.dumps(self.blood_test_results, indent=2) if self.blood_test_results else "No blood test results available from email/file",
-                "history": lambda x: self.get_conversation_history(),
-            }
+            self.prompt_inputs
+            # Fit the gathered sections into the prompt token budget
+            | RunnableLambda(self.prompt_builder.build)
             | self.prompt
             | self.llm
             | StrOutputParser()
         )
         logging.info("MedicalChatbot initialization complete")
 
+    def prompt_token_counts(self) -> Dict[str, int]:
+        """Per-section token counts of the most recent prompt."""
+        return dict(self.prompt_builder.last_stats)
+
+    def _current_results_version(self):
+        try:
+            return results_version(self.clerk_user_id)
+        except Exception as e:
+            logging.error(f"Error reading blood test results version: {e}")
+            return None
+
+    def refresh_results(self):
+        """Reload the blood test results if new ones arrived, dropping responses cached for the old ones."""
+        version = self._current_results_version()
+        if version is None or version == self.results_version:
+            return
+        logging.info(f"Blood test results changed for user {self.clerk_user_id}, reloading")
+        self.blood_test_results = load_user_data(self.clerk_user_id, get_blood_test_results(self.clerk_user_id))
+        self.results_version = version
+        self._trend_summary = None
+        get_response_cache().invalidate(self.clerk_user_id, keep_version=version)
+
+    def _cache_key(self, question: Optional[str] = None):
+        """The (context, vector) a response is cached under; question is None for fixed prompts.
+
+        Standalone questions are shared across turns of the conversation; only
+        follow-ups that refer back to it include the history the prompt holds.
+        Below a threshold of 1.0, questions are matched by embedding instead of
+        by their text.
+        """
+        if question is None:
+            return "", None
+        history = []
+        if depends_on_history(question):
+            history = [[m.type, m.content] for m in self.memory.chat_memory.messages[-PROMPT_MAX_HISTORY_MESSAGES:]]
+        if RESPONSE_CACHE_THRESHOLD >= 1.0:
+            return _digest(history, normalize_question(question)), None
+        # The retriever embeds the same question, so this is an embedding cache hit
+        return _digest(history), get_embeddings().embed_query(question)
+
+    def cached_response(self, kind: str, question: Optional[str] = None):
+        """Look up a response for the current results and conversation.
+
+        Returns (response or None, key to store the new response under).
+        """
+        if not RESPONSE_CACHE_ENABLED or self.results_version is None:
+            return None, None
+        key = self._cache_key(question)
+        context, vector = key
+        response = get_response_cache().get(self.clerk_user_id, kind, self.results_version, self.llm.model, vector, context)
+        if response is not None:
+            logging.info(f"Serving cached {kind} response for user {self.clerk_user_id}")
+        return response, key
+
+    def cache_response(self, kind: str, response: str, key=None):
+        if RESPONSE_CACHE_ENABLED and self.results_version is not None:
+            context, vector = key or ("", None)
+            get_response_cache().put(self.clerk_user_id, kind, self.results_version, self.llm.model, response, vector, context)
+
+    async def _aprepare(self, kind: str, question: Optional[str] = None):
+        # Both steps block on Supabase or the encoder
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.refresh_results)
+        return await loop.run_in_executor(None, self.cached_response, kind, question)
+
     def get_conversation_history(self) -> str:
         history = "\n".join([f"{m.type.capitalize()}: {m.content}" for m in self.memory.chat_memory.messages[-10:]])
         logging.info(f"Retrieved conversation history: {history[:100]}...")  # Log first 100 chars
         return history
 
+    def _record_turn(self, message: str, response: str):
+        self.memory.chat_memory.add_user_message(message)
+        self.memory.chat_memory.add_ai_message(response)
+
+        # Queue the turn for the vector store; embedding and upsert happen in
+        # the background so they are not part of the response time
+        new_messages = [
+            {"type": "human", "content": message, "timestamp": datetime.datetime.utcnow().isoformat()},
+            {"type": "ai", "content": response, "timestamp": datetime.datetime.utcnow().isoformat()}
+        ]
+        get_conversation_writer().enqueue(new_messages, self.clerk_user_id)
+
+        logging.info("Conversation queued for saving")
+
     def process_message(self, message: str) -> str:
         logging.info(f"Processing message: {message}")
         try:
-            response = self.qa_chain.invoke({
-                "question": message,
-            })
+            self.refresh_results()
+            response, key = self.cached_response("chat", message)
+            if response is None:
+                response = self.qa_chain.invoke({
+                    "question": message,
+                })
+                self.cache_response("chat", response, key)
             logging.info(f"Generated response: {response[:100]}...")  # Log first 100 chars
             
-            self.memory.chat_memory.add_user_message(message)
-            self.memory.chat_memory.add_ai_message(response)
-            
-            # Update conversation memory in vector store
-            new_messages = [
-                {"type": "human", "content": message, "timestamp": datetime.datetime.utcnow().isoformat()},
-                {"type": "ai", "content": response, "timestamp": datetime.datetime.utcnow().isoformat()}
-            ]
-            update_conversation_memory(new_messages, self.clerk_user_id)
-            
-            logging.info("Conversation saved to database")
+            self._record_turn(message, response)
             
             return response  # Return the response instead of printing it
         except Exception as e:
@@ -253,16 +470,55 @@ class MedicalChatbot:
             error_message = "I'm sorry, but I encountered an error while processing your message. Please try again later."
             return error_message  # Return the error message instead of printing it
 
+    async def astream_message(self, message: str):
+        """Yield response chunks from Ollama as they are generated, then save the turn."""
+        logging.info(f"Streaming response to message: {message}")
+        response, key = await self._aprepare("chat", message)
+        if response is not None:
+            yield response
+        else:
+            chunks = []
+            async for chunk in self.qa_chain.astream({"question": message}):
+                chunks.append(chunk)
+                yield chunk
+            response = "".join(chunks)
+            self.cache_response("chat", response, key)
+        logging.info(f"Generated response: {response[:100]}...")  # Log first 100 chars
+        self._record_turn(message, response)
+
+    async def aprocess_message(self, message: str) -> str:
+        try:
+            return "".join([chunk async for chunk in self.astream_message(message)])
+        except Busy:
+            raise
+        except Exception as e:
+            logging.error(f"Error processing message: {e}")
+            return "I'm sorry, but I encountered an error while processing your message. Please try again later."
+
+    HEALTH_ANALYSIS_PROMPT = """
+            The patient's blood test results are given as a precomputed trend table: one row per parameter with the latest value, the two previous values, the reference range, a LOW/ok/HIGH flag, the change from the previous report in percent, the slope per month, the z-score of the latest value against the patient's own history, how many reports were out of range, and whether the trend is worsening. Using this table, assess the overall health condition of the user, explain the flagged values and worsening trends, and recommend that the user consult a healthcare professional for any anomaly, deteriorating trend or critical value that may indicate a potential health risk. Use the context from the database to consider any relevant medical history or conditions that might influence the interpretation of the results.
+            """
+
+    def _health_analysis_inputs(self) -> Dict:
+        # Range flags, deltas, slopes and z-scores are computed here rather than by
+        # the LLM, from the per-analyte BloodTestValue columns; kept until the
+        # results version changes
+        if self._trend_summary is None:
+            self._trend_summary = summarize(*load_results_matrix(self.clerk_user_id))
+            logging.info(f"Trend summary for health analysis:\n{self._trend_summary}")
+        return {
+            "question": self.HEALTH_ANALYSIS_PROMPT,
+            "blood_test_results": self._trend_summary,
+        }
+
     def generate_health_analysis(self) -> str:
         logging.info("Generating health analysis")
         try:
-            analysis_prompt = """
-            Using the provided blood test results {blood_test_results}, analyze each parameter and assess the overall health condition of the user. Compare the most recent blood test results with the previous two to evaluate the progression of each parameter. Identify any values that fall outside the normal reference range and highlight any concerning trends or significant changes over time. If any parameters show an anomaly, deteriorating trend, or critical value that may indicate a potential health risk, recommend that the user consult a healthcare professional. Please use the context provided in {context} to consider any relevant medical history or conditions that might influence the interpretation of the results.
-            """
-            
-            response = self.qa_chain.invoke({
-                "question": analysis_prompt,
-            })
+            self.refresh_results()
+            response, _ = self.cached_response("health_analysis")
+            if response is None:
+                response = self.qa_chain.invoke(self._health_analysis_inputs())
+                self.cache_response("health_analysis", response)
             logging.info(f"Generated health analysis: {response[:100]}...")  # Log first 100 chars
             return response
         except Exception as e:
@@ -270,48 +526,104 @@ class MedicalChatbot:
             error_message = "I'm sorry, but I encountered an error while generating the health analysis. Please try again later."
             return error_message
 
-def get_blood_test_results(clerk_user_id):
+    async def astream_health_analysis(self):
+        logging.info("Streaming health analysis")
+        response, _ = await self._aprepare("health_analysis")
+        if response is not None:
+            yield response
+            return
+        # Loading the trend columns blocks on Supabase
+        inputs = await asyncio.get_running_loop().run_in_executor(None, self._health_analysis_inputs)
+        chunks = []
+        async for chunk in self.qa_chain.astream(inputs):
+            chunks.append(chunk)
+            yield chunk
+        self.cache_response("health_analysis", "".join(chunks))
+
+    async def agenerate_health_analysis(self) -> str:
+        try:
+            return "".join([chunk async for chunk in self.astream_health_analysis()])
+        except Busy:
+            raise
+        except Exception as e:
+            logging.error(f"Error generating health analysis: {e}")
+            return "I'm sorry, but I encountered an error while generating the health analysis. Please try again later."
+
+async def stream_frames(chatbot: MedicalChatbot, chunks):
+    """Wrap a chunk stream as frames: {"type": "chunk"} per chunk, then a final {"type": "done"} with timings and token counts."""
+    start = time.perf_counter()
+    first_token_at = None
+    parts = []
     try:
-        # Run the get_email.py script and capture its output
-        result = subprocess.run(['python', 'backend/get_email.py'], capture_output=True, text=True, check=True)
-        output = json.loads(result.stdout)
-        
-        if 'error' in output:
-            logging.error(f"Error in get_email.py: {output['error']}")
-            return None
-        
-        return output['bloodTestResults']
-    except subprocess.CalledProcessError as e:
-        logging.error(f"Error running get_email.py: {e}")
-        return None
-    except json.JSONDecodeError as e:
-        logging.error(f"Error parsing output from get_email.py: {e}")
-        return None
+        async for chunk in chunks:
+            if first_token_at is None:
+                first_token_at = time.perf_counter()
+            parts.append(chunk)
+            yield {"type": "chunk", "content": chunk}
+    except Busy:
+        raise
+    except Exception as e:
+        logging.error(f"Error while streaming response: {e}")
+        yield {"type": "error", "error": "I'm sorry, but I encountered an error while processing your message. Please try again later."}
+        return
+    finished_at = time.perf_counter()
+    yield {
+        "type": "done",
+        "timings": {
+            "firstTokenMs": round((first_token_at - start) * 1000, 1) if first_token_at else None,
+            "totalMs": round((finished_at - start) * 1000, 1),
+        },
+        "tokens": {
+            "prompt": chatbot.prompt_token_counts(),
+            "completion": chatbot.prompt_builder.counter.count("".join(parts)),
+        },
+    }
+
+def get_blood_test_results(clerk_user_id):
+    # Parsed results are kept up to date by sync_job.py, so a chat turn only
+    # reads them instead of syncing the mailbox first.
+    return load_blood_test_results(clerk_user_id)
+
+async def print_stream(chatbot: MedicalChatbot, chunks):
+    # One JSON object per line so the caller can render chunks as they arrive
+    async for frame in stream_frames(chatbot, chunks):
+        print(json.dumps(frame), flush=True)
 
 def main():
     logging.info("Starting Medical Chatbot")
-    if len(sys.argv) < 3:
+    args = sys.argv[1:]
+    # --stream: emit newline-delimited JSON frames instead of one final block
+    stream = '--stream' in args
+    if stream:
+        args.remove('--stream')
+    if len(args) < 2:
         logging.error("Incorrect number of arguments")
         sys.exit(1)
 
-    clerk_user_id = sys.argv[1]
-    request_type = sys.argv[2]
+    clerk_user_id = args[0]
+    request_type = args[1]
 
     logging.info(f"Request type: {request_type}")
 
-    blood_test_results = get_blood_test_results(clerk_user_id)
-
     try:
         check_db_embedding_structure()
-        chatbot = MedicalChatbot(clerk_user_id, blood_test_results)
+        chatbot = MedicalChatbot(clerk_user_id)
         logging.info("Medical Chatbot initialized successfully")
 
+        if stream:
+            if request_type == "health_analysis":
+                chunks = chatbot.astream_health_analysis()
+            else:
+                chunks = chatbot.astream_message(" ".join(args[1:]))
+            asyncio.run(print_stream(chatbot, chunks))
+            return
+
         if request_type == "health_analysis":
             logging.info("Generating health analysis")
             response = chatbot.generate_health_analysis()
             logging.info("Health analysis generated")
         else:
-            user_question = " ".join(sys.argv[2:])
+            user_question = " ".join(args[1:])
             logging.info(f"Processing user question: {user_question}")
             response = chatbot.process_message(user_question)
 
@@ -0,0 +1,291 @@
+import asyncio
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+from analysis_jobs import HEALTH_ANALYSIS, AnalysisJobRunner, fail_abandoned_tasks
+
+# Importing chatbot loads LangChain and the Supabase client once for the
+# lifetime of the server instead of once per request.
+from chatbot import (
+    MedicalChatbot,
+    check_db_embedding_structure,
+    check_embedding_structure,
+    stream_frames,
+)
+from conversation_writer import get_conversation_writer
+from embeddings import embedding_cache_stats
+from response_cache import get_response_cache
+from scheduler import BACKGROUND, INTERACTIVE, Busy, get_scheduler
+
+HOST = os.environ.get("CHATBOT_SERVER_HOST", "127.0.0.1")
+PORT = int(os.environ.get("CHATBOT_SERVER_PORT", "8001"))
+MAX_SESSIONS = int(os.environ.get("CHATBOT_MAX_SESSIONS", "256"))
+SESSION_TTL = float(os.environ.get("CHATBOT_SESSION_TTL", "900"))
+
+
+class ChatbotSession:
+    def __init__(self, chatbot: MedicalChatbot):
+        self.chatbot = chatbot
+        # Serializes turns for one user; only used on the server's event loop
+        self.lock = asyncio.Lock()
+        self.last_used = time.monotonic()
+
+
+class ChatbotPool:
+    """Keeps one warm MedicalChatbot per user, evicting idle sessions."""
+
+    def __init__(self, max_sessions: int = MAX_SESSIONS, ttl: float = SESSION_TTL):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions: "OrderedDict[str, ChatbotSession]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _evict(self):
+        now = time.monotonic()
+        for clerk_user_id in [u for u, s in self._sessions.items() if now - s.last_used > self.ttl]:
+            logging.info(f"Evicting idle chatbot session for user {clerk_user_id}")
+            del self._sessions[clerk_user_id]
+        while len(self._sessions) > self.max_sessions:
+            clerk_user_id, _ = self._sessions.popitem(last=False)
+            logging.info(f"Evicting least recently used chatbot session for user {clerk_user_id}")
+
+    def get(self, clerk_user_id: str) -> ChatbotSession:
+        with self._lock:
+            self._evict()
+            session = self._sessions.get(clerk_user_id)
+            if session is not None:
+                self._sessions.move_to_end(clerk_user_id)
+                session.last_used = time.monotonic()
+                return session
+
+        # Build outside the pool lock so one slow user does not block the others
+        session = ChatbotSession(MedicalChatbot(clerk_user_id))
+
+        with self._lock:
+            existing = self._sessions.get(clerk_user_id)
+            if existing is not None:
+                return existing
+            self._sessions[clerk_user_id] = session
+            self._evict()
+        return session
+
+    def drop(self, clerk_user_id: str):
+        with self._lock:
+            self._sessions.pop(clerk_user_id, None)
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+pool = ChatbotPool()
+
+# All chatbot work runs as coroutines on one event loop; HTTP handler threads
+# only wait on the results, so concurrent conversations share the loop, the
+# pooled Supabase connections and the embedder.
+loop = asyncio.new_event_loop()
+
+
+def run_async(coro):
+    return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+
+async def get_session(clerk_user_id: str) -> ChatbotSession:
+    # Building a chatbot does blocking Supabase reads
+    return await loop.run_in_executor(None, pool.get, clerk_user_id)
+
+
+def llm_slot(clerk_user_id: str, priority: int = INTERACTIVE):
+    # Bounds concurrent generations against the local Ollama instance. Every
+    # path takes the slot before session.lock; taking them in the other order
+    # anywhere lets two requests each hold what the other is waiting for.
+    return get_scheduler()["llm"].slot(clerk_user_id, priority)
+
+
+async def chat(clerk_user_id: str, message: str) -> dict:
+    session = await get_session(clerk_user_id)
+    async with llm_slot(clerk_user_id), session.lock:
+        response = await session.chatbot.aprocess_message(message)
+        token_counts = session.chatbot.prompt_token_counts()
+    return {"response": response, "promptTokens": token_counts}
+
+
+async def health_analysis(clerk_user_id: str) -> dict:
+    session = await get_session(clerk_user_id)
+    async with llm_slot(clerk_user_id), session.lock:
+        response = await session.chatbot.agenerate_health_analysis()
+        token_counts = session.chatbot.prompt_token_counts()
+    return {"response": response, "promptTokens": token_counts}
+
+
+async def compute_health_analysis(clerk_user_id: str) -> str:
+    # Streams rather than calling agenerate_health_analysis so that failures
+    # raise instead of being returned as an apology text
+    session = await get_session(clerk_user_id)
+    # Precomputed analyses give way to interactive requests
+    async with llm_slot(clerk_user_id, BACKGROUND), session.lock:
+        return "".join([chunk async for chunk in session.chatbot.astream_health_analysis()])
+
+
+# Health analyses recorded in the Task table; created on the event loop thread
+analysis_jobs = AnalysisJobRunner(compute_health_analysis, HEALTH_ANALYSIS)
+
+
+def handle_chat(payload: dict) -> dict:
+    return run_async(chat(payload["clerkUserId"], payload["message"]))
+
+
+def handle_health_analysis(payload: dict) -> dict:
+    return run_async(health_analysis(payload["clerkUserId"]))
+
+
+def handle_health_analysis_job(payload: dict) -> dict:
+    return run_async(analysis_jobs.submit(payload["clerkUserId"], force=bool(payload.get("force"))))
+
+
+ROUTES = {
+    "/chat": handle_chat,
+    "/health-analysis": handle_health_analysis,
+    "/health-analysis/jobs": handle_health_analysis_job,
+}
+
+STREAMS = {
+    "/chat": lambda chatbot, payload: chatbot.astream_message(payload["message"]),
+    "/health-analysis": lambda chatbot, _payload: chatbot.astream_health_analysis(),
+}
+
+
+async def stream_to_queue(path: str, payload: dict, frames: queue.Queue):
+    """Push response frames onto a thread-safe queue for the HTTP handler; None marks the end."""
+    try:
+        session = await get_session(payload["clerkUserId"])
+        async with llm_slot(payload["clerkUserId"]), session.lock:
+            async for frame in stream_frames(session.chatbot, STREAMS[path](session.chatbot, payload)):
+                frames.put(frame)
+    except Busy as e:
+        logging.warning(f"Rejected {path} stream: {e}")
+        frames.put({"type": "error", "error": "busy"})
+    except Exception as e:
+        logging.error(f"Error streaming {path}: {e}")
+        frames.put({"type": "error", "error": str(e)})
+    finally:
+        frames.put(None)
+
+
+class ChatbotRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _send_json(self, status: int, body: dict, headers: Optional[dict] = None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_stream(self, payload: dict):
+        # Server-sent events; the connection is closed after the final frame
+        frames = queue.Queue()
+        future = asyncio.run_coroutine_threadsafe(stream_to_queue(self.path, payload, frames), loop)
+        self.close_connection = True
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            while (frame := frames.get()) is not None:
+                self.wfile.write(f"data: {json.dumps(frame)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            logging.info(f"Client disconnected from {self.path} stream")
+            # Stop generating so the LLM slot and the session lock are released
+            future.cancel()
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send_json(200, {
+                "status": "ok",
+                "sessions": len(pool),
+                "embedding_cache": embedding_cache_stats(),
+                "response_cache": get_response_cache().stats(),
+                "analysis_jobs": analysis_jobs.stats(),
+                "scheduler": get_scheduler().stats(),
+            })
+        else:
+            self._send_json(404, {"error": "Not found"})
+
+    def do_POST(self):
+        handler = ROUTES.get(self.path)
+        if handler is None:
+            self._send_json(404, {"error": "Not found"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            payload = json.loads(self.rfile.read(length) or b"{}")
+        except (ValueError, json.JSONDecodeError):
+            self._send_json(400, {"error": "Invalid JSON body"})
+            return
+        if not payload.get("clerkUserId"):
+            self._send_json(400, {"error": "clerkUserId is required"})
+            return
+        if self.path == "/chat" and "message" not in payload:
+            self._send_json(400, {"error": "Missing field: 'message'"})
+            return
+        if payload.get("stream") and self.path in STREAMS:
+            self._send_stream(payload)
+            return
+        start = time.perf_counter()
+        try:
+            body = handler(payload)
+        except KeyError as e:
+            self._send_json(400, {"error": f"Missing field: {e}"})
+            return
+        except Busy as e:
+            logging.warning(f"Rejected {self.path} for user {payload['clerkUserId']}: {e}")
+            self._send_json(503, {"error": "busy"}, {"Retry-After": "5"})
+            return
+        except Exception as e:
+            logging.error(f"Error handling {self.path}: {e}")
+            self._send_json(500, {"error": str(e)})
+            return
+        logging.info(f"{self.path} for user {payload['clerkUserId']} took {time.perf_counter() - start:.2f}s")
+        self._send_json(200, body)
+
+    def log_message(self, format, *args):
+        logging.debug(f"{self.address_string()} - {format % args}")
+
+
+def main():
+    # Load the embedding model before accepting traffic
+    check_embedding_structure()
+    check_db_embedding_structure()
+    # Jobs from a previous run of the server will never finish
+    try:
+        fail_abandoned_tasks(HEALTH_ANALYSIS)
+    except Exception as e:
+        logging.error(f"Error clearing abandoned analysis tasks: {e}")
+    threading.Thread(target=loop.run_forever, name="chatbot-event-loop", daemon=True).start()
+    server = ThreadingHTTPServer((HOST, PORT), ChatbotRequestHandler)
+    server.daemon_threads = True
+    logging.info(f"Chatbot server listening on http://{HOST}:{PORT}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logging.info("Shutting down chatbot server")
+    finally:
+        server.server_close()
+        # Flush conversation messages still waiting to be written
+        get_conversation_writer().close()
+
+
+if __name__ == "__main__":
+    main()
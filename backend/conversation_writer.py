@@ -0,0 +1,105 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Dict, List
+
+from load_memory import store_conversation_batch
+
+WRITER_BATCH_SIZE = int(os.environ.get("CONVERSATION_WRITER_BATCH_SIZE", "64"))
+WRITER_FLUSH_INTERVAL = float(os.environ.get("CONVERSATION_WRITER_FLUSH_INTERVAL", "1.0"))
+WRITER_RETRIES = int(os.environ.get("CONVERSATION_WRITER_RETRIES", "3"))
+
+# Queued by close() so a writer waiting for a full batch flushes immediately
+_CLOSE = object()
+
+
+class ConversationWriter:
+    """Write-behind queue for conversation messages.
+
+    Messages from every user are collected on a background thread and written
+    in batches: one embedding pass and one upsert per batch, retried with
+    backoff. close() (also registered with atexit) flushes whatever is queued.
+    """
+
+    def __init__(self, batch_size: int = WRITER_BATCH_SIZE, flush_interval: float = WRITER_FLUSH_INTERVAL,
+                 retries: int = WRITER_RETRIES):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retries = retries
+        self._queue: "queue.Queue" = queue.Queue()
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="conversation-writer", daemon=True)
+        self._thread.start()
+        self.written = 0
+        self.dropped = 0
+
+    def enqueue(self, messages: List[Dict], clerk_user_id: str):
+        if self._closed.is_set():
+            raise RuntimeError("ConversationWriter is closed")
+        for message in messages:
+            self._queue.put((message, clerk_user_id))
+
+    def _next_batch(self) -> List:
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is _CLOSE:
+                break
+            batch.append(item)
+        return batch
+
+    def _write(self, batch: List):
+        for attempt in range(1, self.retries + 1):
+            try:
+                store_conversation_batch(batch)
+                self.written += len(batch)
+                logging.info(f"Stored {len(batch)} conversation messages")
+                return
+            except Exception as e:
+                if attempt == self.retries:
+                    self.dropped += len(batch)
+                    logging.error(f"Dropping {len(batch)} conversation messages after {attempt} attempts: {e}")
+                    return
+                delay = 2 ** attempt
+                logging.warning(f"Storing conversation batch failed ({e}), retrying in {delay}s")
+                time.sleep(delay)
+
+    def _run(self):
+        while not (self._closed.is_set() and self._queue.empty()):
+            batch = self._next_batch()
+            if batch:
+                self._write(batch)
+
+    def close(self, timeout: float = 30.0):
+        """Stop accepting messages and wait for the queue to drain."""
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        self._queue.put(_CLOSE)
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logging.error(f"Conversation writer did not finish flushing within {timeout}s")
+
+
+_writer = None
+_lock = threading.Lock()
+
+
+def get_conversation_writer() -> ConversationWriter:
+    global _writer
+    if _writer is None:
+        with _lock:
+            if _writer is None:
+                _writer = ConversationWriter()
+                atexit.register(_writer.close)
+    return _writer
@@ -0,0 +1,145 @@
+import hashlib
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import List, Optional, cast
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+def embedding_key(model_name: str, text: str) -> str:
+    return hashlib.sha256(f"{model_name}\0{text}".encode("utf-8")).hexdigest()
+
+
+class SQLiteEmbeddingStore:
+    """On-disk float32 vectors keyed by SHA-256 of model name + text."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+        )
+        self._conn.commit()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            row = self._conn.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def put_many(self, items: List[tuple]):
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)", items)
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class CachedEmbeddings(Embeddings):
+    """Wraps an Embeddings model with an LRU (bounded by entries and bytes) and an optional SQLite store."""
+
+    def __init__(self, embeddings: Embeddings, model_name: str, max_entries: int = 10000,
+                 max_bytes: int = 64 * 1024 * 1024, store: Optional[SQLiteEmbeddingStore] = None):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.store = store
+        self._lru: "OrderedDict[str, bytes]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _remember(self, key: str, blob: bytes):
+        if key in self._lru:
+            self._lru.move_to_end(key)
+            return
+        self._lru[key] = blob
+        self._bytes += len(blob)
+        while self._lru and (len(self._lru) > self.max_entries or self._bytes > self.max_bytes):
+            _, evicted = self._lru.popitem(last=False)
+            self._bytes -= len(evicted)
+
+    def _lookup(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            blob = self._lru.get(key)
+            if blob is not None:
+                self._lru.move_to_end(key)
+                self.hits += 1
+                return blob
+        if self.store is not None:
+            blob = self.store.get(key)
+            if blob is not None:
+                with self._lock:
+                    self._remember(key, blob)
+                    self.disk_hits += 1
+                return blob
+        return None
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [embedding_key(self.model_name, text) for text in texts]
+        vectors: List[Optional[List[float]]] = [None] * len(texts)
+        missing = {}
+        for i, key in enumerate(keys):
+            blob = self._lookup(key)
+            if blob is not None:
+                vectors[i] = np.frombuffer(blob, dtype=np.float32).tolist()
+            else:
+                missing.setdefault(key, []).append(i)
+
+        if missing:
+            miss_keys = list(missing)
+            computed = self.embeddings.embed_documents([texts[missing[k][0]] for k in miss_keys])
+            new_items = []
+            with self._lock:
+                self.misses += len(miss_keys)
+                for key, vector in zip(miss_keys, computed, strict=True):
+                    blob = np.asarray(vector, dtype=np.float32).tobytes()
+                    self._remember(key, blob)
+                    new_items.append((key, blob))
+                    for i in missing[key]:
+                        vectors[i] = list(vector)
+            if self.store is not None:
+                try:
+                    self.store.put_many(new_items)
+                except sqlite3.Error as e:
+                    logging.warning(f"Could not persist embeddings to {self.store.path}: {e}")
+        # Every slot is filled by a cache hit or by the batch computed above
+        return cast(List[List[float]], vectors)
+
+    def embed_query(self, text: str) -> List[float]:
+        key = embedding_key(self.model_name, text)
+        blob = self._lookup(key)
+        if blob is not None:
+            return np.frombuffer(blob, dtype=np.float32).tolist()
+        vector = self.embeddings.embed_query(text)
+        blob = np.asarray(vector, dtype=np.float32).tobytes()
+        with self._lock:
+            self.misses += 1
+            self._remember(key, blob)
+        if self.store is not None:
+            try:
+                self.store.put_many([(key, blob)])
+            except sqlite3.Error as e:
+                logging.warning(f"Could not persist embedding to {self.store.path}: {e}")
+        return vector
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+                "entries": len(self._lru),
+                "bytes": self._bytes,
+            }
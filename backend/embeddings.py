@@ -0,0 +1,72 @@
+import logging
+import os
+import threading
+from typing import List
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+EMBEDDING_MODEL_NAME = os.environ.get("EMBEDDING_MODEL_NAME", "all-MiniLM-L6-v2")
+EMBEDDING_DEVICE = os.environ.get("EMBEDDING_DEVICE", "cpu")
+EMBEDDING_THREADS = int(os.environ.get("EMBEDDING_THREADS", "0"))  # 0 keeps the torch default
+EMBEDDING_BATCH_SIZE = int(os.environ.get("EMBEDDING_BATCH_SIZE", "64"))
+EMBEDDING_CACHE_ENTRIES = int(os.environ.get("EMBEDDING_CACHE_ENTRIES", "10000"))
+EMBEDDING_CACHE_BYTES = int(os.environ.get("EMBEDDING_CACHE_BYTES", str(64 * 1024 * 1024)))
+EMBEDDING_CACHE_PATH = os.environ.get("EMBEDDING_CACHE_PATH")  # unset disables the on-disk store
+
+_embeddings = None
+_lock = threading.Lock()
+
+
+def get_embeddings():
+    """Return the process-wide cached HuggingFace embedder, loading it on first use."""
+    global _embeddings
+    if _embeddings is None:
+        with _lock:
+            if _embeddings is None:
+                _embeddings = _load_embeddings()
+    return _embeddings
+
+
+def embed_texts(texts: List[str], batch_size: int = EMBEDDING_BATCH_SIZE) -> np.ndarray:
+    """Embed texts through embed_documents in batches, returning a float32 matrix."""
+    embeddings = get_embeddings()
+    vectors = []
+    for start in range(0, len(texts), batch_size):
+        vectors.extend(embeddings.embed_documents(texts[start:start + batch_size]))
+    if not vectors:
+        return np.empty((0, 0), dtype=np.float32)
+    return np.asarray(vectors, dtype=np.float32)
+
+
+def embedding_cache_stats() -> dict:
+    if _embeddings is None:
+        return {}
+    return _embeddings.stats()
+
+
+def _load_embeddings():
+    # Imported here so that importing this module stays cheap
+    from embedding_cache import CachedEmbeddings, SQLiteEmbeddingStore
+    from langchain_huggingface import HuggingFaceEmbeddings
+
+    if EMBEDDING_THREADS > 0:
+        import torch
+        torch.set_num_threads(EMBEDDING_THREADS)
+
+    logging.info(f"Loading embedding model {EMBEDDING_MODEL_NAME} on {EMBEDDING_DEVICE}")
+    model = HuggingFaceEmbeddings(
+        model_name=EMBEDDING_MODEL_NAME,
+        model_kwargs={"device": EMBEDDING_DEVICE},
+        encode_kwargs={"batch_size": EMBEDDING_BATCH_SIZE},
+    )
+    store = SQLiteEmbeddingStore(EMBEDDING_CACHE_PATH) if EMBEDDING_CACHE_PATH else None
+    return CachedEmbeddings(
+        model,
+        EMBEDDING_MODEL_NAME,
+        max_entries=EMBEDDING_CACHE_ENTRIES,
+        max_bytes=EMBEDDING_CACHE_BYTES,
+        store=store,
+    )
@@ -0,0 +1,91 @@
+import argparse
+import itertools
+import json
+import statistics
+import time
+from typing import Dict, List
+
+from chatbot import MATCH_THRESHOLD, query_db
+from reranking import RETRIEVAL_CONTEXT_TOKENS, RETRIEVAL_DUPLICATE_THRESHOLD, rerank
+from vector_index import load_hybrid_index
+
+# Evaluation set format, one JSON object per line:
+#   {"question": "...", "expected": ["substring of a relevant chunk", ...], "clerkUserId": "optional"}
+# A question counts as a hit when any selected chunk contains any expected
+# substring (case-insensitive).
+
+
+def load_cases(path: str) -> List[Dict]:
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def is_hit(selected: List[Dict], expected: List[str]) -> bool:
+    expected = [e.lower() for e in expected]
+    return any(e in r["content"].lower() for r in selected for e in expected)
+
+
+def percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def report(name: str, hits: List[bool], counts: List[int], timings: List[float]):
+    print(f"{name:<44} hit rate {sum(hits) / len(hits):6.3f}  chunks {statistics.mean(counts):5.2f}  "
+          f"p50 {statistics.median(timings):7.3f} ms  p95 {percentile(timings, 0.95):7.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare retrieval settings on a labelled question set")
+    parser.add_argument("cases", help="JSONL evaluation set")
+    parser.add_argument("--user", default="", help="clerkUserId for cases that do not set one")
+    parser.add_argument("--local", action="store_true", help="Search the in-process index instead of match_blood_test_data")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--fetch-k", type=int, nargs="+", default=[10, 20, 40])
+    parser.add_argument("--min-score", type=float, nargs="+", default=[0.2, 0.3])
+    parser.add_argument("--score-gap", type=float, nargs="+", default=[0.1, 0.2, 1.0])
+    parser.add_argument("--lambda-mult", type=float, nargs="+", default=[0.5, 0.7, 1.0])
+    args = parser.parse_args()
+
+    cases = load_cases(args.cases)
+    indexes = {}
+
+    # Candidates are fetched once per question with the widest setting; every
+    # configuration is then evaluated on a prefix of the same candidate list.
+    fetched, fetch_timings = [], []
+    for case in cases:
+        clerk_user_id = case.get("clerkUserId") or args.user
+        if args.local and clerk_user_id not in indexes:
+            indexes[clerk_user_id] = load_hybrid_index(clerk_user_id)
+        start = time.perf_counter()
+        candidates = query_db(case["question"], clerk_user_id, top_k=max(args.fetch_k),
+                              index=indexes.get(clerk_user_id), threshold=min(args.min_score))
+        fetch_timings.append((time.perf_counter() - start) * 1000)
+        fetched.append(sorted(candidates, key=lambda r: r["similarity"], reverse=True))
+
+    print(f"{len(cases)} questions, candidate fetch p50 {statistics.median(fetch_timings):.1f} ms "
+          f"p95 {percentile(fetch_timings, 0.95):.1f} ms ({'in-process' if args.local else 'pgvector'})")
+
+    hits, counts, timings = [], [], []
+    for case, candidates in zip(cases, fetched, strict=True):
+        start = time.perf_counter()
+        selected = [r for r in candidates if r["similarity"] > MATCH_THRESHOLD][:args.top_k]
+        timings.append((time.perf_counter() - start) * 1000)
+        hits.append(is_hit(selected, case["expected"]))
+        counts.append(len(selected))
+    report(f"similarity threshold={MATCH_THRESHOLD}", hits, counts, timings)
+
+    for fetch_k, min_score, score_gap, lambda_mult in itertools.product(args.fetch_k, args.min_score, args.score_gap, args.lambda_mult):
+        hits, counts, timings = [], [], []
+        for case, candidates in zip(cases, fetched, strict=True):
+            start = time.perf_counter()
+            selected = rerank(candidates[:fetch_k], args.top_k, min_score, score_gap, lambda_mult,
+                              RETRIEVAL_DUPLICATE_THRESHOLD, RETRIEVAL_CONTEXT_TOKENS)
+            timings.append((time.perf_counter() - start) * 1000)
+            hits.append(is_hit(selected, case["expected"]))
+            counts.append(len(selected))
+        report(f"mmr fetch_k={fetch_k} min={min_score} gap={score_gap} lambda={lambda_mult}", hits, counts, timings)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,27 @@
+import asyncio
+import base64
+import concurrent.futures
+import json
+import logging
 import os
+import re
+import sys
+import threading
+import time
+from datetime import datetime
+
+import fitz  # PyMuPDF
+import httplib2
 from dotenv import load_dotenv
-from supabase import create_client, Client
 from google.oauth2.credentials import Credentials
+from google_auth_httplib2 import AuthorizedHttp
 from googleapiclient.discovery import build
-from base64 import urlsafe_b64decode
-import fitz  # PyMuPDF
-from models import BloodTestResults
+from googleapiclient.errors import HttpError
 from langchain_openai import ChatOpenAI
-import concurrent.futures
-import json
-from datetime import datetime
-import sys
-import base64
-import asyncio
-import traceback
-import logging
+from models import BloodTestResults
+from report_cache import ReportCache, file_key, gmail_key
+from scheduler import INTERACTIVE, Busy, get_scheduler
+from supabase import Client, create_client
 
 # Set up logging
 logging.basicConfig(filename='get_email.log', level=logging.INFO)
@@ -33,10 +40,13 @@ logging.info("Supabase client created")
 llm = ChatOpenAI(temperature=0, model="gpt-4o-mini")
 logging.info("Language model initialized")
 
-def fetch_gmail_token():
+def fetch_gmail_token(user_id=None):
     logging.info("Fetching Gmail token...")
     try:
-        response = supabase.table("User").select("gmailAccessToken").execute()
+        query = supabase.table("User").select("gmailAccessToken")
+        if user_id is not None:
+            query = query.eq("id", user_id)
+        response = query.execute()
         if not response.data or 'gmailAccessToken' not in response.data[0]:
             logging.info("No valid token found in the database.")
             return None
@@ -46,54 +56,253 @@ def fetch_gmail_token():
         logging.error(f"An error occurred while fetching Gmail token: {e}")
         return None
 
-def search_emails(token):
+# Gmail fetch settings
+GMAIL_SUBJECT_TERMS = ['blood test', 'blood analysis', 'lab', 'blood', 'hemoglobin']
+GMAIL_QUERY = f"subject:({' OR '.join(GMAIL_SUBJECT_TERMS)})"
+GMAIL_FETCH_WORKERS = int(os.getenv("GMAIL_FETCH_WORKERS", "8"))
+GMAIL_MAX_RETRIES = int(os.getenv("GMAIL_MAX_RETRIES", "5"))  # googleapiclient backs off on 429/5xx
+GMAIL_API_ENDPOINT = os.getenv("GMAIL_API_ENDPOINT")  # e.g. a local fake Gmail server in tests
+# Processed message IDs kept per user to skip messages already parsed on a full resync
+GMAIL_PROCESSED_IDS_LIMIT = int(os.getenv("GMAIL_PROCESSED_IDS_LIMIT", "5000"))
+
+class GmailClient:
+    """One Gmail service shared by a bounded worker pool.
+
+    httplib2 connections are not thread-safe, so each worker thread reuses its
+    own authorized connection while sharing the discovery-built service. The
+    pool lives as long as the client; close() it, or use it as a context
+    manager. map() must not be called from inside a mapped function.
+    """
+
+    def __init__(self, token, max_workers=GMAIL_FETCH_WORKERS):
+        self.credentials = Credentials(token=token)
+        client_options = {"api_endpoint": GMAIL_API_ENDPOINT} if GMAIL_API_ENDPOINT else None
+        self.service = build('gmail', 'v1', credentials=self.credentials,
+                             client_options=client_options, cache_discovery=False)
+        self.max_workers = max_workers
+        self._local = threading.local()
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="gmail")
+
+    def _http(self):
+        http = getattr(self._local, 'http', None)
+        if http is None:
+            http = AuthorizedHttp(self.credentials, http=httplib2.Http(timeout=30))
+            self._local.http = http
+        return http
+
+    def execute(self, request):
+        return request.execute(http=self._http(), num_retries=GMAIL_MAX_RETRIES)
+
+    def map(self, fn, items):
+        return list(self._executor.map(fn, items))
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def search_emails(client, query=GMAIL_QUERY):
     logging.info("Searching emails...")
-    credentials = Credentials(token=token)
-    service = build('gmail', 'v1', credentials=credentials)
-    query = 'subject:(blood test OR blood analysis OR lab OR blood OR hemoglobin)'
-    results = service.users().messages().list(userId='me', q=query).execute()
-    messages = results.get('messages', [])
+    messages = []
+    page_token = None
+    while True:
+        results = client.execute(client.service.users().messages().list(userId='me', q=query, pageToken=page_token))
+        messages.extend(results.get('messages', []))
+        page_token = results.get('nextPageToken')
+        if not page_token:
+            break
     logging.info(f"Found {len(messages)} emails matching the search criteria")
     return messages
 
-def get_email_details(service, message_id):
+def iter_attachment_parts(payload):
+    for part in payload.get('parts', []):
+        if part.get('filename'):
+            yield part
+        yield from iter_attachment_parts(part)
+
+def get_email_message(client, message_id):
     logging.info(f"Getting details for email {message_id}")
     try:
-        message = service.users().messages().get(userId='me', id=message_id).execute()
-        attachments = []
-        for part in message['payload']['parts']:
-            if part['filename']:
-                if 'data' in part['body']:
-                    data = part['body']['data']
-                else:
-                    att_id = part['body']['attachmentId']
-                    att = service.users().messages().attachments().get(userId='me', messageId=message_id, id=att_id).execute()
-                    data = att['data']
-                file_data = base64.urlsafe_b64decode(data.encode('UTF-8'))
-                attachments.append({
-                    'filename': part['filename'],
-                    'data': base64.b64encode(file_data).decode('utf-8')  # Encode as base64 string
-                })
-                logging.info(f"Found attachment: {part['filename']}")
-        logging.info(f"Retrieved {len(attachments)} attachments for email {message_id}")
-        return attachments
+        return client.execute(client.service.users().messages().get(userId='me', id=message_id))
     except Exception as e:
         logging.error(f"An error occurred while processing message {message_id}: {e}")
-    return None
+        return None
+
+def get_attachment_data(client, message_id, part):
+    try:
+        if 'data' in part['body']:
+            data = part['body']['data']
+        else:
+            att_id = part['body']['attachmentId']
+            att = client.execute(client.service.users().messages().attachments().get(userId='me', messageId=message_id, id=att_id))
+            data = att['data']
+        file_data = base64.urlsafe_b64decode(data.encode('UTF-8'))
+        logging.info(f"Found attachment: {part['filename']}")
+        return {
+            'messageId': message_id,
+            'filename': part['filename'],
+            'data': base64.b64encode(file_data).decode('utf-8')  # Encode as base64 string
+        }
+    except Exception as e:
+        logging.error(f"An error occurred while fetching attachment {part.get('filename')} of message {message_id}: {e}")
+        return None
+
+def get_email_details(client, message_id):
+    message = get_email_message(client, message_id)
+    if message is None:
+        return None
+    parts = list(iter_attachment_parts(message['payload']))
+    attachments = [a for a in client.map(lambda part: get_attachment_data(client, message_id, part), parts) if a]
+    logging.info(f"Retrieved {len(attachments)} attachments for email {message_id}")
+    return attachments
+
+def fetch_message_attachments(client, message_ids):
+    """Return the attachments of the given messages and the IDs of messages that could not be fully fetched."""
+    # Fetch all messages concurrently, then all of their attachments concurrently
+    messages = client.map(lambda message_id: get_email_message(client, message_id), message_ids)
+    failed = {message_id for message_id, message in zip(message_ids, messages, strict=True) if message is None}
+    parts = [
+        (message['id'], part)
+        for message in messages if message is not None
+        for part in iter_attachment_parts(message['payload'])
+    ]
+    attachments = client.map(lambda item: get_attachment_data(client, *item), parts)
+    failed.update(message_id for (message_id, _), attachment in zip(parts, attachments, strict=True) if attachment is None)
+    return [a for a in attachments if a], failed
+
+def fetch_attachments(client, message_ids):
+    attachments, _ = fetch_message_attachments(client, message_ids)
+    return attachments
 
 def search_and_retrieve_emails(token):
     logging.info("Searching and retrieving emails...")
-    credentials = Credentials(token=token)
-    service = build('gmail', 'v1', credentials=credentials)
-    messages = search_emails(token)
-    attachments = []
-    for message in messages:
-        email_attachments = get_email_details(service, message['id'])
-        if email_attachments:
-            attachments.extend(email_attachments)
+    with GmailClient(token) as client:
+        messages = search_emails(client)
+        attachments = fetch_attachments(client, [message['id'] for message in messages])
     logging.info(f"Total attachments found: {len(attachments)}")
     return attachments
 
+def load_sync_state(user_id):
+    response = (
+        supabase.table("User")
+        .select("gmailHistoryId, gmailProcessedMessageIds")
+        .eq("id", user_id)
+        .execute()
+    )
+    row = response.data[0] if response.data else {}
+    return {
+        'historyId': row.get('gmailHistoryId'),
+        'processedMessageIds': row.get('gmailProcessedMessageIds') or [],
+    }
+
+def save_sync_state(user_id, state):
+    supabase.table("User").update({
+        'gmailHistoryId': state['historyId'],
+        # Newest last; older IDs are only needed if history expires and a full resync runs
+        'gmailProcessedMessageIds': state['processedMessageIds'][-GMAIL_PROCESSED_IDS_LIMIT:],
+        'gmailLastSyncAt': datetime.utcnow().isoformat(),
+    }).eq("id", user_id).execute()
+
+def list_history_message_ids(client, start_history_id):
+    """Return IDs of messages added since start_history_id, or None if that history has expired."""
+    message_ids = []
+    page_token = None
+    try:
+        while True:
+            results = client.execute(client.service.users().history().list(
+                userId='me', startHistoryId=start_history_id, historyTypes='messageAdded', pageToken=page_token))
+            for record in results.get('history', []):
+                message_ids.extend(added['message']['id'] for added in record.get('messagesAdded', []))
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                break
+    except HttpError as e:
+        if e.resp.status == 404:
+            return None
+        raise
+    return list(dict.fromkeys(message_ids))
+
+def subject_matches(subject):
+    subject = (subject or '').lower()
+    return any(re.search(rf"\b{re.escape(term)}\b", subject) for term in GMAIL_SUBJECT_TERMS)
+
+def filter_matching_messages(client, message_ids):
+    """Apply the GMAIL_QUERY subject filter locally to messages found through history.
+
+    Returns the matching IDs and the IDs whose subject could not be fetched.
+    """
+    failed = set()
+
+    def fetch_subject(message_id):
+        try:
+            message = client.execute(client.service.users().messages().get(
+                userId='me', id=message_id, format='metadata', metadataHeaders=['Subject']))
+        except HttpError as e:
+            # Messages deleted since they were added show up in history but 404 here
+            if e.resp.status != 404:
+                failed.add(message_id)
+            logging.warning(f"Could not fetch message {message_id}: {e}")
+            return None
+        except Exception as e:
+            failed.add(message_id)
+            logging.warning(f"Could not fetch message {message_id}: {e}")
+            return None
+        headers = message.get('payload', {}).get('headers', [])
+        return next((h['value'] for h in headers if h['name'].lower() == 'subject'), None)
+
+    subjects = client.map(fetch_subject, message_ids)
+    return [message_id for message_id, subject in zip(message_ids, subjects, strict=True) if subject_matches(subject)], failed
+
+def retry_messages(sync_state, failed):
+    """Leave failed messages unprocessed and keep the previous history position, so the next sync sees them again."""
+    if not failed:
+        return sync_state
+    logging.info(f"{len(failed)} messages failed and will be retried on the next sync")
+    return {
+        **sync_state,
+        'historyId': sync_state['startHistoryId'],
+        'processedMessageIds': [m for m in sync_state['processedMessageIds'] if m not in failed],
+    }
+
+def sync_mailbox(token, user_id):
+    """Fetch attachments of matching messages added since the user's last sync.
+
+    Falls back to a full search when there is no stored historyId or Gmail no
+    longer has history that far back. Returns the attachments and the sync
+    state to persist once they have been processed. If any message could not
+    be fetched, that state keeps the previous historyId so it is retried.
+    """
+    with GmailClient(token) as client:
+        state = load_sync_state(user_id)
+        # Read the current historyId first so nothing added during this sync is missed next time
+        history_id = client.execute(client.service.users().getProfile(userId='me'))['historyId']
+        processed = set(state['processedMessageIds'])
+
+        message_ids = None
+        failed = set()
+        if state['historyId']:
+            added = list_history_message_ids(client, state['historyId'])
+            if added is None:
+                logging.info("Gmail history window expired, falling back to a full resync")
+            else:
+                message_ids, failed = filter_matching_messages(client, [m for m in added if m not in processed])
+                logging.info(f"Incremental sync found {len(message_ids)} new matching emails")
+        if message_ids is None:
+            message_ids = [message['id'] for message in search_emails(client)]
+
+        new_ids = [m for m in message_ids if m not in processed]
+        attachments, fetch_failed = fetch_message_attachments(client, new_ids)
+        new_state = {
+            'historyId': history_id,
+            'startHistoryId': state['historyId'],
+            'processedMessageIds': state['processedMessageIds'] + new_ids,
+        }
+    return attachments, retry_messages(new_state, failed | fetch_failed)
+
 def format_date(date_string):
     logging.info(f"Formatting date: {date_string}")
     if not date_string:
@@ -167,54 +376,130 @@ def transform_results_to_list_of_dicts(results):
     logging.info("List of dictionaries transformation completed")
     return processed_data
 
-async def process_pdf(file_data, filename):
+# PDF parsing settings
+# How many reports are parsed at once is set by the scheduler's "pdf" queue
+PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", str(os.cpu_count() or 1)))
+
+_pdf_executor = None
+
+def get_pdf_executor():
+    global _pdf_executor
+    if _pdf_executor is None:
+        _pdf_executor = concurrent.futures.ProcessPoolExecutor(max_workers=PDF_EXTRACT_WORKERS)
+    return _pdf_executor
+
+def extract_pdf_text(file_data):
+    # Runs in a worker process; PyMuPDF extraction is CPU-bound
+    document = fitz.open(stream=file_data, filetype="pdf")
+    try:
+        return "".join(page.get_text() for page in document)
+    finally:
+        document.close()
+
+async def process_pdf(file_data, filename, user=None, priority=INTERACTIVE):
     logging.info(f"Processing PDF: {filename}")
     try:
-        # Process PDF data in memory
-        document = fitz.open(stream=file_data, filetype="pdf")
-        text = ""
-        for page in document:
-            text += page.get_text()
+        queued = time.perf_counter()
+        scheduler = get_scheduler()
+        # The in-process queue keeps users fair; the shared slot bounds parses
+        # running in every backend process at once
+        async with scheduler["pdf"].slot(user or "anonymous", priority), scheduler.shared["pdf"].slot(priority):
+            return await parse_pdf(file_data, filename, queued)
+    except Busy:
+        raise
+    except Exception as e:
+        logging.error(f"An error occurred while processing the PDF {filename}: {e}")
+        return None
 
-        logging.info(f"Extracted text from PDF {filename}: {text[:100]}...")  # Print first 100 characters
+async def parse_pdf(file_data, filename, queued):
+    # Process PDF data in memory
+    start = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    text = await loop.run_in_executor(get_pdf_executor(), extract_pdf_text, file_data)
+    extracted_at = time.perf_counter()
 
-        prompt = f"""
-        The following is a block of text extracted from a blood test report. Extract the relevant blood test results and the date of the report. Structure them according to the following schema:
+    logging.info(f"Extracted text from PDF {filename}: {text[:100]}...")  # Print first 100 characters
 
-        {BloodTestResults.schema_json(indent=2)}
+    prompt = f"""
+    The following is a block of text extracted from a blood test report. Extract the relevant blood test results and the date of the report. Structure them according to the following schema:
 
-        Please do not specify that data is in JSON format.
+    {BloodTestResults.schema_json(indent=2)}
 
-        Text:
-        {text}
+    Please do not specify that data is in JSON format.
 
-        Structured Results:
-        """
+    Text:
+    {text}
 
-        logging.info("Sending prompt to language model...")
-        response = llm.invoke(prompt)
-        logging.info(f"LLM response for {filename}: {response.content}")
-        logging.info(f"Received response from language model for {filename}")
+    Structured Results:
+    """
 
-        extracted_data = json.loads(response.content)
-        
-        for key, value in extracted_data.items():
-            if isinstance(value, bytes):
-                extracted_data[key] = value.decode('utf-8', errors='replace')
+    logging.info("Sending prompt to language model...")
+    response = await llm.ainvoke(prompt)
+    finished_at = time.perf_counter()
+    logging.info(f"LLM response for {filename}: {response.content}")
+    logging.info(f"Received response from language model for {filename}")
+    logging.info(
+        f"Timing for {filename}: queue {start - queued:.2f}s, extract {extracted_at - start:.2f}s, "
+        f"llm {finished_at - extracted_at:.2f}s"
+    )
+
+    extracted_data = json.loads(response.content)
+    
+    for key, value in extracted_data.items():
+        if isinstance(value, bytes):
+            extracted_data[key] = value.decode('utf-8', errors='replace')
+
+    logging.info(f"Successfully processed {filename}")
+    return extracted_data
 
-        logging.info(f"Successfully processed {filename}")
-        return extracted_data
+_report_cache = None
+
+def get_report_cache():
+    global _report_cache
+    if _report_cache is None:
+        _report_cache = ReportCache()
+    return _report_cache
+
+def is_valid_report(extracted_data):
+    try:
+        BloodTestResults.parse_obj(extracted_data)
+        return True
     except Exception as e:
-        logging.error(f"An error occurred while processing the PDF {filename}: {e}")
-        return None
+        logging.warning(f"Parsed report does not match BloodTestResults, not caching it: {e}")
+        return False
 
-async def process_attachments():
+async def process_pdf_cached(file_data, filename, message_id=None, user=None, priority=INTERACTIVE):
+    """Return a cached parse for this attachment or upload, running process_pdf only on a miss."""
+    keys = [gmail_key(message_id, file_data)] if message_id else []
+    keys.append(file_key(file_data))
+    cache = get_report_cache()
+    cached = cache.get(*keys)
+    if cached is not None:
+        logging.info(f"Report cache hit for {filename}")
+        return cached
+    extracted_data = await process_pdf(file_data, filename, user, priority)
+    if extracted_data is not None and is_valid_report(extracted_data):
+        cache.put(extracted_data, *keys)
+    return extracted_data
+
+async def process_email_attachments(attachments, user=None, priority=INTERACTIVE):
+    start = time.perf_counter()
     tasks = []
-    for attachment in email_attachments:
-        task = process_pdf(base64.b64decode(attachment['data']), attachment['filename'])
+    for attachment in attachments:
+        task = process_pdf_cached(base64.b64decode(attachment['data']), attachment['filename'], attachment.get('messageId'), user, priority)
         tasks.append(task)
     processed_pdfs = await asyncio.gather(*tasks)
-    
+    logging.info(f"Processed {len(tasks)} attachments in {time.perf_counter() - start:.2f}s")
+    return processed_pdfs
+
+def commit_sync_state(user_id, sync_state, attachments, processed_pdfs):
+    # Leave messages with failed attachments unprocessed so the next sync retries them
+    failed = {a['messageId'] for a, pdf in zip(attachments, processed_pdfs, strict=True) if pdf is None}
+    save_sync_state(user_id, retry_messages(sync_state, failed))
+
+async def process_attachments():
+    processed_pdfs = await process_email_attachments(email_attachments)
+
     for i, attachment in enumerate(email_attachments):
         raw_attachments.append({
             'filename': attachment['filename'],
@@ -226,7 +511,7 @@ async def process_attachments():
 async def process_single_file(file_data, filename):
     logging.info(f"Processing single file: {filename}")
     try:
-        processed_pdf = await process_pdf(file_data, filename)
+        processed_pdf = await process_pdf_cached(file_data, filename)
         if processed_pdf:
             raw_attachment = {
                 'filename': filename,
@@ -242,13 +527,19 @@ async def process_single_file(file_data, filename):
 # Main execution
 if __name__ == "__main__":
     try:
-        if len(sys.argv) > 2:  # Check if file data is provided as an argument
+        args = sys.argv[1:]
+        # --incremental: only process emails added since the user's last sync
+        incremental = '--incremental' in args
+        if incremental:
+            args.remove('--incremental')
+
+        if len(args) > 1:  # Check if file data is provided as an argument
             # Single file processing
-            filename = sys.argv[1]
-            file_data = base64.b64decode(sys.argv[2])
+            filename = args[0]
+            file_data = base64.b64decode(args[1])
             
             loop = asyncio.get_event_loop()
-            processed_pdf = loop.run_until_complete(process_pdf(file_data, filename))
+            processed_pdf = loop.run_until_complete(process_pdf_cached(file_data, filename))
             
             if processed_pdf:
                 results = [processed_pdf]
@@ -262,16 +553,26 @@ if __name__ == "__main__":
                 raw_attachments = []
         else:
             # Email processing (existing code)
-            token = fetch_gmail_token()
+            user_id = args[0] if args else None
+            if incremental and user_id is None:
+                raise ValueError("Incremental sync requires a user ID.")
+            token = fetch_gmail_token(user_id)
             if not token:
                 raise ValueError("No valid token available.")
-            email_attachments = search_and_retrieve_emails(token)
+            sync_state = None
+            if incremental:
+                email_attachments, sync_state = sync_mailbox(token, user_id)
+            else:
+                email_attachments = search_and_retrieve_emails(token)
             raw_attachments = []
             
             loop = asyncio.get_event_loop()
             processed_pdfs = loop.run_until_complete(process_attachments())
             
             results = [pdf for pdf in processed_pdfs if pdf is not None]
+
+            if sync_state is not None:
+                commit_sync_state(user_id, sync_state, email_attachments, processed_pdfs)
         
         processed_results = transform_results_to_list_of_dicts(results)
         
@@ -279,5 +580,8 @@ if __name__ == "__main__":
             "bloodTestResults": processed_results,
             "rawAttachments": raw_attachments
         }))
+    except Busy as e:
+        logging.warning(f"Rejected report parsing: {e}")
+        print(json.dumps({"error": "busy", "bloodTestResults": [], "rawAttachments": []}))
     except Exception as e:
         print(json.dumps({"error": str(e), "bloodTestResults": [], "rawAttachments": []}))
\ No newline at end of file
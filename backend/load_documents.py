@@ -1,13 +1,22 @@
-import os
-from typing import List, Dict
-from langchain_huggingface import HuggingFaceEmbeddings
-from supabase import create_client, Client
+import argparse
+import glob
+import hashlib
+import itertools
 import json
-from dotenv import load_dotenv
-import fitz  # PyMuPDF
+import logging
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
 from datetime import datetime
+from typing import Deque, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import fitz  # PyMuPDF
+from dotenv import load_dotenv
+from embeddings import embed_texts, get_embeddings
 from langchain_experimental.text_splitter import SemanticChunker
-import logging
+from supabase import Client, create_client
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -19,29 +28,110 @@ url: str = os.environ.get("NEXT_PUBLIC_SUPABASE_URL")
 key: str = os.environ.get("NEXT_PUBLIC_SUPABASE_ANON_KEY")
 supabase: Client = create_client(url, key)
 
-# HuggingFace Embeddings setup
-hf_embeddings = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
+# Streaming ingestion settings
+INGEST_BATCH_SIZE = int(os.environ.get("INGEST_BATCH_SIZE", "64"))
+INGEST_WINDOW_CHARS = int(os.environ.get("INGEST_WINDOW_CHARS", "20000"))
+INGEST_CHECKPOINT_DIR = os.environ.get("INGEST_CHECKPOINT_DIR", ".ingest_checkpoints")
+INGEST_INSERT_RETRIES = int(os.environ.get("INGEST_INSERT_RETRIES", "3"))
+# Pages per extraction task; at most `workers` tasks are extracted ahead of the encoder
+INGEST_PAGES_PER_TASK = int(os.environ.get("INGEST_PAGES_PER_TASK", "16"))
 
-# Semantic Chunker using HuggingFace embeddings for reference books
-openai_text_splitter = SemanticChunker(
-    hf_embeddings, 
-    breakpoint_threshold_type="gradient"
-)
+_text_splitter = None
 
-def chunk_and_embed_reference_book(text: str) -> List[Dict]:
-    chunks = openai_text_splitter.create_documents([text])
-    
-    embedded_chunks = []
-    for chunk in chunks:
-        vector = hf_embeddings.embed_query(chunk.page_content)
-        embedded_chunks.append({
-            "content": chunk.page_content,
-            "embedding": vector,
-            "metadata": json.dumps({"source": "reference_book", **chunk.metadata}),
-            "accessType": "global"
-        })
-    
-    return embedded_chunks
+def get_text_splitter() -> SemanticChunker:
+    # Semantic Chunker using the shared HuggingFace embeddings for reference books
+    global _text_splitter
+    if _text_splitter is None:
+        _text_splitter = SemanticChunker(
+            get_embeddings(),
+            breakpoint_threshold_type="gradient"
+        )
+    return _text_splitter
+
+def reference_chunk_row(content: str, vector, metadata: Dict) -> Dict:
+    return {
+        "content": content,
+        "embedding": vector,
+        "metadata": {"source": "reference_book", **metadata},
+        "accessType": "global"
+    }
+
+def iter_pdf_pages(file_path: str) -> Iterator[str]:
+    doc = fitz.open(file_path)
+    try:
+        for page in doc:
+            yield page.get_text()
+    finally:
+        doc.close()
+
+def iter_chunks(pages: Iterable[str], window_chars: int = INGEST_WINDOW_CHARS) -> Iterator[str]:
+    """Semantically chunk a stream of page texts over a sliding window.
+
+    The last chunk of each window may stop mid-section, so it is carried into
+    the next window instead of being emitted. Memory stays bounded by roughly
+    one window plus one page.
+    """
+    buffer = ""
+    for text in pages:
+        buffer += text
+        if len(buffer) < window_chars:
+            continue
+        chunks = get_text_splitter().split_text(buffer)
+        if len(chunks) > 1 and len(chunks[-1]) < window_chars:
+            yield from chunks[:-1]
+            buffer = chunks[-1]
+        else:
+            yield from chunks
+            buffer = ""
+    if buffer.strip():
+        yield from get_text_splitter().split_text(buffer)
+
+def iter_batches(items: Iterable, batch_size: int) -> Iterator[List]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def file_sha256(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _checkpoint_path(file_hash: str) -> str:
+    return os.path.join(INGEST_CHECKPOINT_DIR, f"{file_hash}.json")
+
+def read_checkpoint(file_hash: str) -> Dict:
+    try:
+        with open(_checkpoint_path(file_hash)) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {"chunks": 0, "complete": False}
+
+def write_checkpoint(file_hash: str, checkpoint: Dict):
+    os.makedirs(INGEST_CHECKPOINT_DIR, exist_ok=True)
+    path = _checkpoint_path(file_hash)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, path)
+
+def insert_with_retry(chunks: List[Dict], retries: int = INGEST_INSERT_RETRIES):
+    for attempt in range(1, retries + 1):
+        try:
+            insert_to_db(chunks)
+            return
+        except Exception:
+            if attempt == retries:
+                raise
+            delay = 2 ** attempt
+            logging.warning(f"Insert attempt {attempt} failed, retrying in {delay}s")
+            time.sleep(delay)
 
 def insert_to_db(chunks: List[Dict]):
     current_time = datetime.utcnow().isoformat()
@@ -58,27 +148,188 @@ def insert_to_db(chunks: List[Dict]):
         logging.error(f"Error during insert: {str(e)}")
         raise
 
-def load_reference_book(file_path: str):
+def ingest_reference_book(file_path: str, batch_size: int = INGEST_BATCH_SIZE,
+                          pages: Optional[Iterable[str]] = None, file_hash: Optional[str] = None) -> Dict:
+    """Stream a PDF through page extraction -> chunking -> batched embedding -> batched insert.
+
+    Progress is checkpointed after every committed batch, keyed by the file's
+    SHA-256, so an interrupted load resumes after the last committed chunk.
+    Pages may be passed in when they were already extracted elsewhere.
+    Returns page, chunk and inserted row counts for this run.
+    """
+    file_hash = file_hash or file_sha256(file_path)
+    stats = {"pages": 0, "chunks": 0, "rows": 0}
+    checkpoint = read_checkpoint(file_hash)
+    if checkpoint.get("complete"):
+        logging.info(f"{file_path} was already ingested ({checkpoint['chunks']} chunks), skipping")
+        return stats
+    if checkpoint["chunks"]:
+        logging.info(f"Resuming {file_path} after {checkpoint['chunks']} committed chunks")
+
+    def counted_pages():
+        for text in (pages if pages is not None else iter_pdf_pages(file_path)):
+            stats["pages"] += 1
+            yield text
+
+    def counted_chunks():
+        for chunk in iter_chunks(counted_pages()):
+            stats["chunks"] += 1
+            yield chunk
+
+    chunks = counted_chunks()
+    # Chunks before the checkpoint were already inserted; re-chunking is needed
+    # to find the resume point but embedding and insert are skipped. Counting
+    # chunks rather than batches keeps this right if --batch-size changed.
+    for _ in itertools.islice(chunks, checkpoint["chunks"]):
+        pass
+    for batch in iter_batches(chunks, batch_size):
+        vectors = embed_texts(batch)
+        metadata = {"document": os.path.basename(file_path), "document_hash": file_hash}
+        rows = [
+            reference_chunk_row(content, vector, {**metadata, "chunk_index": checkpoint["chunks"] + i})
+            for i, (content, vector) in enumerate(zip(batch, vectors, strict=True))
+        ]
+        insert_with_retry(rows)
+        stats["rows"] += len(rows)
+        checkpoint["chunks"] += len(rows)
+        write_checkpoint(file_hash, checkpoint)
+
+    checkpoint["complete"] = True
+    write_checkpoint(file_hash, checkpoint)
+    return stats
+
+def expand_document_paths(patterns: List[str]) -> List[str]:
+    """Resolve files, directories (searched recursively) and glob patterns to PDF paths."""
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = glob.glob(os.path.join(pattern, "**", "*.pdf"), recursive=True)
+        else:
+            matches = glob.glob(pattern, recursive=True)
+        paths.extend(m for m in sorted(matches) if m.lower().endswith(".pdf"))
+    # Keep the first occurrence of each path
+    return list(dict.fromkeys(os.path.abspath(p) for p in paths))
+
+def document_info(file_path: str) -> Tuple[str, str, int]:
+    """Process-pool worker: hash the file and count its pages."""
+    doc = fitz.open(file_path)
     try:
-        # Open the PDF file
-        doc = fitz.open(file_path)
-        
-        # Extract text from all pages
-        content = ""
-        for page in doc:
-            content += page.get_text()
-        
-        # Close the document
+        page_count = doc.page_count
+    finally:
         doc.close()
-        
-        # Chunk and embed the content
-        chunks = chunk_and_embed_reference_book(content)
-        
-        insert_to_db(chunks)
-        logging.info(f"Reference book loaded and stored. Created {len(chunks)} chunks.")
-    except Exception as e:
-        logging.error(f"Error loading PDF: {str(e)}")
+    return file_path, file_sha256(file_path), page_count
+
+def extract_pages(file_path: str, start: int, stop: int) -> List[str]:
+    """Process-pool worker: extract the texts of pages [start, stop)."""
+    doc = fitz.open(file_path)
+    try:
+        return [doc[i].get_text() for i in range(start, stop)]
+    finally:
+        doc.close()
+
+def iter_extracted_pages(executor: Executor, file_path: str, page_count: int, in_flight: int,
+                         pages_per_task: int = INGEST_PAGES_PER_TASK) -> Iterator[str]:
+    """Yield a document's page texts in order while the pool extracts up to in_flight page ranges ahead."""
+    starts = iter(range(0, page_count, pages_per_task))
+    pending: Deque[Future] = deque()
+
+    def submit():
+        while len(pending) < in_flight:
+            start = next(starts, None)
+            if start is None:
+                return
+            pending.append(executor.submit(extract_pages, file_path, start, min(start + pages_per_task, page_count)))
+
+    submit()
+    while pending:
+        texts = pending.popleft().result()
+        submit()
+        yield from texts
+
+def document_already_ingested(file_hash: str) -> bool:
+    # A local checkpoint for an unfinished load takes precedence so partially
+    # inserted documents are resumed rather than skipped.
+    checkpoint = read_checkpoint(file_hash)
+    if checkpoint.get("complete"):
+        return True
+    if checkpoint["chunks"]:
+        return False
+    # Only matches rows whose metadata is a JSON object; rows stored as a JSON
+    # string by older versions need the metadata migration in migrate_metadata.sql
+    response = (
+        supabase.table("BloodTestData")
+        .select("id")
+        .eq("metadata->>document_hash", file_hash)
+        .limit(1)
+        .execute()
+    )
+    return bool(response.data)
+
+def ingest_documents(file_paths: List[str], workers: Optional[int] = None, batch_size: int = INGEST_BATCH_SIZE) -> Dict:
+    """Extract text in a process pool and embed/insert on the shared encoder in this process.
+
+    Documents are embedded one at a time. While one is embedded, the pool
+    extracts its next page ranges and hashes the documents after it, so at
+    most about workers * INGEST_PAGES_PER_TASK page texts are held at once.
+    """
+    totals: Dict[str, float] = {"documents": 0, "skipped": 0, "failed": 0, "pages": 0, "chunks": 0, "rows": 0}
+    start = time.perf_counter()
+    workers = workers or os.cpu_count() or 1
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # Hashes and page counts are small; look a few documents ahead for them
+        infos: Deque[Future] = deque()
+        remaining = iter(file_paths)
+
+        def refill():
+            for file_path in itertools.islice(remaining, workers - len(infos)):
+                infos.append(executor.submit(document_info, file_path))
+
+        refill()
+        while infos:
+            future = infos.popleft()
+            refill()
+            try:
+                file_path, file_hash, page_count = future.result()
+                if document_already_ingested(file_hash):
+                    logging.info(f"Skipping {file_path}: content hash already ingested")
+                    totals["skipped"] += 1
+                    continue
+                pages = iter_extracted_pages(executor, file_path, page_count, workers)
+                stats = ingest_reference_book(file_path, batch_size, pages=pages, file_hash=file_hash)
+                totals["documents"] += 1
+                for key in ("pages", "chunks", "rows"):
+                    totals[key] += stats[key]
+            except Exception as e:
+                logging.error(f"Error ingesting document: {e}")
+                totals["failed"] += 1
+
+    totals["seconds"] = time.perf_counter() - start
+    return totals
+
+def main():
+    parser = argparse.ArgumentParser(description="Load reference PDFs into BloodTestData")
+    parser.add_argument("paths", nargs="*", default=["public/blood_analysis_guidelines.pdf"],
+                        help="PDF files, directories or glob patterns")
+    parser.add_argument("--workers", type=int, default=None, help="Text extraction processes (default: CPU count)")
+    parser.add_argument("--batch-size", type=int, default=INGEST_BATCH_SIZE, help="Chunks per embedding/insert batch")
+    args = parser.parse_args()
+
+    file_paths = expand_document_paths(args.paths)
+    if not file_paths:
+        logging.error("No PDF documents matched the given paths")
+        sys.exit(1)
+
+    logging.info(f"Ingesting {len(file_paths)} documents")
+    totals = ingest_documents(file_paths, args.workers, args.batch_size)
+    seconds = max(totals["seconds"], 1e-9)
+    print(
+        f"Ingested {totals['documents']} documents ({totals['skipped']} skipped, {totals['failed']} failed) "
+        f"in {totals['seconds']:.1f}s: "
+        f"{totals['pages'] / seconds:.1f} pages/s, "
+        f"{totals['chunks'] / seconds:.1f} chunks/s, "
+        f"{totals['rows'] / seconds:.1f} rows/s"
+    )
 
 if __name__ == "__main__":
-    reference_book_path = "/Users/maksymliamin/Desktop/Work/project_saved/public/blood_analysis_guidelines.pdf"
-    load_reference_book(reference_book_path)
\ No newline at end of file
+    main()
@@ -1,10 +1,11 @@
 import os
-from typing import List, Dict
-from langchain_huggingface import HuggingFaceEmbeddings
-from supabase import create_client
-import json
-from dotenv import load_dotenv
 from datetime import datetime
+from typing import Dict, List, Tuple
+
+from dotenv import load_dotenv
+from embeddings import embed_texts, get_embeddings
+from supabase import create_client
+from vector_index import add_user_rows
 
 load_dotenv()
 
@@ -13,32 +14,38 @@ url = os.environ.get("NEXT_PUBLIC_SUPABASE_URL")
 key = os.environ.get("NEXT_PUBLIC_SUPABASE_ANON_KEY")
 supabase = create_client(url, key)
 
-# HuggingFace Embeddings setup for conversation history and blood test results
-hf_embeddings = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
-
-def embed_conversation_message(message: Dict) -> Dict:
-    vector = hf_embeddings.embed_query(message['content'])
+def conversation_message_row(message: Dict, vector: List[float]) -> Dict:
     return {
         "content": message['content'],
         "embedding": vector,  # Store as vector directly
-        "metadata": json.dumps({
+        # Stored as a JSON object so it can be filtered and indexed server-side
+        "metadata": {
             "source": "conversation",
             "type": "message",
             "message_type": message['type'],
             "timestamp": message['timestamp']
-        })
+        }
     }
 
+def embed_conversation_message(message: Dict) -> Dict:
+    vector = get_embeddings().embed_query(message['content'])
+    return conversation_message_row(message, vector)
+
+def embed_conversation_messages(messages: List[Dict]) -> List[Dict]:
+    # One batched forward pass instead of one embed_query per message
+    vectors = embed_texts([message['content'] for message in messages])
+    return [conversation_message_row(message, vector.tolist()) for message, vector in zip(messages, vectors, strict=True)]
+
 def embed_blood_test_results(results: str) -> Dict:
-    vector = hf_embeddings.embed_query(results)
+    vector = get_embeddings().embed_query(results)
     return {
         "content": results,
         "embedding": vector,  # Store as vector directly
-        "metadata": json.dumps({
+        "metadata": {
             "source": "blood_test",
             "type": "test_results",
             "timestamp": datetime.utcnow().isoformat()
-        })
+        }
     }
 
 def upsert_to_db(chunks: List[Dict], clerk_user_id: str):
@@ -49,12 +56,30 @@ def upsert_to_db(chunks: List[Dict], clerk_user_id: str):
         chunk["updatedAt"] = current_time
     try:
         supabase.table("BloodTestData").upsert(chunks).execute()
+        add_user_rows(chunks)
     except Exception as e:
         print(f"Error upserting to BloodTestData: {str(e)}")
 
+def store_conversation_batch(batch: List[Tuple[Dict, str]]) -> List[Dict]:
+    """Embed and upsert (message, clerk_user_id) pairs from any number of users in one round trip.
+
+    Unlike upsert_to_db this raises on failure so callers can retry.
+    Returns the stored rows.
+    """
+    current_time = datetime.utcnow().isoformat()
+    rows = embed_conversation_messages([message for message, _ in batch])
+    for row, (_, clerk_user_id) in zip(rows, batch, strict=True):
+        row["clerkUserId"] = clerk_user_id
+        row["createdAt"] = current_time
+        row["updatedAt"] = current_time
+    supabase.table("BloodTestData").upsert(rows).execute()
+    # Keep live in-process indexes in step with what was just written
+    add_user_rows(rows)
+    return rows
+
 def load_conversation_history(conversation: List[Dict], clerk_user_id: str):
     try:
-        embedded_messages = [embed_conversation_message(message) for message in conversation]
+        embedded_messages = embed_conversation_messages(conversation)
         upsert_to_db(embedded_messages, clerk_user_id)
     except Exception as e:
         print(f"Error loading conversation history: {str(e)}")
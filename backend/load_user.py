@@ -1,7 +1,6 @@
 import os
 from dotenv import load_dotenv
 from supabase import create_client
-from langchain_huggingface import HuggingFaceEmbeddings
 import json
 import logging
 
@@ -15,9 +14,6 @@ url = os.environ.get("NEXT_PUBLIC_SUPABASE_URL")
 key = os.environ.get("NEXT_PUBLIC_SUPABASE_ANON_KEY")
 supabase = create_client(url, key)
 
-# HuggingFace Embeddings setup
-hf_embeddings = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
-
 def load_user_data(clerk_user_id, blood_test_results):
     logging.info(f"Loading user data for {clerk_user_id}")
     if blood_test_results is None:
@@ -23,4 +23,28 @@ class BloodTestResults(BaseModel):
     PDW: Optional[float]  # Platelet Distribution Width
     MPV: Optional[float]  # Mean Platelet Volume
     P_LCR: Optional[float]  # Platelet Large Cell Ratio
-    PCT: Optional[float]  # Plateletcrit
\ No newline at end of file
+    PCT: Optional[float]  # Plateletcrit
+
+# Dashboard column name and unit for each BloodTestResults analyte
+ANALYTES = {
+    'WBC': ('WBC', '10^3/µL'),
+    'RBC': ('RBC', '10^6/µL'),
+    'HGB': ('HGB', 'g/dL'),
+    'HCT': ('HCT', '%'),
+    'MCV': ('MCV', 'fL'),
+    'MCH': ('MCH', 'pg'),
+    'MCHC': ('MCHC', 'g/dL'),
+    'PLT': ('PLT', '10^3/µL'),
+    'LYM_percent': ('LYM%', '%'),
+    'MXD_percent': ('MXD%', '%'),
+    'NEUT_percent': ('NEUT%', '%'),
+    'LYM_count': ('LYM#', '10^3/µL'),
+    'MXD_count': ('MXD#', '10^3/µL'),
+    'NEUT_count': ('NEUT#', '10^3/µL'),
+    'RDW_SD': ('RDW-SD', 'fL'),
+    'RDW_CV': ('RDW-CV', '%'),
+    'PDW': ('PDW', 'fL'),
+    'MPV': ('MPV', 'fL'),
+    'P_LCR': ('P-LCR', '%'),
+    'PCT': ('PCT', '%'),
+}
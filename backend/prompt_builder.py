@@ -0,0 +1,170 @@
+import logging
+import os
+from typing import Callable, Dict, List, Union
+
+from models import ANALYTES
+
+PROMPT_TOKEN_BUDGET = int(os.environ.get("PROMPT_TOKEN_BUDGET", "3000"))
+PROMPT_MAX_HISTORY_MESSAGES = int(os.environ.get("PROMPT_MAX_HISTORY_MESSAGES", "10"))
+PROMPT_MAX_MESSAGE_TOKENS = int(os.environ.get("PROMPT_MAX_MESSAGE_TOKENS", "300"))
+
+# Sections are filled in this order. Each may use at most its share of the
+# budget; whatever a section leaves unused flows to the ones after it.
+SECTION_PRIORITY = [
+    ("question", 1.0),
+    ("blood_test_results", 0.4),
+    ("context", 0.3),
+    ("history", 1.0),
+]
+
+NO_RESULTS = "No blood test results available from email/file"
+ELLIPSIS = " ..."
+
+
+class TokenCounter:
+    """tiktoken counts when available, otherwise a ~4 characters per token estimate."""
+
+    def __init__(self, encoding_name: str = "cl100k_base"):
+        try:
+            import tiktoken
+            self._encoding = tiktoken.get_encoding(encoding_name)
+        except Exception as e:
+            logging.warning(f"tiktoken unavailable, estimating token counts from length: {e}")
+            self._encoding = None
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        if self._encoding is None:
+            return (len(text) + 3) // 4
+        return len(self._encoding.encode(text, disallowed_special=()))
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Cut text to at most max_tokens, including the trailing ellipsis."""
+        if max_tokens <= 0:
+            return ""
+        if self.count(text) <= max_tokens:
+            return text
+        keep = max_tokens - self.count(ELLIPSIS)
+        if keep <= 0:
+            return ""
+        if self._encoding is None:
+            return text[:keep * 4].rstrip() + ELLIPSIS
+        tokens = self._encoding.encode(text, disallowed_special=())
+        return self._encoding.decode(tokens[:keep]).rstrip() + ELLIPSIS
+
+
+def _cell(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, (int, float)):
+        return f"{value:g}"
+    return str(value)
+
+
+def results_table(rows: List[Dict]) -> str:
+    """Encode dashboard result rows as a pipe-separated table, newest first, skipping empty columns."""
+    columns = [column for column, _ in ANALYTES.values() if any(row.get(column) is not None for row in rows)]
+    lines = ["|".join(["Date"] + columns)]
+    for row in reversed(rows):
+        lines.append("|".join([_cell(row.get("Date"))] + [_cell(row.get(column)) for column in columns]))
+    return "\n".join(lines)
+
+
+class PromptBuilder:
+    """Fits the chatbot prompt sections into a token budget.
+
+    build() takes the raw inputs gathered by the chain and returns the
+    formatted template variables. Per-section token counts for the last build
+    are kept in last_stats.
+    """
+
+    def __init__(self, template: str, budget: int = PROMPT_TOKEN_BUDGET,
+                 max_history_messages: int = PROMPT_MAX_HISTORY_MESSAGES,
+                 max_message_tokens: int = PROMPT_MAX_MESSAGE_TOKENS):
+        self.counter = TokenCounter()
+        self.budget = budget
+        self.max_history_messages = max_history_messages
+        self.max_message_tokens = max_message_tokens
+        # Fixed instructions in the template count against the budget too
+        self.template_tokens = self.counter.count(template)
+        self.last_stats: Dict[str, int] = {}
+
+    def _fit_question(self, question: str, limit: int) -> str:
+        return self.counter.truncate(question, limit)
+
+    def _fit_lines(self, lines: List[str], limit: int, omitted: Callable[[int], str], hidden: int = 0) -> List[str]:
+        """Keep lines in order while they fit, ending with omitted(n) if n lines were dropped.
+
+        hidden counts lines already dropped by the caller. The omission line
+        counts against limit. Returns [] if not even the first line fits.
+        """
+        kept: List[str] = []
+        used = 0
+        for i, line in enumerate(lines):
+            line_tokens = self.counter.count(line) + 1
+            dropped = hidden + len(lines) - i - 1
+            note_tokens = self.counter.count(omitted(dropped)) + 1 if dropped else 0
+            if used + line_tokens + note_tokens > limit:
+                break
+            kept.append(line)
+            used += line_tokens
+        dropped = hidden + len(lines) - len(kept)
+        if kept and dropped:
+            kept.append(omitted(dropped))
+        return kept
+
+    def _fit_results(self, results: Union[str, List[Dict], None], limit: int) -> str:
+        if not results:
+            return NO_RESULTS
+        if isinstance(results, str):
+            # A trend summary: report line and column header, then one row per analyte
+            text, header, noun = results, 2, "more analytes"
+        else:
+            # One row per report, newest first
+            text, header, noun = results_table(results), 1, "older reports"
+        if self.counter.count(text) <= limit:
+            return text
+        lines = text.split("\n")
+        head = "\n".join(lines[:header])
+        rows = self._fit_lines(lines[header:], limit - self.counter.count(head) - 1,
+                               lambda n: f"... {n} {noun} omitted")
+        if not rows:
+            return self.counter.truncate(text, limit)
+        return "\n".join([head] + rows)
+
+    def _fit_context(self, context: str, limit: int) -> str:
+        return self.counter.truncate(context or "", limit)
+
+    def _fit_history(self, messages: List, limit: int) -> str:
+        messages = messages or []
+        recent = messages[-self.max_history_messages:] if self.max_history_messages else []
+        # Walk back from the newest message so older turns are the ones dropped
+        newest_first = [
+            f"{m.type.capitalize()}: {self.counter.truncate(m.content, self.max_message_tokens)}"
+            for m in reversed(recent)
+        ]
+        lines = self._fit_lines(newest_first, limit, lambda n: f"[{n} earlier messages omitted]",
+                                hidden=len(messages) - len(recent))
+        return "\n".join(reversed(lines))
+
+    def build(self, inputs: Dict) -> Dict[str, str]:
+        fitters: Dict[str, Callable] = {
+            "question": self._fit_question,
+            "blood_test_results": self._fit_results,
+            "context": self._fit_context,
+            "history": self._fit_history,
+        }
+        remaining = max(self.budget - self.template_tokens, 0)
+        sections = {}
+        stats = {"template": self.template_tokens}
+        for name, share in SECTION_PRIORITY:
+            limit = min(remaining, int(self.budget * share))
+            sections[name] = fitters[name](inputs.get(name), limit)
+            stats[name] = self.counter.count(sections[name])
+            remaining -= stats[name]
+        stats["total"] = sum(stats.values())
+        stats["budget"] = self.budget
+        self.last_stats = stats
+        logging.info(f"Prompt token counts: {stats}")
+        return sections
@@ -0,0 +1,57 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from typing import Dict, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+REPORT_CACHE_PATH = os.getenv("REPORT_CACHE_PATH", ".report_cache.sqlite3")
+
+
+def file_key(file_data: bytes) -> str:
+    return f"sha256:{hashlib.sha256(file_data).hexdigest()}"
+
+
+def gmail_key(message_id: str, file_data: bytes) -> str:
+    return f"gmail:{message_id}:{hashlib.sha256(file_data).hexdigest()}"
+
+
+class ReportCache:
+    """Parsed lab reports keyed by Gmail message + attachment hash and by file SHA-256."""
+
+    def __init__(self, path: str = REPORT_CACHE_PATH):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS reports ("
+            "key TEXT PRIMARY KEY, result TEXT NOT NULL, "
+            "createdAt TEXT DEFAULT CURRENT_TIMESTAMP)"
+        )
+        self._conn.commit()
+        self._lock = threading.Lock()
+
+    def get(self, *keys: str) -> Optional[Dict]:
+        with self._lock:
+            for key in keys:
+                row = self._conn.execute("SELECT result FROM reports WHERE key = ?", (key,)).fetchone()
+                if row:
+                    return json.loads(row[0])
+        return None
+
+    def put(self, result: Dict, *keys: str):
+        data = json.dumps(result)
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO reports (key, result) VALUES (?, ?)",
+                [(key, data) for key in keys],
+            )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,97 @@
+import logging
+import os
+from typing import Dict, List, Optional
+
+import numpy as np
+from prompt_builder import PROMPT_TOKEN_BUDGET, TokenCounter
+from vector_index import normalize, parse_vector
+
+# Defaults for SupabaseRetriever in "mmr" mode. MiniLM cosine scores for a
+# relevant chunk are typically 0.3-0.7, so candidates are over-fetched with a
+# low floor and trimmed here instead of with a fixed high threshold.
+RETRIEVAL_FETCH_K = int(os.environ.get("RETRIEVAL_FETCH_K", "20"))
+RETRIEVAL_MIN_SCORE = float(os.environ.get("RETRIEVAL_MIN_SCORE", "0.25"))
+RETRIEVAL_SCORE_GAP = float(os.environ.get("RETRIEVAL_SCORE_GAP", "0.15"))
+RETRIEVAL_MMR_LAMBDA = float(os.environ.get("RETRIEVAL_MMR_LAMBDA", "0.7"))
+RETRIEVAL_DUPLICATE_THRESHOLD = float(os.environ.get("RETRIEVAL_DUPLICATE_THRESHOLD", "0.95"))
+# Matches the context share of the prompt budget in prompt_builder.SECTION_PRIORITY
+RETRIEVAL_CONTEXT_TOKENS = int(os.environ.get("RETRIEVAL_CONTEXT_TOKENS", str(int(PROMPT_TOKEN_BUDGET * 0.3))))
+
+_counter = None
+
+
+def _token_counter() -> TokenCounter:
+    global _counter
+    if _counter is None:
+        _counter = TokenCounter()
+    return _counter
+
+
+def score_gap_cutoff(scores: np.ndarray, min_score: float, max_gap: float) -> int:
+    """How many of the descending scores to keep.
+
+    Scores below min_score are dropped, as is everything after the first drop
+    between neighbours larger than max_gap.
+    """
+    if len(scores) == 0:
+        return 0
+    gaps = -np.diff(scores) > max_gap
+    after_gap = np.concatenate([[False], np.logical_or.accumulate(gaps)])
+    return int(((scores >= min_score) & ~after_gap).sum())
+
+
+def mmr(similarities: np.ndarray, vectors: np.ndarray, k: int, lambda_mult: float,
+        duplicate_threshold: float = 1.0, costs: Optional[np.ndarray] = None,
+        budget: Optional[float] = None) -> List[int]:
+    """Maximal marginal relevance over normalized candidate vectors.
+
+    Picks up to k indices, trading relevance (similarities to the query)
+    against similarity to what is already picked. Candidates at or above
+    duplicate_threshold to a picked one are discarded, and when costs and
+    budget are given a candidate that no longer fits is skipped.
+    """
+    n = len(similarities)
+    available = np.ones(n, dtype=bool)
+    redundancy = np.zeros(n)
+    selected: List[int] = []
+    used = 0.0
+    while len(selected) < k and available.any():
+        scores = np.where(available, lambda_mult * similarities - (1 - lambda_mult) * redundancy, -np.inf)
+        best = int(np.argmax(scores))
+        available[best] = False
+        if costs is not None and budget is not None and used + costs[best] > budget:
+            continue
+        selected.append(best)
+        if costs is not None:
+            used += costs[best]
+        overlap = vectors @ vectors[best]
+        redundancy = np.maximum(redundancy, overlap)
+        available &= overlap < duplicate_threshold
+    return selected
+
+
+def rerank(results: List[Dict], top_k: int, min_score: float = RETRIEVAL_MIN_SCORE,
+           score_gap: float = RETRIEVAL_SCORE_GAP, lambda_mult: float = RETRIEVAL_MMR_LAMBDA,
+           duplicate_threshold: float = RETRIEVAL_DUPLICATE_THRESHOLD,
+           context_tokens: Optional[int] = RETRIEVAL_CONTEXT_TOKENS) -> List[Dict]:
+    """Trim over-fetched match results with a score-gap cutoff, then pick diverse ones with MMR.
+
+    results are rows from match_blood_test_data or the in-process index and
+    must include their embedding. The returned rows fit in context_tokens.
+    """
+    results = sorted(results, key=lambda r: r["similarity"], reverse=True)
+    scores = np.array([r["similarity"] for r in results], dtype=np.float32)
+    results = results[:score_gap_cutoff(scores, min_score, score_gap)]
+    if not results:
+        return []
+    if any(r.get("embedding") is None for r in results):
+        logging.warning("Match results without embeddings, skipping MMR")
+        return results[:top_k]
+
+    vectors = normalize(np.stack([parse_vector(r["embedding"]) for r in results]))
+    costs = None
+    if context_tokens:
+        counter = _token_counter()
+        costs = np.array([counter.count(r["content"]) for r in results], dtype=np.float64)
+    picked = mmr(scores[:len(results)], vectors, top_k, lambda_mult, duplicate_threshold, costs, context_tokens)
+    return [results[i] for i in picked]
@@ -0,0 +1,166 @@
+import itertools
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+RESPONSE_CACHE_ENTRIES = int(os.environ.get("RESPONSE_CACHE_ENTRIES", "2000"))
+RESPONSE_CACHE_TTL = float(os.environ.get("RESPONSE_CACHE_TTL", str(24 * 3600)))
+# Minimum cosine similarity between questions for a cached answer to be reused.
+# 1.0 (the default) reuses answers only for the same question text: sentence
+# embeddings barely separate e.g. "is my LDL high" from "is my LDL low".
+RESPONSE_CACHE_THRESHOLD = float(os.environ.get("RESPONSE_CACHE_THRESHOLD", "1.0"))
+RESPONSE_CACHE_ENABLED = os.environ.get("RESPONSE_CACHE_ENABLED", "1") == "1"
+# Questions that refer back to the conversation ("is that bad?", "what about
+# iron?") are cached per conversation history; all others are shared across turns
+FOLLOW_UP_WORDS = frozenset({
+    "it", "it's", "its", "that", "that's", "this", "these", "those", "they", "them", "their",
+    "above", "previous", "earlier", "again", "else", "same",
+})
+FOLLOW_UP_PREFIXES = ("and ", "also ", "but ", "so ", "what about ", "how about ")
+
+
+def normalize_question(question: str) -> str:
+    return " ".join(question.lower().split())
+
+
+def depends_on_history(question: str) -> bool:
+    """Whether a chat question only makes sense given the preceding turns."""
+    question = normalize_question(question)
+    return question.startswith(FOLLOW_UP_PREFIXES) or any(
+        word in FOLLOW_UP_WORDS for word in re.findall(r"[a-z']+", question)
+    )
+
+
+class CachedResponse:
+    def __init__(self, bucket: tuple, vector: Optional[np.ndarray], response: str):
+        self.bucket = bucket
+        self.vector = vector
+        self.response = response
+        self.created = time.monotonic()
+
+
+class ResponseCache:
+    """LLM responses keyed by (user, kind, results version, model, context) and question embedding.
+
+    context is any further key the response depends on, such as a digest of
+    the question and, for follow-up questions, the conversation history. Within a bucket a lookup returns
+    the entry whose question is most similar to the new one, if that
+    similarity reaches threshold. Entries without a vector match exactly.
+    Entries expire after ttl and the least recently used are evicted beyond
+    max_entries. Entries for older results versions are dropped by
+    invalidate().
+    """
+
+    def __init__(self, max_entries: int = RESPONSE_CACHE_ENTRIES, ttl: float = RESPONSE_CACHE_TTL,
+                 threshold: float = RESPONSE_CACHE_THRESHOLD):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threshold = threshold
+        self._entries: "OrderedDict[int, CachedResponse]" = OrderedDict()
+        self._buckets: Dict[tuple, List[int]] = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _normalize(vector) -> Optional[np.ndarray]:
+        if vector is None:
+            return None
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _remove(self, entry_id: int):
+        entry = self._entries.pop(entry_id)
+        ids = self._buckets[entry.bucket]
+        ids.remove(entry_id)
+        if not ids:
+            del self._buckets[entry.bucket]
+
+    def _expire(self):
+        now = time.monotonic()
+        # Entries are in LRU order, not creation order, so check them all
+        for entry_id in [i for i, e in self._entries.items() if now - e.created > self.ttl]:
+            self._remove(entry_id)
+            self.evictions += 1
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def get(self, clerk_user_id: str, kind: str, results_version: str, model: str, vector=None,
+            context: str = "") -> Optional[str]:
+        bucket = (clerk_user_id, kind, results_version, model, context)
+        query = self._normalize(vector)
+        with self._lock:
+            self._expire()
+            ids = self._buckets.get(bucket, [])
+            if query is None:
+                matches = [i for i in ids if self._entries[i].vector is None]
+                best = matches[-1] if matches else None
+            else:
+                candidates = [(i, v) for i in ids if (v := self._entries[i].vector) is not None]
+                best = None
+                if candidates:
+                    similarities = np.stack([v for _, v in candidates]) @ query
+                    index = int(np.argmax(similarities))
+                    if similarities[index] >= self.threshold:
+                        best = candidates[index][0]
+            if best is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(best)
+            return self._entries[best].response
+
+    def put(self, clerk_user_id: str, kind: str, results_version: str, model: str, response: str, vector=None,
+            context: str = ""):
+        bucket = (clerk_user_id, kind, results_version, model, context)
+        with self._lock:
+            entry_id = next(self._ids)
+            self._entries[entry_id] = CachedResponse(bucket, self._normalize(vector), response)
+            self._buckets.setdefault(bucket, []).append(entry_id)
+            self._expire()
+
+    def invalidate(self, clerk_user_id: str, keep_version: Optional[str] = None):
+        """Drop a user's entries, except those for keep_version."""
+        with self._lock:
+            stale = [i for i, e in self._entries.items() if e.bucket[0] == clerk_user_id and e.bucket[2] != keep_version]
+            for entry_id in stale:
+                self._remove(entry_id)
+            self.invalidations += len(stale)
+        if stale:
+            logging.info(f"Invalidated {len(stale)} cached responses for user {clerk_user_id}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+_cache = None
+_lock = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache:
+    global _cache
+    if _cache is None:
+        with _lock:
+            if _cache is None:
+                _cache = ResponseCache()
+    return _cache
@@ -0,0 +1,188 @@
+import json
+import logging
+import os
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+from models import ANALYTES
+from supabase import create_client
+
+load_dotenv()
+
+# Supabase setup
+url = os.environ.get("NEXT_PUBLIC_SUPABASE_URL")
+key = os.environ.get("NEXT_PUBLIC_SUPABASE_ANON_KEY")
+supabase = create_client(url, key)
+
+# PostgREST caps a single select, so larger reads are paged
+PAGE_SIZE = 1000
+
+
+def report_date(row: Dict) -> str:
+    # Rows use the dashboard's dd/mm/yy 'Date' format
+    return datetime.strptime(row['Date'], '%d/%m/%y').date().isoformat()
+
+
+def save_reports(clerk_user_id: str, reports: List[Dict]):
+    """Upsert parsed reports for a user.
+
+    Each report is {"sourceKey": ..., "row": ...} where row is one item of
+    transform_results_to_list_of_dicts and sourceKey identifies the attachment
+    or upload it came from, so re-syncing the same file is a no-op.
+    """
+    if not reports:
+        return
+    current_time = datetime.utcnow().isoformat()
+    rows = [
+        {
+            "clerkUserId": clerk_user_id,
+            "sourceKey": report["sourceKey"],
+            "reportDate": report_date(report["row"]),
+            "results": report["row"],
+            "updatedAt": current_time,
+        }
+        for report in reports
+    ]
+    response = supabase.table("BloodTestReport").upsert(rows, on_conflict="clerkUserId,sourceKey").execute()
+    save_values(clerk_user_id, response.data)
+    logging.info(f"Stored {len(rows)} blood test reports for user {clerk_user_id}")
+
+
+def value_rows(clerk_user_id: str, report: Dict) -> List[Dict]:
+    """Split a stored report into one typed row per non-empty analyte."""
+    results = report["results"] if isinstance(report["results"], dict) else json.loads(report["results"])
+    rows = []
+    for analyte, (column, unit) in ANALYTES.items():
+        value = results.get(column)
+        if value is None:
+            continue
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            logging.warning(f"Skipping non-numeric {analyte} value {value!r} in report {report['id']}")
+            continue
+        rows.append({
+            "clerkUserId": clerk_user_id,
+            "reportId": report["id"],
+            "reportDate": report["reportDate"],
+            "analyte": analyte,
+            "value": value,
+            "unit": unit,
+        })
+    return rows
+
+
+def save_values(clerk_user_id: str, reports: List[Dict]):
+    rows = [row for report in reports for row in value_rows(clerk_user_id, report)]
+    if rows:
+        supabase.table("BloodTestValue").upsert(rows, on_conflict="reportId,analyte").execute()
+
+
+def _select_all(build_query) -> List[Dict]:
+    rows = []
+    start = 0
+    while True:
+        page = build_query().range(start, start + PAGE_SIZE - 1).execute().data
+        rows.extend(page)
+        if len(page) < PAGE_SIZE:
+            return rows
+        start += PAGE_SIZE
+
+
+def values_matrix(rows: List[Dict], analytes: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """Pivot BloodTestValue rows ordered by (reportDate, reportId) into (dates, values).
+
+    dates has one datetime64[D] entry per report and values is a float64
+    matrix of shape (reports, analytes) with NaN where a report did not
+    include an analyte.
+    """
+    if not rows:
+        return np.empty(0, dtype="datetime64[D]"), np.empty((0, len(analytes)))
+    report_ids = np.array([r["reportId"] for r in rows], dtype=np.int64)
+    # Rows arrive ordered by date, so order reports by first appearance
+    _, first_index, inverse = np.unique(report_ids, return_index=True, return_inverse=True)
+    order = np.argsort(first_index)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+
+    column = {analyte: i for i, analyte in enumerate(analytes)}
+    values = np.full((len(order), len(analytes)), np.nan)
+    values[rank[inverse], [column[r["analyte"]] for r in rows]] = [r["value"] for r in rows]
+    dates = np.array([str(r["reportDate"])[:10] for r in rows], dtype="datetime64[D]")[first_index[order]]
+    return dates, values
+
+
+def load_results_matrix(clerk_user_id: str, analytes: Iterable[str] = ANALYTES) -> Tuple[np.ndarray, List[str], np.ndarray]:
+    """Return (dates, analytes, values) for a user's reports, oldest first, from BloodTestValue.
+
+    Column j of values is the series for analytes[j]; see values_matrix.
+    """
+    analytes = list(analytes)
+    rows = _select_all(lambda: (
+        supabase.table("BloodTestValue")
+        .select("reportId, reportDate, analyte, value")
+        .eq("clerkUserId", clerk_user_id)
+        .in_("analyte", analytes)
+        .order("reportDate")
+        .order("reportId")
+    ))
+    dates, values = values_matrix(rows, analytes)
+    return dates, analytes, values
+
+
+def backfill_values(clerk_user_id: Optional[str] = None) -> int:
+    """Write BloodTestValue rows for reports stored before the table existed. Returns the number of reports."""
+    def build_query():
+        query = supabase.table("BloodTestReport").select("id, clerkUserId, reportDate, results")
+        if clerk_user_id is not None:
+            query = query.eq("clerkUserId", clerk_user_id)
+        return query.order("id")
+
+    reports = _select_all(build_query)
+    by_user: Dict[str, List[Dict]] = {}
+    for report in reports:
+        by_user.setdefault(report["clerkUserId"], []).append(report)
+    for user, user_reports in by_user.items():
+        save_values(user, user_reports)
+    return len(reports)
+
+
+def load_blood_test_results(clerk_user_id: str) -> List[Dict]:
+    """Return the user's parsed results, oldest first, in the dashboard row format."""
+    try:
+        rows = _select_all(lambda: (
+            supabase.table("BloodTestReport")
+            .select("results")
+            .eq("clerkUserId", clerk_user_id)
+            .order("reportDate")
+            .order("id")
+        ))
+    except Exception as e:
+        logging.error(f"Error loading blood test reports for user {clerk_user_id}: {e}")
+        return []
+    return [r['results'] if isinstance(r['results'], dict) else json.loads(r['results']) for r in rows]
+
+
+def results_version(clerk_user_id: str) -> str:
+    """A marker that changes whenever a report is added or re-saved for the user."""
+    response = (
+        supabase.table("BloodTestReport")
+        .select("id, updatedAt", count="exact")
+        .eq("clerkUserId", clerk_user_id)
+        .order("updatedAt", desc=True)
+        .order("id", desc=True)
+        .limit(1)
+        .execute()
+    )
+    latest = response.data[0] if response.data else {}
+    return f"{response.count}:{latest.get('id')}:{latest.get('updatedAt')}"
+
+
+if __name__ == "__main__":
+    import sys
+
+    logging.basicConfig(level=logging.INFO)
+    count = backfill_values(sys.argv[1] if len(sys.argv) > 1 else None)
+    logging.info(f"Backfilled per-analyte values for {count} reports")
@@ -0,0 +1,259 @@
+import asyncio
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: only the in-process queues apply
+    fcntl = None
+
+# Chat generation shares one local Ollama instance
+CHAT_LLM_CONCURRENCY = int(os.environ.get("CHAT_LLM_CONCURRENCY", "2"))
+EMBEDDING_CONCURRENCY = int(os.environ.get("EMBEDDING_CONCURRENCY", "2"))
+# Whole report parses: text extraction plus the structuring LLM call
+PDF_CONCURRENCY = int(os.environ.get("PDF_CONCURRENCY", os.environ.get("LLM_CONCURRENCY", "8")))
+# Interactive requests waiting beyond this are turned away with Busy
+SCHEDULER_MAX_WAITING = int(os.environ.get("SCHEDULER_MAX_WAITING", "32"))
+# Recent wait times kept per priority for the percentiles in stats()
+WAIT_SAMPLES = 1000
+# Lock files shared by every backend process: the chatbot server, sync_job.py
+# and the get_email.py runs the upload and email routes start
+SCHEDULER_LOCK_DIR = os.environ.get("SCHEDULER_LOCK_DIR", os.path.join(tempfile.gettempdir(), "medical-card-slots"))
+# Interactive work waiting longer than this for a cross-process slot is turned away with Busy
+SCHEDULER_SLOT_TIMEOUT = float(os.environ.get("SCHEDULER_SLOT_TIMEOUT", "60"))
+SLOT_POLL_INTERVAL = 0.05
+
+INTERACTIVE = 0
+BACKGROUND = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background"}
+
+
+class Busy(Exception):
+    """Raised when a queue is too deep to admit more interactive work."""
+
+
+def _percentile(values, q: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+class WorkQueue:
+    """Runs at most `concurrency` jobs of one kind at a time.
+
+    Waiting jobs are served interactive before background, and round-robin
+    across users within a priority, so one user's batch cannot starve
+    everyone else. Interactive jobs are rejected with Busy when
+    max_waiting interactive jobs are already queued; background jobs always queue,
+    since they come from our own bounded batch work. Use from one event loop
+    at a time.
+    """
+
+    def __init__(self, name: str, concurrency: int, max_waiting: int = SCHEDULER_MAX_WAITING):
+        self.name = name
+        self.concurrency = max(1, concurrency)
+        self.max_waiting = max_waiting
+        self._running = 0
+        # priority -> user -> waiting futures, users in round-robin order
+        self._waiting: Dict[int, "OrderedDict[str, deque]"] = {p: OrderedDict() for p in PRIORITY_NAMES}
+        self._depth = dict.fromkeys(PRIORITY_NAMES, 0)
+        self._waits = {p: deque(maxlen=WAIT_SAMPLES) for p in PRIORITY_NAMES}
+        self.admitted = 0
+        self.rejected = 0
+        self.completed = 0
+
+    def _queued(self) -> int:
+        return sum(self._depth.values())
+
+    def _pop_next(self) -> Optional[asyncio.Future]:
+        for priority in sorted(self._waiting):
+            users = self._waiting[priority]
+            if not users:
+                continue
+            user, futures = next(iter(users.items()))
+            future = futures.popleft()
+            # Move the user to the back of the round-robin order
+            del users[user]
+            if futures:
+                users[user] = futures
+            self._depth[priority] -= 1
+            return future
+        return None
+
+    def _grant_next(self):
+        while self._running < self.concurrency:
+            future = self._pop_next()
+            if future is None:
+                return
+            if future.cancelled():
+                continue
+            self._running += 1
+            future.set_result(None)
+
+    def _release(self):
+        self._running -= 1
+        self.completed += 1
+        self._grant_next()
+
+    def _forget(self, priority: int, user: str, future: asyncio.Future):
+        futures = self._waiting[priority].get(user)
+        if futures is not None and future in futures:
+            futures.remove(future)
+            self._depth[priority] -= 1
+            if not futures:
+                del self._waiting[priority][user]
+
+    async def acquire(self, user: str, priority: int = INTERACTIVE):
+        start = time.monotonic()
+        if self._running < self.concurrency and self._queued() == 0:
+            self._running += 1
+        else:
+            # Background jobs are served after interactive ones, so only
+            # interactive waiters count towards admission
+            if priority == INTERACTIVE and self._depth[INTERACTIVE] >= self.max_waiting:
+                self.rejected += 1
+                raise Busy(f"{self.name} queue is full ({self._depth[INTERACTIVE]} interactive waiting)")
+            future = asyncio.get_running_loop().create_future()
+            self._waiting[priority].setdefault(user, deque()).append(future)
+            self._depth[priority] += 1
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    # Granted a slot just as the caller went away
+                    self._release()
+                else:
+                    self._forget(priority, user, future)
+                raise
+        self.admitted += 1
+        self._waits[priority].append(time.monotonic() - start)
+
+    @asynccontextmanager
+    async def slot(self, user: str, priority: int = INTERACTIVE):
+        await self.acquire(user, priority)
+        try:
+            yield
+        finally:
+            self._release()
+
+    async def run(self, user: str, priority: int, fn, *args):
+        """Await fn(*args) once a slot is free."""
+        async with self.slot(user, priority):
+            return await fn(*args)
+
+    def stats(self) -> dict:
+        waits = {}
+        for priority, name in PRIORITY_NAMES.items():
+            samples = list(self._waits[priority])
+            p50, p95 = _percentile(samples, 0.5), _percentile(samples, 0.95)
+            waits[name] = {
+                "waiting": self._depth[priority],
+                "wait_p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+                "wait_p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+            }
+        return {
+            "concurrency": self.concurrency,
+            "running": self._running,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "completed": self.completed,
+            **waits,
+        }
+
+
+class ProcessSlots:
+    """At most `concurrency` holders across all processes on this machine.
+
+    Slot i is held by taking an exclusive flock() on <directory>/<name>-<i>.lock,
+    which the kernel releases if the holder dies. There is no queue: waiters
+    poll, background ones less often so interactive work tends to win, and
+    interactive waiters give up with Busy after `timeout` seconds.
+    """
+
+    def __init__(self, name: str, concurrency: int, directory: str = SCHEDULER_LOCK_DIR,
+                 timeout: float = SCHEDULER_SLOT_TIMEOUT):
+        self.name = name
+        self.concurrency = max(1, concurrency)
+        self.directory = directory
+        self.timeout = timeout
+        self.rejected = 0
+
+    def _try_acquire(self) -> Optional[int]:
+        assert fcntl is not None
+        os.makedirs(self.directory, exist_ok=True)
+        for i in range(self.concurrency):
+            fd = os.open(os.path.join(self.directory, f"{self.name}-{i}.lock"), os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return fd
+            except BlockingIOError:
+                os.close(fd)
+        return None
+
+    @asynccontextmanager
+    async def slot(self, priority: int = INTERACTIVE):
+        if fcntl is None:
+            yield
+            return
+        deadline = time.monotonic() + self.timeout
+        interval = SLOT_POLL_INTERVAL if priority == INTERACTIVE else SLOT_POLL_INTERVAL * 4
+        while (fd := self._try_acquire()) is None:
+            if priority == INTERACTIVE and time.monotonic() >= deadline:
+                self.rejected += 1
+                raise Busy(f"no {self.name} slot free across processes after {self.timeout:.0f}s")
+            await asyncio.sleep(interval)
+        try:
+            yield
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    def stats(self) -> dict:
+        return {"concurrency": self.concurrency, "rejected": self.rejected}
+
+
+class Scheduler:
+    """One WorkQueue per kind of heavy work: LLM generation, embedding and PDF parsing.
+
+    PDF parsing also happens in sync_job.py and in get_email.py processes, so
+    its limit is additionally enforced across processes by `shared["pdf"]`.
+    """
+
+    def __init__(self, llm: int = CHAT_LLM_CONCURRENCY, embedding: int = EMBEDDING_CONCURRENCY,
+                 pdf: int = PDF_CONCURRENCY, max_waiting: int = SCHEDULER_MAX_WAITING):
+        self.queues = {
+            "llm": WorkQueue("llm", llm, max_waiting),
+            "embedding": WorkQueue("embedding", embedding, max_waiting),
+            "pdf": WorkQueue("pdf", pdf, max_waiting),
+        }
+        self.shared = {"pdf": ProcessSlots("pdf", pdf)}
+
+    def __getitem__(self, name: str) -> WorkQueue:
+        return self.queues[name]
+
+    def stats(self) -> dict:
+        stats = {name: queue.stats() for name, queue in self.queues.items()}
+        for name, slots in self.shared.items():
+            stats[name]["shared"] = slots.stats()
+        return stats
+
+
+_scheduler = None
+_lock = threading.Lock()
+
+
+def get_scheduler() -> Scheduler:
+    global _scheduler
+    if _scheduler is None:
+        with _lock:
+            if _scheduler is None:
+                _scheduler = Scheduler()
+                logging.info(f"Scheduler limits: llm {CHAT_LLM_CONCURRENCY}, embedding {EMBEDDING_CONCURRENCY}, pdf {PDF_CONCURRENCY}")
+    return _scheduler
@@ -0,0 +1,78 @@
+import argparse
+import asyncio
+import base64
+import logging
+import sys
+import time
+
+from analysis_jobs import request_health_analysis
+from get_email import (
+    commit_sync_state,
+    process_email_attachments,
+    supabase,
+    sync_mailbox,
+    transform_results_to_list_of_dicts,
+)
+from report_cache import gmail_key
+from results_store import save_reports
+from scheduler import BACKGROUND
+
+
+def list_users(clerk_user_ids=None):
+    query = supabase.table("User").select("id, clerkUserId, gmailAccessToken").is_("deletedAt", "null")
+    if clerk_user_ids:
+        query = query.in_("clerkUserId", clerk_user_ids)
+    return query.execute().data
+
+
+async def refresh_user(user):
+    """Sync one user's mailbox and store any newly parsed reports."""
+    attachments, sync_state = sync_mailbox(user['gmailAccessToken'], user['id'])
+    processed_pdfs = await process_email_attachments(attachments, user['clerkUserId'], BACKGROUND)
+
+    reports = []
+    for attachment, pdf in zip(attachments, processed_pdfs, strict=True):
+        if pdf is None:
+            continue
+        rows = transform_results_to_list_of_dicts([pdf])
+        if rows:
+            source_key = gmail_key(attachment['messageId'], base64.b64decode(attachment['data']))
+            reports.append({"sourceKey": source_key, "row": rows[0]})
+
+    save_reports(user['clerkUserId'], reports)
+    commit_sync_state(user['id'], sync_state, attachments, processed_pdfs)
+    return len(reports)
+
+
+async def refresh_all(clerk_user_ids=None):
+    for user in list_users(clerk_user_ids):
+        try:
+            stored = await refresh_user(user)
+            logging.info(f"Refreshed mailbox for user {user['clerkUserId']}: {stored} new reports")
+            if stored:
+                # Precompute the analysis so the dashboard only has to read it
+                request_health_analysis(user['clerkUserId'])
+        except Exception as e:
+            logging.error(f"Error refreshing mailbox for user {user['clerkUserId']}: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sync users' lab emails into BloodTestReport")
+    parser.add_argument("--user", action="append", dest="users", help="Clerk user ID to sync (repeatable, default: all users)")
+    parser.add_argument("--interval", type=float, default=0, help="Seconds between syncs; 0 runs once and exits")
+    args = parser.parse_args()
+
+    while True:
+        start = time.perf_counter()
+        asyncio.run(refresh_all(args.users))
+        logging.info(f"Mailbox sync finished in {time.perf_counter() - start:.1f}s")
+        if args.interval <= 0:
+            break
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        sys.exit(0)
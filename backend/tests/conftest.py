@@ -0,0 +1,10 @@
+import os
+import sys
+
+# Backend modules import each other by bare name, as they do when run from backend/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Several modules create Supabase or OpenAI clients at import; tests never contact them
+os.environ.setdefault("NEXT_PUBLIC_SUPABASE_URL", "http://127.0.0.1:9")
+os.environ.setdefault("NEXT_PUBLIC_SUPABASE_ANON_KEY", "test")
+os.environ.setdefault("OPENAI_API_KEY", "test")
@@ -0,0 +1,102 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("pydantic")
+
+from analysis import (  # noqa: E402
+    DAYS_PER_MONTH,
+    MIN_TREND_POINTS,
+    analyze,
+    summarize,
+)
+
+ANALYTES = ["WBC", "HGB", "PLT"]
+DATES = np.array(
+    ["2024-01-01", "2024-02-01", "2024-03-01", "2024-04-01"], dtype="datetime64[D]"
+)
+nan = np.nan
+
+
+def column(stats, name):
+    return {key: value[ANALYTES.index(name)] for key, value in stats.items()}
+
+
+@pytest.fixture
+def stats():
+    values = np.array(
+        [
+            # WBC rising in range, HGB low and falling with a gap, PLT high
+            [5.0, 12.5, 420.0],
+            [5.5, nan, 430.0],
+            [6.0, 11.5, nan],
+            [6.2, 11.0, 410.0],
+        ]
+    )
+    return analyze(DATES, ANALYTES, values)
+
+
+def test_latest_values_skip_missing_reports(stats):
+    hgb = column(stats, "HGB")
+    assert (hgb["latest"], hgb["previous"], hgb["earlier"]) == (11.0, 11.5, 12.5)
+    assert hgb["count"] == 3
+    plt = column(stats, "PLT")
+    assert (plt["latest"], plt["previous"], plt["earlier"]) == (410.0, 430.0, 420.0)
+
+
+def test_range_flags_and_out_of_range_counts(stats):
+    assert list(stats["flag"]) == [0, -1, 1]
+    assert list(stats["out_of_range_count"]) == [0, 2, 3]
+
+
+def test_slope_matches_least_squares_per_month(stats):
+    months = (DATES - DATES[0]).astype(float) / DAYS_PER_MONTH
+    expected = np.polyfit(months, [5.0, 5.5, 6.0, 6.2], 1)[0]
+    assert column(stats, "WBC")["slope_per_month"] == pytest.approx(expected)
+    # Missing reports are left out of the fit
+    keep = [0, 2, 3]
+    expected = np.polyfit(months[keep], [12.5, 11.5, 11.0], 1)[0]
+    assert column(stats, "HGB")["slope_per_month"] == pytest.approx(expected)
+
+
+def test_zscore_against_own_history(stats):
+    wbc = np.array([5.0, 5.5, 6.0, 6.2])
+    expected = (wbc[-1] - wbc.mean()) / wbc.std(ddof=1)
+    assert column(stats, "WBC")["zscore"] == pytest.approx(expected)
+
+
+def test_deltas(stats):
+    wbc = column(stats, "WBC")
+    assert wbc["delta"] == pytest.approx(0.2)
+    assert wbc["delta_percent"] == pytest.approx(0.2 / 6.0 * 100)
+
+
+def test_worsening_when_out_of_range_and_moving_away(stats):
+    # HGB is low and still falling; PLT is high but fell since the last report
+    assert list(stats["worsening"]) == [False, True, False]
+
+
+def test_worsening_when_projected_to_leave_the_range():
+    # In range now, but rising by about 1.5 per month towards the 11.0 limit
+    values = np.array([[5.0], [6.5], [8.0], [9.5]])
+    stats = analyze(DATES, ["WBC"], values)
+    assert stats["flag"][0] == 0
+    assert stats["worsening"][0]
+
+
+def test_trends_need_enough_reports():
+    values = np.array([[5.0, nan, nan], [6.0, 13.0, nan]])
+    stats = analyze(DATES[:2], ANALYTES, values)
+    assert MIN_TREND_POINTS > 2
+    assert np.isnan(stats["slope_per_month"]).all()
+    assert np.isnan(stats["zscore"]).all()
+    assert list(stats["count"]) == [2, 1, 0]
+    assert np.isnan(column(stats, "HGB")["previous"])
+
+
+def test_empty_matrix():
+    stats = analyze(DATES[:0], ANALYTES, np.empty((0, len(ANALYTES))))
+    assert list(stats["count"]) == [0, 0, 0]
+    assert np.isnan(stats["latest"]).all()
+    assert summarize(DATES[:0], ANALYTES, np.empty((0, len(ANALYTES)))) == (
+        "No blood test results available."
+    )
@@ -0,0 +1,146 @@
+import asyncio
+
+import pytest
+
+for module in ("httpx", "supabase", "dotenv"):
+    pytest.importorskip(module)
+
+import analysis_jobs  # noqa: E402
+from analysis_jobs import AnalysisJobRunner  # noqa: E402
+
+
+class FakeTasks:
+    """Stands in for the Task table and the user's results version."""
+
+    def __init__(self):
+        self.version = "v1"
+        self.rows = {}
+
+    def results_version(self, _clerk_user_id):
+        return self.version
+
+    def create_task(self, clerk_user_id, kind, version):
+        task_id = f"task-{len(self.rows) + 1}"
+        self.rows[task_id] = {
+            "id": task_id,
+            "userId": clerk_user_id,
+            "kind": kind,
+            "resultsVersion": version,
+            "status": "processing",
+            "result": None,
+        }
+        return task_id
+
+    def update_task(self, task_id, status, result):
+        self.rows[task_id].update(status=status, result=result)
+
+    def latest_result(self, clerk_user_id, kind, version):
+        done = [
+            row
+            for row in self.rows.values()
+            if (row["userId"], row["kind"], row["resultsVersion"], row["status"])
+            == (clerk_user_id, kind, version, "success")
+        ]
+        return done[-1] if done else None
+
+
+@pytest.fixture
+def tasks(monkeypatch):
+    fake = FakeTasks()
+    for name in ("results_version", "create_task", "update_task", "latest_result"):
+        monkeypatch.setattr(analysis_jobs, name, getattr(fake, name))
+    return fake
+
+
+class StubCompute:
+    def __init__(self):
+        self.calls = []
+        self.release = asyncio.Event()
+
+    async def __call__(self, clerk_user_id):
+        self.calls.append(clerk_user_id)
+        await self.release.wait()
+        return f"analysis for {clerk_user_id}"
+
+
+async def finish(runner, compute):
+    compute.release.set()
+    await asyncio.gather(*runner._tasks)
+
+
+def test_concurrent_submits_share_one_job(tasks):
+    async def scenario():
+        compute = StubCompute()
+        runner = AnalysisJobRunner(compute)
+        first, second = await asyncio.gather(
+            runner.submit("user"), runner.submit("user")
+        )
+        assert first == second == {"taskId": "task-1", "status": "processing"}
+        await finish(runner, compute)
+        assert compute.calls == ["user"]
+        assert tasks.rows["task-1"]["status"] == "success"
+        assert runner.stats() == {
+            "running": 0,
+            "started": 1,
+            "deduplicated": 1,
+            "served_stored": 0,
+        }
+        # Finished jobs and idle users leave nothing behind
+        assert runner._tasks == set()
+        assert runner._locks == {}
+
+    asyncio.run(scenario())
+
+
+def test_stored_result_is_reused_until_the_results_change(tasks):
+    async def scenario():
+        compute = StubCompute()
+        runner = AnalysisJobRunner(compute)
+        await runner.submit("user")
+        await finish(runner, compute)
+
+        stored = await runner.submit("user")
+        assert stored == {
+            "taskId": "task-1",
+            "status": "success",
+            "result": "analysis for user",
+        }
+        assert compute.calls == ["user"]
+
+        tasks.version = "v2"
+        assert (await runner.submit("user"))["taskId"] == "task-2"
+        await finish(runner, compute)
+        assert runner.served_stored == 1
+
+    asyncio.run(scenario())
+
+
+def test_force_recomputes_a_stored_result(tasks):
+    async def scenario():
+        compute = StubCompute()
+        runner = AnalysisJobRunner(compute)
+        await runner.submit("user")
+        await finish(runner, compute)
+
+        forced = await runner.submit("user", force=True)
+        assert forced == {"taskId": "task-2", "status": "processing"}
+        await finish(runner, compute)
+        assert compute.calls == ["user", "user"]
+        assert tasks.rows["task-2"]["status"] == "success"
+
+    asyncio.run(scenario())
+
+
+def test_failed_compute_is_recorded_and_not_reused(tasks):
+    async def scenario():
+        async def fail(_clerk_user_id):
+            raise RuntimeError("model unavailable")
+
+        runner = AnalysisJobRunner(fail)
+        await runner.submit("user")
+        await asyncio.gather(*runner._tasks)
+        assert tasks.rows["task-1"]["status"] == "error"
+        assert (await runner.submit("user"))["taskId"] == "task-2"
+        await asyncio.gather(*runner._tasks)
+
+    asyncio.run(scenario())
@@ -0,0 +1,139 @@
+import asyncio
+import queue
+
+import pytest
+
+for module in ("langchain", "langchain_core", "langchain_ollama", "httpx", "supabase"):
+    pytest.importorskip(module)
+
+import chatbot_server  # noqa: E402
+from chatbot_server import ChatbotPool, ChatbotSession  # noqa: E402
+from scheduler import WorkQueue  # noqa: E402
+
+
+class FakeChatbot:
+    def __init__(self, clerk_user_id):
+        self.clerk_user_id = clerk_user_id
+
+    async def aprocess_message(self, message):
+        await asyncio.sleep(0.01)
+        return message
+
+    def prompt_token_counts(self):
+        return {}
+
+    async def astream_health_analysis(self):
+        await asyncio.sleep(0.01)
+        yield "analysis"
+
+
+@pytest.fixture(autouse=True)
+def fake_chatbot(monkeypatch):
+    monkeypatch.setattr(chatbot_server, "MedicalChatbot", FakeChatbot)
+
+
+def test_sessions_are_reused_per_user():
+    pool = ChatbotPool()
+    session = pool.get("a")
+    assert pool.get("a") is session
+    assert pool.get("b") is not session
+    assert session.chatbot.clerk_user_id == "a"
+    assert len(pool) == 2
+
+
+def test_least_recently_used_session_is_evicted():
+    pool = ChatbotPool(max_sessions=2)
+    a = pool.get("a")
+    pool.get("b")
+    pool.get("a")
+    pool.get("c")
+    assert len(pool) == 2
+    assert pool.get("a") is a
+    assert "b" not in pool._sessions
+
+
+def test_idle_sessions_expire():
+    pool = ChatbotPool(ttl=60)
+    idle = pool.get("a")
+    idle.last_used -= 61
+    pool.get("b")
+    assert "a" not in pool._sessions
+    assert pool.get("a") is not idle
+
+
+def test_drop_forgets_the_session():
+    pool = ChatbotPool()
+    session = pool.get("a")
+    pool.drop("a")
+    pool.drop("missing")
+    assert pool.get("a") is not session
+
+
+def test_chats_and_background_analysis_do_not_deadlock(monkeypatch):
+    async def scenario():
+        queue = WorkQueue("llm", concurrency=1)
+        monkeypatch.setattr(chatbot_server, "get_scheduler", lambda: {"llm": queue})
+        sessions = {}
+
+        async def get_session(clerk_user_id):
+            return sessions.setdefault(
+                clerk_user_id, ChatbotSession(FakeChatbot(clerk_user_id))
+            )
+
+        monkeypatch.setattr(chatbot_server, "get_session", get_session)
+        first = asyncio.ensure_future(chatbot_server.chat("a", "one"))
+        await asyncio.sleep(0)
+        # The analysis queues for the slot while the second chat queues behind
+        # the first; whichever gets the slot next must also get the lock
+        background = asyncio.ensure_future(chatbot_server.compute_health_analysis("a"))
+        second = asyncio.ensure_future(chatbot_server.chat("a", "two"))
+        return await asyncio.wait_for(
+            asyncio.gather(first, background, second), timeout=5
+        )
+
+    first, background, second = asyncio.run(scenario())
+    assert (first["response"], background, second["response"]) == (
+        "one",
+        "analysis",
+        "two",
+    )
+
+
+def test_cancelled_stream_releases_the_slot_and_the_lock(monkeypatch):
+    async def passthrough(_chatbot, chunks):
+        async for chunk in chunks:
+            yield {"type": "chunk", "content": chunk}
+
+    async def endless(message):
+        while True:
+            await asyncio.sleep(0.01)
+            yield message
+
+    async def scenario():
+        llm = WorkQueue("llm", concurrency=1)
+        session = ChatbotSession(FakeChatbot("a"))
+        session.chatbot.astream_message = endless
+
+        async def get_session(_clerk_user_id):
+            return session
+
+        monkeypatch.setattr(chatbot_server, "get_scheduler", lambda: {"llm": llm})
+        monkeypatch.setattr(chatbot_server, "get_session", get_session)
+        monkeypatch.setattr(chatbot_server, "stream_frames", passthrough)
+        frames = queue.Queue()
+        payload = {"clerkUserId": "a", "message": "hi"}
+        task = asyncio.ensure_future(
+            chatbot_server.stream_to_queue("/chat", payload, frames)
+        )
+        await asyncio.sleep(0.05)
+        # What the request handler does when the client goes away
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return llm, session, frames
+
+    llm, session, frames = asyncio.run(scenario())
+    assert llm.stats()["running"] == 0
+    assert not session.lock.locked()
+    sent = list(frames.queue)
+    assert sent[0] == {"type": "chunk", "content": "hi"}
+    assert sent[-1] is None
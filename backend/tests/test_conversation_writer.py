@@ -0,0 +1,66 @@
+import threading
+
+import pytest
+
+pytest.importorskip("supabase")
+pytest.importorskip("dotenv")
+
+import conversation_writer  # noqa: E402
+from conversation_writer import ConversationWriter  # noqa: E402
+
+
+def message(i):
+    return {"content": f"message {i}", "type": "human", "timestamp": str(i)}
+
+
+@pytest.fixture
+def batches(monkeypatch):
+    written = []
+    monkeypatch.setattr(
+        conversation_writer,
+        "store_conversation_batch",
+        lambda batch: written.append(batch),
+    )
+    return written
+
+
+def test_messages_are_written_in_batches(batches):
+    # A long flush interval means only full batches go out before close()
+    writer = ConversationWriter(batch_size=2, flush_interval=60)
+    writer.enqueue([message(i) for i in range(4)], "user-a")
+    writer.enqueue([message(4)], "user-b")
+    writer.close(timeout=5)
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+    assert batches[-1] == [(message(4), "user-b")]
+    assert writer.written == 5
+
+
+def test_close_flushes_a_partial_batch_without_waiting(batches):
+    writer = ConversationWriter(batch_size=64, flush_interval=60)
+    writer.enqueue([message(0), message(1)], "user-a")
+    writer.close(timeout=5)
+    assert not writer._thread.is_alive()
+    assert batches == [[(message(0), "user-a"), (message(1), "user-a")]]
+
+
+def test_enqueue_after_close_is_rejected(batches):
+    writer = ConversationWriter(flush_interval=60)
+    writer.close(timeout=5)
+    with pytest.raises(RuntimeError):
+        writer.enqueue([message(0)], "user-a")
+    assert batches == []
+
+
+def test_failed_batches_are_dropped_after_retries(monkeypatch):
+    calls = threading.Event()
+
+    def fail(_batch):
+        calls.set()
+        raise ConnectionError("down")
+
+    monkeypatch.setattr(conversation_writer, "store_conversation_batch", fail)
+    writer = ConversationWriter(flush_interval=60, retries=1)
+    writer.enqueue([message(0), message(1)], "user-a")
+    writer.close(timeout=5)
+    assert calls.is_set()
+    assert (writer.written, writer.dropped) == (0, 2)
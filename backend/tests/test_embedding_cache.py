@@ -0,0 +1,84 @@
+import pytest
+
+pytest.importorskip("langchain_core")
+
+from embedding_cache import (  # noqa: E402
+    CachedEmbeddings,
+    SQLiteEmbeddingStore,
+    embedding_key,
+)
+from langchain_core.embeddings import Embeddings  # noqa: E402
+
+DIM = 4
+VECTOR_BYTES = DIM * 4
+
+
+class CountingEmbeddings(Embeddings):
+    def __init__(self):
+        self.calls = []
+
+    def embed_documents(self, texts):
+        self.calls.append(list(texts))
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text):
+        self.calls.append([text])
+        return self._vector(text)
+
+    @staticmethod
+    def _vector(text):
+        return [float(len(text)), 1.0, 2.0, 3.0]
+
+
+def test_repeated_texts_are_embedded_once():
+    model = CountingEmbeddings()
+    cache = CachedEmbeddings(model, "model")
+    vectors = cache.embed_documents(["a", "bb", "a"])
+    assert vectors == [[1.0, 1.0, 2.0, 3.0], [2.0, 1.0, 2.0, 3.0], [1.0, 1.0, 2.0, 3.0]]
+    assert model.calls == [["a", "bb"]]
+    assert cache.embed_query("bb") == [2.0, 1.0, 2.0, 3.0]
+    assert model.calls == [["a", "bb"]]
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (1, 2)
+
+
+def test_lru_is_bounded_by_bytes():
+    model = CountingEmbeddings()
+    cache = CachedEmbeddings(model, "model", max_bytes=2 * VECTOR_BYTES)
+    cache.embed_documents(["a", "bb"])
+    cache.embed_query("a")  # "bb" is now the least recently used
+    cache.embed_query("ccc")
+    stats = cache.stats()
+    assert stats["entries"] == 2
+    assert stats["bytes"] == 2 * VECTOR_BYTES
+    cache.embed_query("a")
+    assert model.calls[-1] == ["ccc"]
+    cache.embed_query("bb")
+    assert model.calls[-1] == ["bb"]
+
+
+def test_lru_is_bounded_by_entries():
+    cache = CachedEmbeddings(CountingEmbeddings(), "model", max_entries=1)
+    cache.embed_documents(["a", "bb", "ccc"])
+    assert cache.stats()["entries"] == 1
+    assert cache.stats()["bytes"] == VECTOR_BYTES
+
+
+def test_vector_larger_than_max_bytes_is_not_kept():
+    cache = CachedEmbeddings(CountingEmbeddings(), "model", max_bytes=VECTOR_BYTES - 1)
+    cache.embed_query("a")
+    assert cache.stats()["entries"] == 0
+    assert cache.stats()["bytes"] == 0
+
+
+def test_sqlite_store_survives_a_new_cache(tmp_path):
+    store = SQLiteEmbeddingStore(str(tmp_path / "embeddings.db"))
+    CachedEmbeddings(CountingEmbeddings(), "model", store=store).embed_query("a")
+    model = CountingEmbeddings()
+    cache = CachedEmbeddings(model, "model", store=store)
+    assert cache.embed_query("a") == [1.0, 1.0, 2.0, 3.0]
+    assert model.calls == []
+    assert cache.stats()["disk_hits"] == 1
+    # Keys are per model, so another model misses the stored vector
+    assert store.get(embedding_key("other", "a")) is None
+    store.close()
@@ -0,0 +1,164 @@
+import base64
+import json
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+pytest.importorskip("googleapiclient")
+pytest.importorskip("fitz")
+
+import get_email  # noqa: E402
+import googleapiclient.http  # noqa: E402
+
+PDF_BYTES = b"%PDF-1.4 test"
+
+
+def encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode("ascii")
+
+
+MESSAGES = {
+    "m1": {
+        "id": "m1",
+        "payload": {
+            "parts": [
+                {"filename": "inline.pdf", "body": {"data": encode(PDF_BYTES)}},
+                {
+                    "filename": "",
+                    "parts": [
+                        {"filename": "attached.pdf", "body": {"attachmentId": "a1"}},
+                    ],
+                },
+            ]
+        },
+    },
+    "m4": {
+        "id": "m4",
+        "payload": {
+            "parts": [
+                {"filename": "throttled.pdf", "body": {"data": encode(PDF_BYTES)}},
+            ]
+        },
+    },
+    "m3": {
+        "id": "m3",
+        "payload": {
+            "parts": [
+                {"filename": "missing.pdf", "body": {"attachmentId": "gone"}},
+            ]
+        },
+    },
+}
+ATTACHMENTS = {"a1": {"data": encode(PDF_BYTES)}}
+# messages.list is served in two pages linked by nextPageToken
+PAGES = {
+    None: {"messages": [{"id": "m1"}, {"id": "m2"}], "nextPageToken": "page-2"},
+    "page-2": {"messages": [{"id": "m3"}, {"id": "m4"}]},
+}
+
+
+class FakeGmailHandler(BaseHTTPRequestHandler):
+    """Serves messages.list, messages.get and attachments.get from the dicts above.
+
+    Messages listed in server.throttled answer 429 on their first get. Every
+    request path and the messages served successfully are counted on the server.
+    """
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        parts = url.path.strip("/").split("/")
+        # gmail/v1/users/me/messages[/<id>[/attachments/<id>]]
+        body, status = None, 200
+        with self.server.lock:
+            self.server.requests[url.path] += 1
+            if parts[-1] == "messages":
+                page_token = parse_qs(url.query).get("pageToken", [None])[0]
+                body = PAGES.get(page_token)
+            elif parts[-2] == "messages":
+                message_id = parts[-1]
+                if message_id in self.server.throttled:
+                    self.server.throttled.discard(message_id)
+                    status = 429
+                    body = {"error": {"code": 429, "message": "Rate Limit Exceeded"}}
+                else:
+                    body = MESSAGES.get(message_id)
+                    if body is not None:
+                        self.server.served[message_id] += 1
+            elif parts[-2] == "attachments":
+                body = ATTACHMENTS.get(parts[-1])
+        if body is None:
+            status, body = 404, {"error": {"code": 404}}
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def gmail_endpoint(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeGmailHandler)
+    server.lock = threading.Lock()
+    server.requests = Counter()
+    server.served = Counter()
+    server.throttled = {"m4"}
+    # googleapiclient sleeps up to 2**retry seconds before retrying a 429
+    monkeypatch.setattr(googleapiclient.http.time, "sleep", lambda _seconds: None)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(
+        get_email, "GMAIL_API_ENDPOINT", f"http://127.0.0.1:{server.server_port}/"
+    )
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.usefixtures("gmail_endpoint")
+def test_fetch_message_attachments_reports_failed_messages():
+    with get_email.GmailClient("token", max_workers=4) as client:
+        message_ids = [m["id"] for m in get_email.search_emails(client)]
+        attachments, failed = get_email.fetch_message_attachments(client, message_ids)
+
+    assert message_ids == ["m1", "m2", "m3", "m4"]
+    assert sorted(a["filename"] for a in attachments) == [
+        "attached.pdf",
+        "inline.pdf",
+        "throttled.pdf",
+    ]
+    assert all(base64.b64decode(a["data"]) == PDF_BYTES for a in attachments)
+    # m2 does not exist and m3's attachment does not, so both are retried next sync
+    assert failed == {"m2", "m3"}
+
+
+def test_paged_and_throttled_messages_are_fetched_once(gmail_endpoint):
+    with get_email.GmailClient("token", max_workers=4) as client:
+        message_ids = [m["id"] for m in get_email.search_emails(client)]
+        attachments, failed = get_email.fetch_message_attachments(client, message_ids)
+
+    # Both pages are listed, each message once
+    assert message_ids == ["m1", "m2", "m3", "m4"]
+    # m4 was throttled once and retried by the client, not reported as failed
+    assert gmail_endpoint.served == {"m1": 1, "m3": 1, "m4": 1}
+    assert gmail_endpoint.requests["/gmail/v1/users/me/messages/m4"] == 2
+    assert "throttled.pdf" in {a["filename"] for a in attachments}
+    assert failed == {"m2", "m3"}
+
+
+@pytest.mark.usefixtures("gmail_endpoint")
+def test_client_reuses_one_pool_until_closed():
+    client = get_email.GmailClient("token", max_workers=2)
+    executor = client._executor
+    assert client.map(lambda x: x * 2, [1, 2, 3]) == [2, 4, 6]
+    get_email.fetch_attachments(client, ["m1"])
+    assert client._executor is executor
+    client.close()
+    with pytest.raises(RuntimeError):
+        client.map(lambda x: x, [1])
@@ -0,0 +1,120 @@
+from concurrent.futures import Future
+
+import pytest
+
+for module in ("fitz", "langchain_experimental", "supabase", "dotenv"):
+    pytest.importorskip(module)
+
+import load_documents  # noqa: E402
+from load_documents import (  # noqa: E402
+    ingest_reference_book,
+    iter_batches,
+    iter_chunks,
+    iter_extracted_pages,
+    read_checkpoint,
+)
+
+
+class SentenceSplitter:
+    """Stands in for SemanticChunker: one chunk per '.'-terminated sentence."""
+
+    def split_text(self, text):
+        sentences = [s.strip() + "." for s in text.split(".") if s.strip()]
+        if text.strip() and not text.rstrip().endswith("."):
+            sentences[-1] = sentences[-1][:-1]
+        return sentences
+
+
+@pytest.fixture(autouse=True)
+def splitter(monkeypatch):
+    monkeypatch.setattr(load_documents, "_text_splitter", SentenceSplitter())
+
+
+def test_iter_chunks_carries_the_unfinished_chunk_into_the_next_window():
+    pages = ["One. Two. Thr", "ee. Four.", " Five"]
+    assert list(iter_chunks(pages, window_chars=10)) == [
+        "One.",
+        "Two.",
+        "Three.",
+        "Four.",
+        "Five",
+    ]
+
+
+def test_iter_chunks_waits_for_a_full_window():
+    assert list(iter_chunks(["A. B."], window_chars=100)) == ["A.", "B."]
+    assert list(iter_chunks([], window_chars=100)) == []
+
+
+def test_iter_batches():
+    assert list(iter_batches(range(5), 2)) == [[0, 1], [2, 3], [4]]
+    assert list(iter_batches([], 2)) == []
+
+
+class InlineExecutor:
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, fn, *args):
+        self.submitted.append(args)
+        future = Future()
+        future.set_result(fn(*args))
+        return future
+
+
+def test_pages_are_extracted_in_bounded_ranges(monkeypatch):
+    monkeypatch.setattr(
+        load_documents,
+        "extract_pages",
+        lambda path, start, stop: [f"{path}:{i}" for i in range(start, stop)],
+    )
+    executor = InlineExecutor()
+    pages = iter_extracted_pages(executor, "a.pdf", 7, in_flight=2, pages_per_task=2)
+    assert next(pages) == "a.pdf:0"
+    # One range is being read and at most two more are queued behind it
+    assert executor.submitted == [("a.pdf", 0, 2), ("a.pdf", 2, 4), ("a.pdf", 4, 6)]
+    assert list(pages) == [f"a.pdf:{i}" for i in range(1, 7)]
+    assert executor.submitted[-1] == ("a.pdf", 6, 7)
+
+
+@pytest.fixture
+def store(monkeypatch, tmp_path):
+    inserted = []
+    monkeypatch.setattr(load_documents, "INGEST_CHECKPOINT_DIR", str(tmp_path))
+    monkeypatch.setattr(
+        load_documents, "embed_texts", lambda texts: [[float(len(t))] for t in texts]
+    )
+    monkeypatch.setattr(load_documents, "insert_with_retry", inserted.extend)
+    return inserted
+
+
+PAGES = ["S1. S2. S3. S4. S5. S6. S7."]
+CHUNKS = [f"S{i}." for i in range(1, 8)]
+
+
+def test_ingest_inserts_every_chunk_once_with_its_index(store):
+    stats = ingest_reference_book("book.pdf", batch_size=3, pages=PAGES, file_hash="h")
+    assert [row["content"] for row in store] == CHUNKS
+    assert [row["metadata"]["chunk_index"] for row in store] == list(range(7))
+    assert stats == {"pages": 1, "chunks": 7, "rows": 7}
+    assert read_checkpoint("h") == {"chunks": 7, "complete": True}
+    # A completed document is not ingested again
+    assert ingest_reference_book("book.pdf", pages=PAGES, file_hash="h")["rows"] == 0
+
+
+def test_resume_with_a_different_batch_size(store, monkeypatch):
+    def fail_on_second_batch(rows):
+        if store:
+            raise ConnectionError("insert failed")
+        store.extend(rows)
+
+    monkeypatch.setattr(load_documents, "insert_with_retry", fail_on_second_batch)
+    with pytest.raises(ConnectionError):
+        ingest_reference_book("book.pdf", batch_size=3, pages=PAGES, file_hash="h")
+    assert read_checkpoint("h") == {"chunks": 3, "complete": False}
+
+    monkeypatch.setattr(load_documents, "insert_with_retry", store.extend)
+    stats = ingest_reference_book("book.pdf", batch_size=2, pages=PAGES, file_hash="h")
+    assert [row["content"] for row in store] == CHUNKS
+    assert [row["metadata"]["chunk_index"] for row in store] == list(range(7))
+    assert stats["rows"] == 4
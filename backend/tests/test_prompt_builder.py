@@ -0,0 +1,80 @@
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("pydantic")
+
+from prompt_builder import PromptBuilder  # noqa: E402
+
+
+def message(kind: str, content: str):
+    return SimpleNamespace(type=kind, content=content)
+
+
+@pytest.fixture
+def builder():
+    return PromptBuilder(
+        "{question}", budget=1000, max_history_messages=4, max_message_tokens=50
+    )
+
+
+def test_truncate_counts_the_ellipsis(builder):
+    text = "word " * 200
+    for limit in (5, 20, 60):
+        truncated = builder.counter.truncate(text, limit)
+        assert truncated.endswith(" ...")
+        assert builder.counter.count(truncated) <= limit
+
+
+def test_results_table_omits_older_reports_within_limit(builder):
+    rows = [
+        {"Date": f"{day:02d}/01/24", "WBC": 5.0 + day, "HGB": 14.0}
+        for day in range(1, 29)
+    ]
+    limit = 80
+    text = builder._fit_results(rows, limit)
+    lines = text.split("\n")
+    assert builder.counter.count(text) <= limit
+    assert lines[0] == "Date|WBC|HGB"
+    # Newest report first; the marker names what was dropped
+    assert lines[1].startswith("28/01/24")
+    assert lines[-1] == f"... {len(rows) - (len(lines) - 2)} older reports omitted"
+
+
+def test_trend_summary_omits_analytes_within_limit(builder):
+    summary = "\n".join(
+        ["Reports: 3 (2024-01-01 to 2024-03-01)", "analyte|unit|latest"]
+        + [f"A{i}|g/dL|{i}.5" for i in range(40)]
+    )
+    limit = 60
+    text = builder._fit_results(summary, limit)
+    lines = text.split("\n")
+    assert builder.counter.count(text) <= limit
+    assert lines[:3] == [
+        "Reports: 3 (2024-01-01 to 2024-03-01)",
+        "analyte|unit|latest",
+        "A0|g/dL|0.5",
+    ]
+    assert lines[-1] == f"... {40 - (len(lines) - 3)} more analytes omitted"
+
+
+def test_history_marker_counts_against_limit(builder):
+    messages = [
+        message("human" if i % 2 else "ai", f"message number {i} " * 5)
+        for i in range(10)
+    ]
+    limit = 70
+    text = builder._fit_history(messages, limit)
+    lines = text.split("\n")
+    assert builder.counter.count(text) <= limit
+    # Newest messages kept, oldest first, after a note covering everything dropped
+    assert lines[-1].startswith("Human: message number 9")
+    assert lines[0] == f"[{10 - (len(lines) - 1)} earlier messages omitted]"
+
+
+def test_history_reports_messages_beyond_the_window(builder):
+    messages = [message("human", f"hi {i}") for i in range(6)]
+    lines = builder._fit_history(messages, 1000).split("\n")
+    assert lines == ["[2 earlier messages omitted]"] + [
+        f"Human: hi {i}" for i in range(2, 6)
+    ]
@@ -0,0 +1,55 @@
+import pytest
+
+pytest.importorskip("dotenv")
+
+from report_cache import ReportCache, file_key, gmail_key  # noqa: E402
+
+PDF = b"%PDF-1.4 report"
+REPORT = {"Date": "01/01/24", "WBC": "5.5"}
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = ReportCache(str(tmp_path / "reports.sqlite3"))
+    yield cache
+    cache.close()
+
+
+def test_keys_depend_on_the_content():
+    assert file_key(PDF) == file_key(bytes(PDF))
+    assert file_key(PDF) != file_key(PDF + b" edited")
+    assert gmail_key("m1", PDF) != gmail_key("m2", PDF)
+    assert gmail_key("m1", PDF) != gmail_key("m1", PDF + b" edited")
+
+
+def test_file_key_round_trip(cache):
+    assert cache.get(file_key(PDF)) is None
+    cache.put(REPORT, file_key(PDF))
+    assert cache.get(file_key(PDF)) == REPORT
+    # The same upload with different bytes is parsed again
+    assert cache.get(file_key(PDF + b" edited")) is None
+
+
+def test_gmail_key_round_trip(cache):
+    cache.put(REPORT, gmail_key("m1", PDF), file_key(PDF))
+    assert cache.get(gmail_key("m1", PDF)) == REPORT
+    # A changed attachment under the same message misses both keys
+    edited = PDF + b" edited"
+    assert cache.get(gmail_key("m1", edited), file_key(edited)) is None
+
+
+def test_get_falls_back_to_the_file_key(cache):
+    # An uploaded file later arrives by email: the file hash still matches
+    cache.put(REPORT, file_key(PDF))
+    assert cache.get(gmail_key("m1", PDF), file_key(PDF)) == REPORT
+
+
+def test_put_replaces_and_persists(tmp_path):
+    path = str(tmp_path / "reports.sqlite3")
+    cache = ReportCache(path)
+    cache.put(REPORT, file_key(PDF))
+    cache.put({**REPORT, "WBC": "6.0"}, file_key(PDF))
+    cache.close()
+    reopened = ReportCache(path)
+    assert reopened.get(file_key(PDF)) == {**REPORT, "WBC": "6.0"}
+    reopened.close()
@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("pydantic")
+pytest.importorskip("supabase")
+
+from reranking import mmr, rerank, score_gap_cutoff  # noqa: E402
+
+
+def unit(*components):
+    vector = np.asarray(components, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def test_score_gap_cutoff_stops_at_first_large_drop():
+    scores = np.array([0.9, 0.85, 0.5, 0.45])
+    assert score_gap_cutoff(scores, min_score=0.3, max_gap=0.15) == 2
+
+
+def test_score_gap_cutoff_applies_min_score():
+    scores = np.array([0.6, 0.5, 0.2])
+    assert score_gap_cutoff(scores, min_score=0.25, max_gap=1.0) == 2
+    assert score_gap_cutoff(scores, min_score=0.7, max_gap=1.0) == 0
+
+
+def test_score_gap_cutoff_handles_empty_and_single():
+    assert score_gap_cutoff(np.array([]), min_score=0.0, max_gap=0.1) == 0
+    assert score_gap_cutoff(np.array([0.4]), min_score=0.3, max_gap=0.1) == 1
+
+
+def test_mmr_prefers_diverse_candidates():
+    vectors = np.stack([unit(1, 0, 0), unit(1, 0.05, 0), unit(0, 1, 0)])
+    similarities = np.array([0.9, 0.88, 0.7])
+    # Pure relevance keeps the score order
+    assert mmr(similarities, vectors, k=2, lambda_mult=1.0) == [0, 1]
+    # With a diversity weight the near-duplicate loses to the distinct chunk
+    assert mmr(similarities, vectors, k=2, lambda_mult=0.5) == [0, 2]
+
+
+def test_mmr_drops_duplicates():
+    vectors = np.stack([unit(1, 0, 0), unit(1, 0.01, 0), unit(0, 1, 0)])
+    similarities = np.array([0.9, 0.88, 0.7])
+    picked = mmr(similarities, vectors, k=3, lambda_mult=1.0, duplicate_threshold=0.95)
+    assert picked == [0, 2]
+
+
+def test_mmr_skips_candidates_over_budget():
+    vectors = np.stack([unit(1, 0, 0), unit(0, 1, 0), unit(0, 0, 1)])
+    similarities = np.array([0.9, 0.8, 0.7])
+    costs = np.array([5.0, 5.0, 1.0])
+    picked = mmr(similarities, vectors, k=3, lambda_mult=1.0, costs=costs, budget=6.0)
+    assert picked == [0, 2]
+
+
+def test_rerank_cuts_gap_and_diversifies():
+    rows = [
+        {"content": "a", "similarity": 0.80, "embedding": unit(1, 0, 0).tolist()},
+        {"content": "b", "similarity": 0.78, "embedding": unit(1, 0.01, 0).tolist()},
+        {"content": "c", "similarity": 0.75, "embedding": unit(0, 1, 0).tolist()},
+        {"content": "d", "similarity": 0.30, "embedding": unit(0, 0, 1).tolist()},
+    ]
+    picked = rerank(
+        rows,
+        top_k=3,
+        min_score=0.25,
+        score_gap=0.2,
+        lambda_mult=0.7,
+        duplicate_threshold=0.95,
+        context_tokens=None,
+    )
+    assert [r["content"] for r in picked] == ["a", "c"]
+
+
+def test_rerank_without_embeddings_falls_back_to_top_k():
+    rows = [{"content": str(i), "similarity": 0.9 - i * 0.01} for i in range(5)]
+    picked = rerank(rows, top_k=2, min_score=0.0, score_gap=1.0, context_tokens=None)
+    assert [r["content"] for r in picked] == ["0", "1"]
@@ -0,0 +1,87 @@
+import numpy as np
+from response_cache import ResponseCache, depends_on_history, normalize_question
+
+USER, MODEL = "user", "model"
+
+
+def put(cache, response, version="v1", kind="chat", vector=None, context=""):
+    cache.put(USER, kind, version, MODEL, response, vector, context)
+
+
+def get(cache, version="v1", kind="chat", vector=None, context=""):
+    return cache.get(USER, kind, version, MODEL, vector, context)
+
+
+def test_exact_entries_match_only_their_bucket():
+    cache = ResponseCache()
+    put(cache, "analysis", kind="health_analysis")
+    put(cache, "answer", context="history-1")
+    assert get(cache, kind="health_analysis") == "analysis"
+    assert get(cache, context="history-1") == "answer"
+    assert get(cache, context="history-2") is None
+    assert get(cache, version="v2", kind="health_analysis") is None
+
+
+def test_similarity_threshold():
+    cache = ResponseCache(threshold=0.95)
+    put(cache, "answer", vector=[1.0, 0.0])
+    # cos = 0.96 reuses the answer, cos = 0.8 does not
+    assert get(cache, vector=[0.96, np.sqrt(1 - 0.96**2)]) == "answer"
+    assert get(cache, vector=[0.8, 0.6]) is None
+    # Entries with a vector are never returned for exact lookups, and vice versa
+    assert get(cache) is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 2
+
+
+def test_most_similar_entry_wins():
+    cache = ResponseCache(threshold=0.5)
+    put(cache, "first", vector=[1.0, 0.0])
+    put(cache, "second", vector=[0.0, 1.0])
+    assert get(cache, vector=[0.2, 0.9]) == "second"
+
+
+def test_entries_expire_after_ttl():
+    cache = ResponseCache(ttl=60)
+    put(cache, "old", kind="health_analysis")
+    for entry in cache._entries.values():
+        entry.created -= 61
+    assert get(cache, kind="health_analysis") is None
+    assert cache.stats()["entries"] == 0
+    assert cache.stats()["evictions"] == 1
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = ResponseCache(max_entries=2)
+    put(cache, "a", context="a")
+    put(cache, "b", context="b")
+    assert get(cache, context="a") == "a"
+    put(cache, "c", context="c")
+    assert get(cache, context="b") is None
+    assert get(cache, context="a") == "a"
+    assert get(cache, context="c") == "c"
+    assert cache.stats()["evictions"] == 1
+
+
+def test_invalidate_keeps_only_the_current_version():
+    cache = ResponseCache()
+    put(cache, "old", version="v1", kind="health_analysis")
+    put(cache, "new", version="v2", kind="health_analysis")
+    cache.put("other", "health_analysis", "v1", MODEL, "theirs")
+    cache.invalidate(USER, keep_version="v2")
+    assert get(cache, version="v1", kind="health_analysis") is None
+    assert get(cache, version="v2", kind="health_analysis") == "new"
+    assert cache.get("other", "health_analysis", "v1", MODEL) == "theirs"
+    assert cache.stats()["invalidations"] == 1
+
+
+def test_follow_up_questions_depend_on_history():
+    assert depends_on_history("Is that bad?")
+    assert depends_on_history("what about my iron")
+    assert depends_on_history("Why is it so high?")
+    assert not depends_on_history("Is my hemoglobin low?")
+    assert not depends_on_history("What does a high MCV mean?")
+
+
+def test_normalize_question():
+    assert normalize_question("  Is my LDL\nHIGH?") == "is my ldl high?"
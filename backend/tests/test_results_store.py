@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("pydantic")
+pytest.importorskip("supabase")
+
+import results_store  # noqa: E402
+from results_store import (  # noqa: E402
+    load_results_matrix,
+    value_rows,
+    values_matrix,
+)
+
+ANALYTES = ["WBC", "HGB"]
+
+
+def value(report_id, date, analyte, amount):
+    return {
+        "reportId": report_id,
+        "reportDate": date,
+        "analyte": analyte,
+        "value": amount,
+    }
+
+
+def test_values_matrix_has_one_row_per_report_in_date_order():
+    rows = [
+        value(7, "2024-01-01", "HGB", 13.0),
+        value(7, "2024-01-01", "WBC", 5.0),
+        value(3, "2024-02-01", "WBC", 6.0),
+    ]
+    dates, values = values_matrix(rows, ANALYTES)
+    assert list(dates.astype(str)) == ["2024-01-01", "2024-02-01"]
+    # Column j is the series for ANALYTES[j]
+    assert list(values[:, 0]) == [5.0, 6.0]
+    assert values[0, 1] == 13.0
+    assert np.isnan(values[1, 1])
+
+
+def test_values_matrix_without_rows():
+    dates, values = values_matrix([], ANALYTES)
+    assert dates.shape == (0,)
+    assert values.shape == (0, 2)
+
+
+def test_load_results_matrix_reads_blood_test_values(monkeypatch):
+    rows = [value(1, "2024-01-01T00:00:00", "WBC", 5.0)]
+    monkeypatch.setattr(results_store, "_select_all", lambda _build_query: rows)
+    dates, analytes, values = load_results_matrix("user", ANALYTES)
+    assert analytes == ANALYTES
+    assert list(dates.astype(str)) == ["2024-01-01"]
+    assert values[0, 0] == 5.0
+    assert np.isnan(values[0, 1])
+
+
+def test_value_rows_split_a_report_per_analyte():
+    report = {
+        "id": 1,
+        "reportDate": "2024-01-01",
+        "results": {"Date": "01/01/24", "WBC": "5.5", "HGB": "n/a", "PLT": None},
+    }
+    rows = value_rows("user", report)
+    assert [(r["analyte"], r["value"]) for r in rows] == [("WBC", 5.5)]
+    assert rows[0]["reportId"] == 1
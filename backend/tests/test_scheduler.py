@@ -0,0 +1,163 @@
+import asyncio
+
+import pytest
+from scheduler import BACKGROUND, INTERACTIVE, Busy, ProcessSlots, WorkQueue
+
+
+async def settle():
+    # Let granted waiters resume
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_concurrency_is_bounded():
+    async def scenario():
+        queue = WorkQueue("test", concurrency=2)
+        active = peak = 0
+
+        async def job():
+            nonlocal active, peak
+            active += 1
+            peak = max(peak, active)
+            await asyncio.sleep(0.01)
+            active -= 1
+
+        await asyncio.gather(
+            *[queue.run(f"user-{i}", INTERACTIVE, job) for i in range(8)]
+        )
+        return queue, peak
+
+    queue, peak = asyncio.run(scenario())
+    assert peak == 2
+    assert queue.stats()["completed"] == 8
+    assert queue.stats()["running"] == 0
+
+
+def test_interactive_before_background_and_round_robin_across_users():
+    async def scenario():
+        queue = WorkQueue("test", concurrency=1)
+        order = []
+        release = asyncio.Event()
+
+        async def hold():
+            await release.wait()
+
+        async def record(name):
+            order.append(name)
+
+        blocker = asyncio.ensure_future(queue.run("blocker", INTERACTIVE, hold))
+        await settle()
+        jobs = [
+            queue.run("sync", BACKGROUND, record, "sync-1"),
+            queue.run("a", INTERACTIVE, record, "a-1"),
+            queue.run("a", INTERACTIVE, record, "a-2"),
+            queue.run("a", INTERACTIVE, record, "a-3"),
+            queue.run("b", INTERACTIVE, record, "b-1"),
+        ]
+        tasks = [asyncio.ensure_future(job) for job in jobs]
+        await settle()
+        release.set()
+        await asyncio.gather(blocker, *tasks)
+        return order
+
+    assert asyncio.run(scenario()) == ["a-1", "b-1", "a-2", "a-3", "sync-1"]
+
+
+def test_interactive_admission_is_bounded_but_background_always_queues():
+    async def scenario():
+        queue = WorkQueue("test", concurrency=1, max_waiting=1)
+        release = asyncio.Event()
+
+        async def hold():
+            await release.wait()
+
+        running = asyncio.ensure_future(queue.run("a", INTERACTIVE, hold))
+        await settle()
+        waiting = asyncio.ensure_future(queue.run("b", INTERACTIVE, hold))
+        background = [
+            asyncio.ensure_future(queue.run("sync", BACKGROUND, hold)) for _ in range(3)
+        ]
+        await settle()
+        with pytest.raises(Busy):
+            await queue.acquire("c", INTERACTIVE)
+        stats = queue.stats()
+        release.set()
+        await asyncio.gather(running, waiting, *background)
+        return queue, stats
+
+    queue, stats = asyncio.run(scenario())
+    assert stats["interactive"]["waiting"] == 1
+    assert stats["background"]["waiting"] == 3
+    assert queue.rejected == 1
+    assert queue.completed == 5
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def scenario():
+        queue = WorkQueue("test", concurrency=1)
+        release = asyncio.Event()
+        ran = []
+
+        async def hold():
+            await release.wait()
+
+        async def record(name):
+            ran.append(name)
+
+        running = asyncio.ensure_future(queue.run("a", INTERACTIVE, hold))
+        await settle()
+        cancelled = asyncio.ensure_future(queue.run("b", INTERACTIVE, record, "b"))
+        later = asyncio.ensure_future(queue.run("c", INTERACTIVE, record, "c"))
+        await settle()
+        cancelled.cancel()
+        await settle()
+        waiting = queue.stats()["interactive"]["waiting"]
+        release.set()
+        await asyncio.gather(running, later)
+        return queue, waiting, ran
+
+    queue, waiting, ran = asyncio.run(scenario())
+    assert waiting == 1
+    assert ran == ["c"]
+    assert queue.stats()["running"] == 0
+
+
+def test_slot_granted_to_a_cancelled_waiter_is_released():
+    async def scenario():
+        queue = WorkQueue("test", concurrency=1)
+        await queue.acquire("a")
+        waiter = asyncio.ensure_future(queue.acquire("b"))
+        await settle()
+        # Grant the slot to b, then cancel b before it resumes
+        queue._release()
+        waiter.cancel()
+        await settle()
+        running = queue.stats()["running"]
+        await queue.acquire("c")
+        return running
+
+    assert asyncio.run(scenario()) == 0
+
+
+def test_process_slots_bound_holders_and_turn_interactive_away(tmp_path):
+    async def scenario():
+        # Each holder opens its own lock file descriptor, as separate processes do
+        slots = ProcessSlots("pdf", concurrency=1, directory=str(tmp_path), timeout=0.1)
+        order = []
+
+        async def hold(name, priority, seconds):
+            async with slots.slot(priority):
+                order.append(name)
+                await asyncio.sleep(seconds)
+
+        first = asyncio.ensure_future(hold("first", INTERACTIVE, 0.3))
+        await settle()
+        with pytest.raises(Busy):
+            await hold("rejected", INTERACTIVE, 0)
+        # Background work waits for as long as it takes
+        await asyncio.gather(first, hold("background", BACKGROUND, 0))
+        return slots, order
+
+    slots, order = asyncio.run(scenario())
+    assert order == ["first", "background"]
+    assert slots.stats() == {"concurrency": 1, "rejected": 1}
@@ -0,0 +1,94 @@
+import json
+
+import numpy as np
+import pytest
+
+pytest.importorskip("supabase")
+pytest.importorskip("dotenv")
+
+import vector_index  # noqa: E402
+from vector_index import (  # noqa: E402
+    GlobalVectorIndex,
+    UserVectorIndex,
+    add_user_rows,
+    normalize,
+    register_user_index,
+    top_matches,
+)
+
+
+class NoSupabase:
+    def __getattr__(self, name):
+        raise AssertionError(f"unexpected Supabase call: {name}")
+
+
+@pytest.fixture(autouse=True)
+def no_supabase(monkeypatch):
+    monkeypatch.setattr(vector_index, "supabase", NoSupabase())
+    # Small vectors keep the expected similarities readable
+    monkeypatch.setattr(vector_index, "DIMENSIONS", 2)
+
+
+def row(i, embedding, **extra):
+    return {
+        "id": i,
+        "content": f"chunk {i}",
+        "metadata": {},
+        "embedding": embedding,
+        **extra,
+    }
+
+
+def test_top_matches_orders_and_applies_threshold():
+    vectors = normalize([[1, 0], [0.8, 0.6], [0, 1], [0.6, 0.8]])
+    rows = [{"id": i} for i in range(4)]
+    query = normalize([1, 0])[0]
+    matches = top_matches(vectors, rows, query, top_k=3, threshold=0.5)
+    assert [m["id"] for m in matches] == [0, 1, 3]
+    assert matches[1]["similarity"] == pytest.approx(0.8)
+    assert [m["id"] for m in top_matches(vectors, rows, query, 3, 0.7)] == [0, 1]
+    assert top_matches(vectors, rows, query, top_k=0, threshold=0.0) == []
+
+
+def test_user_index_parses_and_appends_rows():
+    index = UserVectorIndex("user-a")
+    # PostgREST returns vectors as strings; rows without an embedding are skipped
+    index.add_rows([row(1, "[3, 4]"), row(2, None)])
+    index.add_rows([row(3, [0.0, 2.0])])
+    assert len(index) == 2
+    matches = index.search(normalize([0, 1])[0], top_k=5, threshold=0.0)
+    assert [m["id"] for m in matches] == [3, 1]
+    assert matches[1]["similarity"] == pytest.approx(0.8)
+    assert np.linalg.norm(matches[1]["embedding"]) == pytest.approx(1.0)
+
+
+def test_written_rows_reach_only_their_users_live_index():
+    index = UserVectorIndex("user-live")
+    register_user_index(index)
+    add_user_rows(
+        [
+            row(1, [1.0, 0.0], clerkUserId="user-live"),
+            row(2, [1.0, 0.0], clerkUserId="user-gone"),
+            row(3, [1.0, 0.0]),
+        ]
+    )
+    assert len(index) == 1
+
+
+def test_global_search_reads_the_loaded_snapshot_only():
+    index = GlobalVectorIndex()
+    index._data = (normalize([[1, 0], [0, 1]]), [{"id": 1}, {"id": 2}])
+    matches = index.search(normalize([1, 0.1])[0], top_k=1, threshold=0.0)
+    assert [m["id"] for m in matches] == [1]
+
+
+def test_global_index_loads_an_existing_cache_without_rebuilding(tmp_path):
+    index = GlobalVectorIndex(directory=str(tmp_path))
+    vectors_path, rows_path = index._paths("v1")
+    np.save(vectors_path, normalize([[1, 0], [0, 1]]))
+    with open(rows_path, "w") as f:
+        json.dump([{"id": 1}, {"id": 2}], f)
+    index._load("v1")
+    assert index.version == "v1"
+    assert len(index) == 2
+    assert isinstance(index._data[0], np.memmap)
@@ -0,0 +1,302 @@
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import weakref
+from typing import Dict, List, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+from numpy.typing import ArrayLike
+from supabase import create_client
+
+load_dotenv()
+
+url = os.environ.get("NEXT_PUBLIC_SUPABASE_URL")
+key = os.environ.get("NEXT_PUBLIC_SUPABASE_ANON_KEY")
+supabase = create_client(url, key)
+
+VECTOR_INDEX_ENABLED = os.environ.get("VECTOR_INDEX_ENABLED", "1") == "1"
+GLOBAL_INDEX_DIR = os.environ.get("GLOBAL_INDEX_DIR", ".vector_index")
+# How often the global corpus version is re-checked against Supabase
+GLOBAL_INDEX_REFRESH_INTERVAL = float(os.environ.get("GLOBAL_INDEX_REFRESH_INTERVAL", "300"))
+# Most recent conversation messages loaded into a user's index; older ones stay in pgvector only
+VECTOR_INDEX_MAX_CONVERSATION = int(os.environ.get("VECTOR_INDEX_MAX_CONVERSATION", "1000"))
+PAGE_SIZE = 1000
+DIMENSIONS = 384
+
+
+def parse_vector(embedding) -> np.ndarray:
+    # PostgREST returns pgvector columns as '[0.1,0.2,...]' strings
+    if isinstance(embedding, str):
+        embedding = json.loads(embedding)
+    return np.asarray(embedding, dtype=np.float32)
+
+
+def normalize(vectors: ArrayLike) -> np.ndarray:
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1.0)
+
+
+def _select_rows(build_query) -> List[Dict]:
+    rows = []
+    start = 0
+    while True:
+        page = build_query().range(start, start + PAGE_SIZE - 1).execute().data
+        rows.extend(page)
+        if len(page) < PAGE_SIZE:
+            return rows
+        start += PAGE_SIZE
+
+
+def top_matches(vectors: np.ndarray, rows: List[Dict], query: np.ndarray, top_k: int, threshold: float) -> List[Dict]:
+    """Rows whose cosine similarity to the normalized query exceeds threshold, best first.
+
+    Results have the same shape as the match_blood_test_data RPC:
+    {id, content, metadata, embedding, similarity}.
+    """
+    if len(rows) == 0 or top_k <= 0:
+        return []
+    scores = vectors @ query
+    k = min(top_k, len(scores))
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    candidates = candidates[np.argsort(-scores[candidates])]
+    return [
+        {**rows[i], "embedding": vectors[i], "similarity": float(scores[i])}
+        for i in candidates if scores[i] > threshold
+    ]
+
+
+class UserVectorIndex:
+    """One user's BloodTestData rows as a normalized float32 matrix.
+
+    Loaded once per chatbot session with the user's documents and their
+    max_conversation most recent conversation messages; add_rows() appends
+    rows as they are written so the index does not have to be reloaded.
+    """
+
+    def __init__(self, clerk_user_id: str, max_conversation: int = VECTOR_INDEX_MAX_CONVERSATION):
+        self.clerk_user_id = clerk_user_id
+        self.max_conversation = max_conversation
+        self._data = (np.empty((0, DIMENSIONS), dtype=np.float32), [])
+        self._lock = threading.Lock()
+
+    def load(self) -> "UserVectorIndex":
+        start = time.perf_counter()
+        rows = _select_rows(lambda: (
+            supabase.table("BloodTestData")
+            .select("id, content, metadata, embedding")
+            .eq("clerkUserId", self.clerk_user_id)
+            .or_("metadata->>source.is.null,metadata->>source.neq.conversation")
+            .order("id")
+        ))
+        # Conversation history grows without bound, so only the newest messages
+        # are kept in memory (served by the partial conversation index)
+        if self.max_conversation > 0:
+            rows += (
+                supabase.table("BloodTestData")
+                .select("id, content, metadata, embedding")
+                .eq("clerkUserId", self.clerk_user_id)
+                .eq("metadata->>source", "conversation")
+                .order("createdAt", desc=True)
+                .order("id", desc=True)
+                .limit(self.max_conversation)
+                .execute()
+                .data
+            )
+        self.add_rows(rows)
+        logging.info(f"Loaded {len(rows)} vectors for user {self.clerk_user_id} in {time.perf_counter() - start:.2f}s")
+        return self
+
+    def add_rows(self, rows: List[Dict]):
+        rows = [r for r in rows if r.get("embedding") is not None]
+        if not rows:
+            return
+        vectors = normalize(np.stack([parse_vector(r["embedding"]) for r in rows]))
+        entries = [{"id": r.get("id"), "content": r["content"], "metadata": r.get("metadata")} for r in rows]
+        with self._lock:
+            # Copy-on-write so searches running concurrently keep a consistent view
+            current_vectors, current_rows = self._data
+            self._data = (np.concatenate([current_vectors, vectors]), current_rows + entries)
+
+    def search(self, query: np.ndarray, top_k: int, threshold: float) -> List[Dict]:
+        vectors, rows = self._data
+        return top_matches(vectors, rows, query, top_k, threshold)
+
+    def __len__(self):
+        return len(self._data[1])
+
+
+class GlobalVectorIndex:
+    """The shared reference corpus, cached on disk and memory-mapped.
+
+    The cache is keyed by a version derived from the global rows' count and
+    latest update, and is rebuilt from Supabase when that version changes.
+    After the first load, start() re-checks the version every
+    refresh_interval in a daemon thread, so search() only ever reads the
+    snapshot already in memory.
+    """
+
+    def __init__(self, directory: str = GLOBAL_INDEX_DIR, refresh_interval: float = GLOBAL_INDEX_REFRESH_INTERVAL):
+        self.directory = directory
+        self.refresh_interval = refresh_interval
+        self.version: Optional[str] = None
+        # (vectors, rows) swapped as one reference so searches never see a mix of versions
+        self._data = (np.empty((0, DIMENSIONS), dtype=np.float32), [])
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def _remote_version(self) -> str:
+        response = (
+            supabase.table("BloodTestData")
+            .select("id, updatedAt", count="exact")
+            .eq("accessType", "global")
+            .order("updatedAt", desc=True)
+            .order("id", desc=True)
+            .limit(1)
+            .execute()
+        )
+        latest = response.data[0] if response.data else {}
+        marker = f"{response.count}:{latest.get('id')}:{latest.get('updatedAt')}"
+        return hashlib.sha256(marker.encode("utf-8")).hexdigest()[:16]
+
+    def _paths(self, version: str):
+        return (os.path.join(self.directory, f"global-{version}.npy"),
+                os.path.join(self.directory, f"global-{version}.json"))
+
+    def _build(self, version: str):
+        start = time.perf_counter()
+        rows = _select_rows(lambda: (
+            supabase.table("BloodTestData")
+            .select("id, content, metadata, embedding")
+            .eq("accessType", "global")
+            .order("id")
+        ))
+        vectors = normalize(np.stack([parse_vector(r["embedding"]) for r in rows])) if rows else np.empty((0, DIMENSIONS), dtype=np.float32)
+        entries = [{"id": r["id"], "content": r["content"], "metadata": r.get("metadata")} for r in rows]
+
+        os.makedirs(self.directory, exist_ok=True)
+        vectors_path, rows_path = self._paths(version)
+        # Write to per-process temporary names first so a crash or a concurrent
+        # build never leaves a partial cache behind
+        suffix = f".{os.getpid()}.tmp"
+        with open(vectors_path + suffix, "wb") as f:
+            np.save(f, vectors)
+        os.replace(vectors_path + suffix, vectors_path)
+        with open(rows_path + suffix, "w") as f:
+            json.dump(entries, f)
+        os.replace(rows_path + suffix, rows_path)
+        for name in os.listdir(self.directory):
+            if name.startswith("global-") and not name.startswith(f"global-{version}.") and not name.endswith(".tmp"):
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(os.path.join(self.directory, name))
+        logging.info(f"Built global vector index {version} with {len(entries)} rows in {time.perf_counter() - start:.2f}s")
+
+    def _load(self, version: str):
+        vectors_path, rows_path = self._paths(version)
+        if not (os.path.exists(vectors_path) and os.path.exists(rows_path)):
+            self._build(version)
+        with open(rows_path) as f:
+            rows = json.load(f)
+        self._data = (np.load(vectors_path, mmap_mode="r"), rows)
+        self.version = version
+
+    def refresh(self):
+        """Reload the cache if the corpus changed. Blocks on Supabase; never call it from a request."""
+        with self._lock:
+            version = self._remote_version()
+            if version != self.version:
+                self._load(version)
+
+    def _refresh_loop(self):
+        while not self._stop.wait(self.refresh_interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                logging.error(f"Error refreshing global vector index: {e}")
+
+    def start(self):
+        """Load the index if needed and keep it fresh in the background."""
+        if self.version is None:
+            self.refresh()
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._refresh_loop, name="global-vector-index", daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def search(self, query: np.ndarray, top_k: int, threshold: float) -> List[Dict]:
+        vectors, rows = self._data
+        return top_matches(vectors, rows, query, top_k, threshold)
+
+    def __len__(self):
+        return len(self._data[1])
+
+
+class HybridIndex:
+    """In-process replacement for the match_blood_test_data RPC for one user."""
+
+    def __init__(self, clerk_user_id: str):
+        self.user = UserVectorIndex(clerk_user_id).load()
+        self.global_index = get_global_index()
+        register_user_index(self.user)
+
+    def search(self, query_vector: List[float], top_k: int, threshold: float, include_global: bool = True) -> List[Dict]:
+        query = normalize(query_vector)[0]
+        results = self.user.search(query, top_k, threshold)
+        if include_global:
+            results += self.global_index.search(query, top_k, threshold)
+        results.sort(key=lambda r: r["similarity"], reverse=True)
+        return results[:top_k]
+
+
+_global_index = None
+_global_lock = threading.Lock()
+
+# Live per-user indexes, so newly written rows can be appended to them
+_user_indexes: "weakref.WeakValueDictionary[str, UserVectorIndex]" = weakref.WeakValueDictionary()
+
+
+def get_global_index() -> GlobalVectorIndex:
+    global _global_index
+    if _global_index is None:
+        with _global_lock:
+            if _global_index is None:
+                _global_index = GlobalVectorIndex()
+    return _global_index
+
+
+def register_user_index(index: UserVectorIndex):
+    _user_indexes[index.clerk_user_id] = index
+
+
+def add_user_rows(rows: List[Dict]):
+    """Append freshly written rows to the indexes of users with a live session."""
+    by_user: Dict[str, List[Dict]] = {}
+    for row in rows:
+        if row.get("clerkUserId"):
+            by_user.setdefault(row["clerkUserId"], []).append(row)
+    for clerk_user_id, user_rows in by_user.items():
+        index = _user_indexes.get(clerk_user_id)
+        if index is not None:
+            index.add_rows(user_rows)
+
+
+def load_hybrid_index(clerk_user_id: str) -> Optional[HybridIndex]:
+    """Build the in-process index for a user, or None to fall back to pgvector."""
+    if not VECTOR_INDEX_ENABLED:
+        return None
+    try:
+        index = HybridIndex(clerk_user_id)
+        index.global_index.start()
+        return index
+    except Exception as e:
+        logging.error(f"Could not build in-process vector index for user {clerk_user_id}, using pgvector: {e}")
+        return None
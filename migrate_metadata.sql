@@ -0,0 +1,14 @@
+-- Upgrade an existing BloodTestData table in place; setup_database.sql drops it.
+-- Safe to run more than once.
+
+-- Older versions stored metadata as a JSON string inside the jsonb column,
+-- which the metadata->> filters and the partial indexes below never match
+UPDATE public."BloodTestData"
+SET metadata = (metadata #>> '{}')::jsonb
+WHERE jsonb_typeof(metadata) = 'string';
+
+-- Last-N conversation history per user, filtered on metadata source
+CREATE INDEX IF NOT EXISTS "BloodTestData_conversation_idx" ON public."BloodTestData"("clerkUserId", "createdAt" DESC, id DESC)
+  WHERE metadata->>'source' = 'conversation';
+-- Reference documents already ingested, looked up by content hash
+CREATE INDEX IF NOT EXISTS "BloodTestData_document_hash_idx" ON public."BloodTestData"((metadata->>'document_hash'));
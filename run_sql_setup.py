@@ -1,4 +1,6 @@
 import os
+import sys
+
 import psycopg2
 from dotenv import load_dotenv
 
@@ -8,6 +10,9 @@ load_dotenv()
 # Get database connection details from environment variables
 db_url = os.getenv('DIRECT_URL')
 
+# Script to run, e.g. migrate_metadata.sql to upgrade an existing table
+sql_path = sys.argv[1] if len(sys.argv) > 1 else 'setup_database.sql'
+
 # Connect to the database
 conn = psycopg2.connect(db_url)
 conn.autocommit = True
@@ -15,7 +20,7 @@ conn.autocommit = True
 try:
     with conn.cursor() as cur:
         # Read the SQL file
-        with open('setup_database.sql', 'r') as file:
+        with open(sql_path, 'r') as file:
             sql_script = file.read()
 
         # Execute the SQL script
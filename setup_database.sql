@@ -2,7 +2,8 @@
 CREATE EXTENSION IF NOT EXISTS vector;
 CREATE EXTENSION IF NOT EXISTS pgcrypto;
 
--- Drop the existing table if it exists
+-- Drop the existing table if it exists.
+-- To keep existing data instead, run migrate_metadata.sql.
 DROP TABLE IF EXISTS public."BloodTestData";
 
 -- Create the BloodTestData table with the correct schema
@@ -20,6 +21,14 @@ CREATE TABLE public."BloodTestData" (
 -- Create indexes
 CREATE INDEX "BloodTestData_clerkUserId_idx" ON public."BloodTestData"("clerkUserId");
 CREATE INDEX "BloodTestData_accessType_idx" ON public."BloodTestData"("accessType");
+-- Last-N conversation history per user, filtered on metadata source
+CREATE INDEX "BloodTestData_conversation_idx" ON public."BloodTestData"("clerkUserId", "createdAt" DESC, id DESC)
+  WHERE metadata->>'source' = 'conversation';
+-- Reference documents already ingested, looked up by content hash
+CREATE INDEX "BloodTestData_document_hash_idx" ON public."BloodTestData"((metadata->>'document_hash'));
+-- Approximate nearest-neighbour search on cosine distance
+CREATE INDEX "BloodTestData_embedding_hnsw_idx" ON public."BloodTestData"
+  USING hnsw (embedding vector_cosine_ops) WITH (m = 16, ef_construction = 64);
 
 -- Grant necessary permissions to the authenticated role
 GRANT USAGE ON SCHEMA public TO authenticated;
@@ -27,36 +36,70 @@ GRANT ALL ON TABLE public."BloodTestData" TO authenticated;
 GRANT USAGE, SELECT ON SEQUENCE public."BloodTestData_id_seq" TO authenticated;
 
 -- Create the match_blood_test_data function
+-- Earlier versions had fewer arguments (ambiguous calls) or a different result type
+DROP FUNCTION IF EXISTS match_blood_test_data(vector, float, int, text, boolean);
+DROP FUNCTION IF EXISTS match_blood_test_data(vector, float, int, text, boolean, int, int);
+
+-- The inner query orders by distance so it can walk the HNSW index and stop
+-- after match_count rows; the similarity threshold is applied afterwards.
+-- ef_search (HNSW) and probes (IVFFlat) trade recall for latency and only
+-- apply to the current transaction. Embeddings are returned so callers can
+-- re-rank candidates (MMR) without embedding them again.
 CREATE OR REPLACE FUNCTION match_blood_test_data(
   query_embedding vector(384),
   match_threshold float,
   match_count int,
   clerk_user_id text,
-  include_global boolean
+  include_global boolean,
+  ef_search int DEFAULT 40,
+  probes int DEFAULT 10
 )
 RETURNS TABLE (
   id bigint,
   content text,
   metadata jsonb,
+  embedding vector(384),
   similarity float
 )
 LANGUAGE plpgsql
 AS $$
 BEGIN
+  PERFORM set_config('hnsw.ef_search', ef_search::text, true);
+  PERFORM set_config('ivfflat.probes', probes::text, true);
+  -- Keep scanning the index until enough rows pass the user/global filter.
+  -- The setting only exists from pgvector 0.8; older versions reject it.
+  BEGIN
+    PERFORM set_config('hnsw.iterative_scan', 'relaxed_order', true);
+  EXCEPTION WHEN others THEN
+    NULL;
+  END;
+
   RETURN QUERY
   SELECT
-    bt.id,
-    bt.content,
-    bt.metadata,
-    1 - (bt.embedding <=> query_embedding) AS similarity
-  FROM
-    public."BloodTestData" bt
+    candidates.id,
+    candidates.content,
+    candidates.metadata,
+    candidates.embedding,
+    candidates.similarity
+  FROM (
+    SELECT
+      bt.id,
+      bt.content,
+      bt.metadata,
+      bt.embedding,
+      1 - (bt.embedding <=> query_embedding) AS similarity
+    FROM
+      public."BloodTestData" bt
+    WHERE
+      (bt."clerkUserId" = clerk_user_id OR (include_global AND bt."accessType" = 'global'))
+    ORDER BY
+      bt.embedding <=> query_embedding
+    LIMIT match_count
+  ) candidates
   WHERE
-    (bt."clerkUserId" = clerk_user_id OR (include_global AND bt."accessType" = 'global'))
-    AND 1 - (bt.embedding <=> query_embedding) > match_threshold
+    candidates.similarity > match_threshold
   ORDER BY
-    bt.embedding <=> query_embedding
-  LIMIT match_count;
+    candidates.similarity DESC;
 END;
 $$;
 